@@ -1,10 +1,18 @@
 import os
+import re
 import sys
 import json
 import time
+import logging
+from contextlib import contextmanager
 from playwright.sync_api import Playwright, sync_playwright, expect
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 from dotenv import load_dotenv
 
+from okofen_artifacts import ArtifactStore, new_run_id
+from okofen_params import load_params, validate as validate_params
+from okofen_resources import ResourceMonitor
+
 # Chargement des variables d'environnement depuis .env (si présent)
 load_dotenv()
 
@@ -12,12 +20,268 @@ OKOFEN_URL = os.getenv("OKOFEN_URL")
 OKOFEN_USER = os.getenv("OKOFEN_USER")
 OKOFEN_PASSWORD = os.getenv("OKOFEN_PASSWORD")
 
+# Cache de session (cookies + storage) entre deux exécutions
+STORAGE_STATE_PATH = os.getenv("STORAGE_STATE_PATH", "/tmp/okofen-storage-state.json")
+STORAGE_STATE_TTL = int(os.getenv("STORAGE_STATE_TTL", "600"))
+
+# Navigation "lean" : ressources inutiles bloquées et attentes ciblées sur les
+# éléments de l'étape suivante au lieu de networkidle (l'UI Pellematic poll
+# en continu, networkidle peut prendre plusieurs secondes)
+LEAN_MODE = os.getenv("OKOFEN_LEAN", "0") == "1"
+BLOCKED_RESOURCE_TYPES = {
+    t.strip()
+    for t in os.getenv("OKOFEN_BLOCK_RESOURCES", "image,font,media").split(",")
+    if t.strip()
+}
+
+# Profil de lancement économe (LXC / petits conteneurs) : un seul processus
+# de rendu, pas de GPU ni de rastériseur logiciel, pas d'isolation de site
+# (une seule origine de confiance : l'interface de la chaudière), images non
+# décodées, tas JavaScript plafonné et fenêtre réduite. Les services
+# d'arrière-plan (réseau, mises à jour de composants, synchro...) sont déjà
+# coupés par les options par défaut de Playwright. Profil optionnel
+# (OKOFEN_LOW_FOOTPRINT=1) : sans lui, lancement par défaut de Playwright.
+LOW_FOOTPRINT = os.getenv("OKOFEN_LOW_FOOTPRINT", "0") == "1"
+JS_HEAP_MB = int(os.getenv("OKOFEN_JS_HEAP_MB", "128"))
+VIEWPORT = os.getenv("OKOFEN_VIEWPORT", "800x600")
+LOW_FOOTPRINT_ARGS = [
+    "--disable-gpu",
+    "--disable-software-rasterizer",
+    "--renderer-process-limit=1",
+    "--disable-site-isolation-trials",
+    "--disable-dev-shm-usage",        # /dev/shm souvent minuscule en conteneur
+    "--blink-settings=imagesEnabled=false",
+    "--disable-notifications",
+    "--disable-speech-api",
+]
+
+# Délais d'attente (ms) : valeurs fixes par défaut, remplacées phase par phase
+# par les délais adaptatifs transmis par app.py (OKOFEN_PHASE_TIMEOUTS ou
+# champ "timeouts" de la requête au driver)
+DEFAULT_WAIT_MS = 30000
+DEFAULT_NAVIGATION_MS = 60000
+# Délai d'affichage du nouveau mode après le clic sur OK (cf. verify_mode)
+VERIFY_TIMEOUT_MS = int(os.getenv("OKOFEN_VERIFY_MS", "5000"))
+_phase_timeouts = {}
+
+
+def set_phase_timeouts(timeouts):
+    """
+    {"session": 8000, "circuit": 5000, ...} ; None ou {} = délais fixes.
+    """
+    global _phase_timeouts
+    _phase_timeouts = {str(k): int(v) for k, v in (timeouts or {}).items()}
+
+
+def phase_timeout(phase: str, default: int = DEFAULT_WAIT_MS):
+    return _phase_timeouts.get(phase, default)
+
+
+# ---------------------------
+# Événements de progression
+# ---------------------------
+
+# Destination des événements (None = désactivés). En CLI : lignes
+# "OKOFEN_EVENT:{json}" sur stdout ; dans le driver persistant : la socket.
+_event_sink = None
+
+
+def set_event_sink(sink):
+    global _event_sink
+    _event_sink = sink
+
+
+def emit_event(event: str, **fields):
+    """
+    Émet un événement structuré (phase_start, phase_end, state, error...).
+    """
+    if _event_sink is None:
+        return
+    _event_sink({"event": event, "ts": round(time.time(), 3), **fields})
+
+
+def print_event(event: dict):
+    print("OKOFEN_EVENT:" + json.dumps(event, ensure_ascii=False), flush=True)
+
+
+# ---------------------------
+# Journalisation
+# ---------------------------
+
+# Niveau sous DEBUG pour le pas-à-pas de la séquence ; désactivé par défaut,
+# un appel filtré ne coûte qu'un test de niveau (pas de formatage)
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+log = logging.getLogger("okofen.playwright")
+
+
+def trace(msg: str, *args):
+    log.log(TRACE, msg, *args, stacklevel=2)
+
 
-def set_mode(page, target: str):
+class EventLogHandler(logging.Handler):
+    """
+    Transmet les enregistrements de journal au destinataire des événements
+    (événement "log") : app.py les reçoit avec la progression, par le même
+    canal (stdout, socket du driver ou boucle asyncio).
+    """
+
+    def emit(self, record):
+        if _event_sink is None:
+            return
+        try:
+            emit_event(
+                "log",
+                level=record.levelname,
+                logger=record.name,
+                func=record.funcName,
+                message=record.getMessage(),
+            )
+        except Exception:
+            self.handleError(record)
+
+
+def configure_logging(level: str = None):
+    """
+    Niveau des journaux "okofen.*" (OKOFEN_LOG_LEVEL : TRACE, DEBUG, INFO...)
+    et transmission en événements "log".
+    """
+    level = (level or os.getenv("OKOFEN_LOG_LEVEL", "INFO")).upper()
+    logger = logging.getLogger("okofen")
+    logger.setLevel(TRACE if level == "TRACE" else getattr(logging, level, logging.INFO))
+    if not any(isinstance(h, EventLogHandler) for h in logger.handlers):
+        logger.addHandler(EventLogHandler())
+
+
+# Lecture de la page du circuit en un seul aller-retour avec le navigateur
+# (au lieu d'un count() / is_visible() par élément). Texte de la page
+# normalisé comme get_by_text (espaces regroupés, sans casse, hors <script> /
+# <style>) pour garder les mêmes correspondances "ModeAuto" / "ModeArrêt".
+PAGE_STATE_JS = """
+() => {
+  const norm = (s) => (s || "").replace(/\\s+/g, " ").trim();
+  const skip = new Set(["SCRIPT", "STYLE", "NOSCRIPT", "TEMPLATE"]);
+  const visible = (el) => !!(el.offsetWidth || el.offsetHeight || el.getClientRects().length);
+  const root = document.body || document.documentElement;
+  const parts = [];
+  let label = null;
+  const walker = document.createTreeWalker(root, NodeFilter.SHOW_TEXT);
+  while (walker.nextNode()) {
+    const node = walker.currentNode;
+    if (node.parentElement && skip.has(node.parentElement.tagName)) continue;
+    parts.push(node.nodeValue);
+    if (label === null && node.nodeValue.includes("Nom du circuit")) label = node.parentElement;
+  }
+  const text = norm(parts.join("")).toLowerCase();
+
+  let circuit = null;
+  if (label !== null) {
+    const after = (el) => norm(el.textContent).replace(/^.*?Nom du circuit/, "").trim();
+    circuit = after(label)
+      || (label.nextElementSibling && norm(label.nextElementSibling.textContent))
+      || (label.parentElement && after(label.parentElement))
+      || null;
+  }
+  const buttons = Array.from(
+    root.querySelectorAll("button, input[type=button], input[type=submit], [role=button]")
+  ).filter(visible).map((el) => norm(el.value || el.textContent));
+  const links = Array.from(root.querySelectorAll("a[href]"))
+    .filter(visible).map((el) => norm(el.textContent));
+
+  return {
+    has_auto: text.includes("modeauto"),
+    has_arret: text.includes("modearrêt"),
+    circuit: circuit,
+    buttons: buttons,
+    links: links,
+  };
+}
+"""
+
+# Boutons de la popup de changement de mode
+POPUP_BUTTONS = ("Auto", "Arrêt", "OK")
+
+
+class PageState:
+    """
+    Photographie de la page du circuit (cf. page_state) : textes de mode,
+    boutons et liens visibles, nom du circuit.
+    """
+
+    def __init__(self, raw: dict):
+        self.has_auto = bool(raw.get("has_auto"))
+        self.has_arret = bool(raw.get("has_arret"))
+        self.circuit = raw.get("circuit")
+        self.buttons = list(raw.get("buttons") or [])
+        self.links = list(raw.get("links") or [])
+
+    @property
+    def mode(self):
+        """
+        "on" | "off" | "unknown" d'après les textes de mode visibles.
+        """
+        if self.has_auto and not self.has_arret:
+            return "on"
+        if self.has_arret and not self.has_auto:
+            return "off"
+        return "unknown"
+
+    @property
+    def popup(self):
+        return any(b in POPUP_BUTTONS for b in self.buttons)
+
+    @property
+    def home(self):
+        return "Home" in self.links
+
+    def describe(self):
+        return {
+            "mode": self.mode,
+            "circuit": self.circuit,
+            "popup": self.popup,
+            "buttons": self.buttons,
+            "links": self.links,
+        }
+
+
+# Vrai quand la page affiche le mode `target` ("on" / "off", mêmes règles
+# que PageState.mode) et que la popup est refermée ; évalué dans la page par
+# wait_for_function
+MODE_IS_JS = """
+({target, popup}) => {
+  const s = (""" + PAGE_STATE_JS + """)();
+  const mode = s.has_auto && !s.has_arret ? "on" : (s.has_arret && !s.has_auto ? "off" : "unknown");
+  return mode === target && !s.buttons.some((b) => popup.includes(b));
+}
+"""
+
+
+def page_state(page):
+    """
+    État de la page du circuit en un seul page.evaluate().
+    """
+    state = PageState(page.evaluate(PAGE_STATE_JS))
+    log.debug("État de la page : %s", state.describe())
+    return state
+
+
+def read_mode(page, state: PageState = None):
+    """
+    Lecture seule du mode du circuit : "on" | "off" | "unknown".
+    """
+    state = state or page_state(page)
+    emit_event("state", status=state.mode)
+    return state.mode
+
+
+def set_mode(page, target: str, state: PageState = None):
     """
     target = "off"  -> Auto -> Arrêt
     target = "on"   -> Arrêt -> Auto
 
+    La décision est prise sur `state` (page_state(page) si absent) : aucun
+    aller-retour avec le navigateur avant les clics.
+
     Retourne un tuple:
         (changed, status_before, status_after)
 
@@ -28,209 +292,770 @@ def set_mode(page, target: str):
         status_before / status_after:
             "on" | "off" | "unknown"
     """
+    if target not in ("on", "off"):
+        raise ValueError(f"Mode inconnu : {target}")
 
-    print("[TRACE] [set_mode] --- DEBUT set_mode ---")
-    # Textes de mode (en haut de page)
-    mode_auto = page.get_by_text("ModeAuto")
-    mode_arret = page.get_by_text("ModeArrêt")
-
-    # On regarde ce qu'on voit actuellement
-    print("[TRACE] [set_mode] Lecture de l'état des modes visibles")
-    has_auto = mode_auto.count() > 0
-    has_arret = mode_arret.count() > 0
+    trace("--- DEBUT set_mode ---")
+    state = state or page_state(page)
+    status_before = read_mode(page, state)
+    log.debug(
+        "a. Mode scan: has_auto=%s, has_arret=%s, target=%s",
+        state.has_auto, state.has_arret, target,
+    )
 
-    # Déduction de l'état actuel
-    if has_auto and not has_arret:
-        status_before = "on"
-    elif has_arret and not has_auto:
-        status_before = "off"
-    else:
-        status_before = "unknown"
+    if status_before == target:
+        log.debug("b. Mode déjà %s (aucune action)", "en Auto" if target == "on" else "en Arrêt")
+        return False, status_before, target
 
-    print(f"[DEBUG] [set_mode] a. Mode scan: has_auto={has_auto}, has_arret={has_arret}, target={target}")
-    changed = False
-    status_after = status_before
+    if status_before == "unknown":
+        log.debug("e. Impossible de déterminer le mode actuel (target=%s), aucune action", target)
+        return False, status_before, "unknown"
 
     if target == "off":
-        print("[TRACE] [set_mode] Debut branche target=off")
-        # Si on voit déjà "ModeArrêt" sans "ModeAuto", on considère qu'on est déjà à l'arrêt
-        if has_arret and not has_auto:
-            print("[DEBUG] [set_mode] b. Mode déjà en Arrêt (aucune action)")
-            changed = False
-            status_after = "off"
-            return changed, status_before, status_after
-
-        # Si on voit "ModeAuto", on peut basculer vers Arrêt
-        if has_auto:
-            print("[TRACE] [set_mode] Click pour passer de Auto à Arrêt")
-            expect(mode_auto).to_be_visible(timeout=30000)
-            mode_auto.click()
-            page.get_by_role("button", name="Arrêt", exact=True).click()
-            print("[DEBUG] [set_mode] d. Passage en mode Arrêt demandé")
-            changed = True
-            status_after = "off"
-            return changed, status_before, status_after
-
-        # Cas indéterminé
-        print("[DEBUG] [set_mode] e. Impossible de déterminer le mode actuel (target=off), aucune action")
-        changed = False
-        status_after = "unknown"
-        return changed, status_before, status_after
-
-    elif target == "on":
-        print("[TRACE] [set_mode] Debut branche target=on")
-        # Si on voit déjà "ModeAuto" sans "ModeArrêt", on considère que c'est déjà allumé
-        if has_auto and not has_arret:
-            print("[DEBUG] [set_mode] f. Mode déjà en Auto (aucune action)")
-            changed = False
-            status_after = "on"
-            return changed, status_before, status_after
-
-        # Si on voit "ModeArrêt", on peut basculer vers Auto
-        if has_arret:
-            print("[TRACE] [set_mode] Click pour passer de Arrêt à Auto")
-            expect(mode_arret).to_be_visible(timeout=30000)
-            mode_arret.click()
-            page.get_by_role("button", name="Auto").click()
-            print("[DEBUG] [set_mode] h. Passage en mode Auto demandé")
-            changed = True
-            status_after = "on"
-            return changed, status_before, status_after
-
-        # Cas indéterminé
-        print("[DEBUG] [set_mode] i. Impossible de déterminer le mode actuel (target=on), aucune action")
-        changed = False
-        status_after = "unknown"
-        return changed, status_before, status_after
-
+        mode_text, label = page.get_by_text("ModeAuto"), "Arrêt"
+        button = page.get_by_role("button", name="Arrêt", exact=True)
     else:
-        raise ValueError(f"Mode inconnu : {target}")
+        mode_text, label = page.get_by_text("ModeArrêt"), "Auto"
+        button = page.get_by_role("button", name="Auto")
 
+    # Popup déjà ouverte : bouton du mode cible directement
+    if label not in state.buttons:
+        trace("Click sur le mode actuel (%s)", status_before)
+        # click() attend que le texte soit visible : pas d'expect préalable
+        mode_text.click(timeout=phase_timeout("set_mode"))
+    button.click()
+    log.debug("d. Passage en mode %s demandé", label)
+    return True, status_before, target
 
-def run(playwright: Playwright, target_mode: str):
+
+def verify_mode(page, target: str):
     """
-    Exécute la séquence Playwright pour atteindre le mode demandé.
+    Après le clic sur OK : attend que la page affiche réellement le mode
+    `target`. La condition est réévaluée dans la page à chaque rendu
+    (polling "raf") et survit à un rechargement déclenché par OK : pas
+    d'attente fixe, au plus phase_timeout("verify") (OKOFEN_VERIFY_MS).
 
-    Retourne:
-        (status_before, status_after, changed)
+    Retourne (verified, mode affiché, durée de l'attente en ms).
     """
-    print(f"[TRACE] [run] === DEBUT run() pour target_mode={target_mode} ===")
-    print("[TRACE] [run] Vérification des credentials en environnement")
-    if not OKOFEN_USER or not OKOFEN_PASSWORD:
-        raise RuntimeError(
-            "Les variables d'environnement OKOFEN_USER et OKOFEN_PASSWORD "
-            "doivent être définies (voir fichier .env)."
+    trace("Vérification de l'affichage du mode %s", target)
+    t0 = time.perf_counter()
+    try:
+        page.wait_for_function(
+            MODE_IS_JS,
+            arg={"target": target, "popup": list(POPUP_BUTTONS)},
+            polling="raf",
+            timeout=phase_timeout("verify", VERIFY_TIMEOUT_MS),
         )
+        verified, status = True, target
+    except PlaywrightTimeoutError:
+        verified, status = False, None
+    verify_ms = round((time.perf_counter() - t0) * 1000, 1)
+    if not verified:
+        try:
+            status = page_state(page).mode
+        except Exception as e:
+            log.debug("Relecture du mode impossible : %s", e)
+            status = "unknown"
+        log.warning("Mode %s non confirmé après %s ms (affiché : %s)", target, verify_ms, status)
+    emit_event("state", status=status)
+    return verified, status, verify_ms
+
+
+def launch_options():
+    """
+    Options de chromium.launch() (API sync et async), cf. LOW_FOOTPRINT.
+    """
+    if not LOW_FOOTPRINT:
+        return {"headless": True}
+    args = list(LOW_FOOTPRINT_ARGS)
+    if JS_HEAP_MB > 0:
+        args.append(f"--js-flags=--max-old-space-size={JS_HEAP_MB}")
+    return {"headless": True, "args": args}
 
-    print("[TRACE] [run] Lancement du navigateur Playwright Chromium")
-    browser = playwright.chromium.launch(headless=True)
-    context = browser.new_context(
+
+def _viewport():
+    width, _, height = VIEWPORT.lower().partition("x")
+    return {"width": int(width), "height": int(height)}
+
+
+def new_context(browser, **kwargs):
+    """
+    Crée un BrowserContext configuré pour l'interface Pellematic (langue FR).
+    """
+    if LOW_FOOTPRINT:
+        kwargs.setdefault("viewport", _viewport())
+        kwargs.setdefault("device_scale_factor", 1)
+    return browser.new_context(
         locale="fr-FR",
         timezone_id="Europe/Paris",
         extra_http_headers={
             "Accept-Language": "fr-FR,fr;q=0.9,en;q=0.8"
         },
+        **kwargs,
     )
-    page = context.new_page()
 
-    print("[TRACE] [run] Set des timeouts par défaut")
-    # Timeouts généraux
-    page.set_default_timeout(30000)              # 30 s pour clics / fill / goto...
-    page.set_default_navigation_timeout(60000)   # 60 s pour les navigations
 
+def _block_assets(route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        route.abort()
+    else:
+        route.continue_()
+
+
+def enable_lean_routing(context):
+    """
+    Intercepte les requêtes du contexte et abandonne les types de ressources
+    dont on n'a pas besoin (images, polices... cf. OKOFEN_BLOCK_RESOURCES).
+    """
+    if LEAN_MODE and BLOCKED_RESOURCE_TYPES:
+        trace("Mode lean : blocage de %s", sorted(BLOCKED_RESOURCE_TYPES))
+        context.route("**/*", _block_assets)
+
+
+def check_credentials():
+    trace("Vérification des credentials en environnement")
+    if not OKOFEN_USER or not OKOFEN_PASSWORD:
+        raise RuntimeError(
+            "Les variables d'environnement OKOFEN_USER et OKOFEN_PASSWORD "
+            "doivent être définies (voir fichier .env)."
+        )
+
+
+def login(page):
     # Page de login
-    print("[TRACE] [run] Navigation vers la page de login")
+    trace("Navigation vers la page de login")
     page.goto(f"{OKOFEN_URL}/login.cgi", wait_until="domcontentloaded")
 
     # On attend tranquillement la ligne "Francais"
-    print("[TRACE] [run] Attente de la ligne de choix de langue 'Francais'\n")
-    expect(page.get_by_role("row", name="Francais")).to_be_visible(timeout=30000)
+    trace("Attente de la ligne de choix de langue 'Francais'")
+    expect(page.get_by_role("row", name="Francais")).to_be_visible(
+        timeout=phase_timeout("session")
+    )
 
-    print("[TRACE] [run] Remplissage des identifiants utilisateur")
+    trace("Remplissage des identifiants utilisateur")
     page.get_by_role("textbox", name="Identifiant:").fill(OKOFEN_USER)
     page.get_by_role("textbox", name="Mot de passe:").fill(OKOFEN_PASSWORD)
-    print("[TRACE] [run] Clic sur le bouton 'Accès'")
-    page.get_by_role("button", name="Accès").click()
+    trace("Clic sur le bouton 'Accès'")
+    if LEAN_MODE:
+        # Il suffit que la réponse du POST de login (cookie de session) soit reçue
+        with page.expect_navigation(wait_until="commit"):
+            page.get_by_role("button", name="Accès").click()
+    else:
+        page.get_by_role("button", name="Accès").click()
+        trace("Attente du réseau après login (networkidle)")
+        page.wait_for_load_state("networkidle")
 
-    print("[TRACE] [run] Attente du réseau après login (networkidle)")
-    page.wait_for_load_state("networkidle")
 
+def storage_state_path(boiler_id: str = None):
+    """
+    Fichier du cache de session d'une chaudière (okofen_targets) :
+    STORAGE_STATE_PATH pour la chaudière par défaut, suffixé sinon.
+    """
+    if not STORAGE_STATE_PATH or boiler_id in (None, "default"):
+        return STORAGE_STATE_PATH
+    root, ext = os.path.splitext(STORAGE_STATE_PATH)
+    return f"{root}-{boiler_id}{ext}"
+
+
+def load_storage_state(path: str = None):
+    """
+    Retourne le storage_state en cache (dict) s'il existe et n'a pas expiré,
+    sinon None.
+    """
+    path = path or STORAGE_STATE_PATH
+    if not path or STORAGE_STATE_TTL <= 0:
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("expires_at", 0) <= time.time():
+        trace("Cache de session expiré")
+        return None
+    return cached.get("state")
+
+
+def write_storage_state(state: dict, path: str = None):
+    """
+    Écrit un storage_state sur disque (écriture atomique, 0600 car il
+    contient le cookie de session).
+    """
+    path = path or STORAGE_STATE_PATH
+    if not path or STORAGE_STATE_TTL <= 0:
+        return
+    cached = {
+        "expires_at": time.time() + STORAGE_STATE_TTL,
+        "state": state,
+    }
+    tmp_path = path + ".tmp"
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(cached, f)
+        os.replace(tmp_path, path)
+        trace("Cache de session enregistré")
+    except OSError as e:
+        log.debug("Impossible d'écrire le cache de session : %s", e)
+
+
+def save_storage_state(context):
+    """
+    Écrit le storage_state du contexte dans le cache de session.
+    """
+    if not STORAGE_STATE_PATH or STORAGE_STATE_TTL <= 0:
+        return
+    write_storage_state(context.storage_state())
+
+
+def is_login_page(page):
+    return (
+        "login.cgi" in page.url
+        or page.get_by_role("textbox", name="Identifiant:").count() > 0
+    )
+
+
+def goto_home(page):
     # Accueil / page principale
-    print("[TRACE] [run] Navigation vers la page d'accueil")
+    trace("Navigation vers la page d'accueil")
     page.goto(f"{OKOFEN_URL}/", wait_until="domcontentloaded")
-    print("[TRACE] [run] Attente de networkidle sur la page d'accueil")
-    page.wait_for_load_state("networkidle")
+    if LEAN_MODE:
+        # Prochaine étape : lien du circuit, ou formulaire si la session a expiré
+        trace("Attente du lien 'Chf1 Chauffage' ou du formulaire de login")
+        chf_link = page.get_by_role("link", name="Chf1 Chauffage")
+        login_box = page.get_by_role("textbox", name="Identifiant:")
+        expect(chf_link.or_(login_box).first).to_be_visible(timeout=phase_timeout("session"))
+    else:
+        trace("Attente de networkidle sur la page d'accueil")
+        page.wait_for_load_state("networkidle")
 
+
+def open_session(page, context):
+    """
+    Amène la page sur l'accueil avec une session valide.
+    Tente d'abord la session en cache (cookies du contexte) et ne repasse
+    par login.cgi que si la chaudière redirige vers la page de login.
+
+    Retourne "hit" (session réutilisée) ou "miss" (login effectué).
+    """
+    if context.cookies():
+        trace("Tentative avec la session en cache")
+        goto_home(page)
+        if not is_login_page(page):
+            trace("Session en cache valide (hit)")
+            return "hit"
+        trace("Redirection vers login, session expirée (miss)")
+
+    # Identifiants et cookies de session hors de la trace Playwright
+    with tracing_paused(context):
+        login(page)
+        save_storage_state(context)
+    goto_home(page)
+    return "miss"
+
+
+def open_circuit(page):
     # Lien "Chf1 Chauffage" avec timeout étendu
-    print("[TRACE] [run] Recherche et clic sur le lien 'Chf1 Chauffage'")
-    chf_link = page.get_by_role("link", name="Chf1 Chauffage")
-    expect(chf_link).to_be_visible(timeout=30000)
-    chf_link.click()
+    trace("Recherche et clic sur le lien 'Chf1 Chauffage'")
+    # click() attend que le lien soit visible : pas d'expect préalable
+    page.get_by_role("link", name="Chf1 Chauffage").click(timeout=phase_timeout("circuit"))
 
     # Attendre la page mode chauffage
-    print("[TRACE] [run] Attente de la page de configuration de circuit chauffage")
-    expect(page.get_by_text("Nom du circuitChauffage")).to_be_visible(timeout=30000)
+    trace("Attente de la page de configuration de circuit chauffage")
+    expect(page.get_by_text("Nom du circuitChauffage")).to_be_visible(
+        timeout=phase_timeout("circuit")
+    )
 
-    print("[TRACE] [run] APPEL à set_mode")
-    changed, status_before, status_after = set_mode(page, target_mode)
 
-    # Valider uniquement si on a vraiment demandé un changement
-    if changed:
-        print("[TRACE] [run] Validation changement de mode (clic sur OK)")
-        expect(page.get_by_role("button", name="OK")).to_be_visible(timeout=30000)
-        page.get_by_role("button", name="OK").click()
-    else:
-        print("[TRACE] [run] Aucun changement de mode demandé, pas de clic sur OK")
+class PhaseTimer:
+    """
+    Chronomètre des phases d'une exécution (time.perf_counter), en ms.
+    Les durées sont écrites dans details["phases"] pour le résumé, et la
+    phase où l'exception est levée dans details["failed_phase"].
+    `fields` est ajouté aux événements de phase (ex: target=... en batch).
+    """
+
+    def __init__(self, details: dict = None, **fields):
+        if details is None:
+            details = {}
+        self.details = details
+        self.phases = details.setdefault("phases", {})
+        self.fields = fields
+
+    @contextmanager
+    def phase(self, name: str):
+        emit_event("phase_start", phase=name, **self.fields)
+        t0 = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            # Phase la plus interne : les phases englobantes ne l'écrasent pas
+            self.details.setdefault("failed_phase", name)
+            raise
+        finally:
+            self.phases[name] = round((time.perf_counter() - t0) * 1000, 1)
+            emit_event("phase_end", phase=name, ms=self.phases[name], **self.fields)
+
+
+# ---------------------------
+# Captures d'échec (okofen_artifacts.py)
+# ---------------------------
+
+# "failure" : trace Playwright enregistrée en continu (chunk par exécution),
+# écrite sur disque avec capture d'écran et DOM seulement si l'exécution
+# échoue ou dure plus de OKOFEN_CAPTURE_SLOW_MS (0 = jamais) ; "always" :
+# chaque exécution ; "off" : rien
+CAPTURE_MODE = os.getenv("OKOFEN_CAPTURE", "failure")
+CAPTURE_SLOW_MS = int(os.getenv("OKOFEN_CAPTURE_SLOW_MS", "0"))
+artifacts = ArtifactStore()
+
 
-    # Retour éventuel à Home si dispo
+def capture_enabled():
+    return CAPTURE_MODE != "off"
+
+
+def start_tracing(context):
+    """
+    Démarre l'enregistrement de la trace (DOM et réseau, sans film
+    d'écrans) pour toute la durée de vie du contexte.
+    """
+    if capture_enabled():
+        context.tracing.start(snapshots=True, screenshots=False)
+
+
+@contextmanager
+def tracing_paused(context):
+    """
+    Suspend la trace pendant le login : saisie du mot de passe, POST de
+    login et cookies reçus n'y figurent jamais. Le chunk en cours est
+    abandonné puis un nouveau est ouvert (même en cas d'échec, pour que
+    run_captured puisse le clore).
+    """
+    if not capture_enabled():
+        yield
+        return
     try:
-        print("[TRACE] [run] Vérification du lien Home et retour éventuel")
-        home_link = page.get_by_role("link", name="Home")
-        if home_link.count() > 0:
-            home_link.click()
-            print("[TRACE] [run] Retour Home effectué")
+        context.tracing.stop_chunk()
     except Exception as e:
-        print(f"[DEBUG] [run] Impossible de cliquer sur Home : {e}")
+        log.debug("Trace non suspendue : %s", e)
+    try:
+        yield
+    finally:
+        try:
+            context.tracing.start_chunk()
+        except Exception as e:
+            log.debug("Trace non reprise : %s", e)
 
-    print("[TRACE] [run] Fermeture du contexte et du navigateur")
-    context.close()
-    browser.close()
 
-    return status_before, status_after, changed
+def should_keep(ok: bool, duration_ms: float):
+    if CAPTURE_MODE == "always":
+        return True
+    return capture_enabled() and (
+        not ok or (CAPTURE_SLOW_MS > 0 and duration_ms >= CAPTURE_SLOW_MS)
+    )
 
 
-if __name__ == "__main__":
-    start = time.time()
-    mode = "off"
+def add_artifact(details: dict, name: str):
+    details.setdefault("artifacts", []).append(name)
+    artifacts.enforce_budget(keep=details["run_id"])
+
+
+def capture_page(page, details: dict):
+    """
+    Capture d'écran et DOM de la page, à appeler avant sa fermeture.
+    """
+    if not capture_enabled():
+        return
+    run_id = details.setdefault("run_id", new_run_id())
+    grabbers = (
+        ("screenshot.png", lambda: page.screenshot(full_page=True, timeout=5000)),
+        ("dom.html", page.content),
+    )
+    for name, grab in grabbers:
+        try:
+            artifacts.write(run_id, name, grab())
+            add_artifact(details, name)
+        except Exception as e:
+            log.debug("Capture %s impossible : %s", name, e)
+
+
+def run_captured(context, target_mode: str, details: dict, changes=None):
+    """
+    run_in_context (ou run_params_in_context si target_mode = "params")
+    dans un chunk de trace : le chunk n'est écrit (trace.zip) que si
+    l'exécution échoue ou est trop lente.
+    """
+    if capture_enabled():
+        context.tracing.start_chunk()
+    t0 = time.perf_counter()
     ok = False
-    error_msg = ""
-    status_before = "unknown"
-    status_after = "unknown"
-    changed = None
+    try:
+        if target_mode == "params":
+            result = run_params_in_context(context, changes, details)
+            ok = all(r["ok"] for r in result)
+        else:
+            result = run_in_context(context, target_mode, details)
+            ok = details.get("verified") is not False
+        return result
+    finally:
+        if capture_enabled():
+            try:
+                if should_keep(ok, (time.perf_counter() - t0) * 1000):
+                    run_id = details.setdefault("run_id", new_run_id())
+                    path = artifacts.path(run_id, "trace.zip")
+                    context.tracing.stop_chunk(path=path)
+                    # Cookies / en-têtes d'authentification des requêtes suivantes
+                    artifacts.redact_trace(path)
+                    add_artifact(details, "trace.zip")
+                else:
+                    context.tracing.stop_chunk()
+            except Exception as e:
+                log.debug("Trace Playwright non enregistrée : %s", e)
+
+
+@contextmanager
+def open_page(context, details: dict):
+    """
+    Nouvelle page avec les délais par défaut. Si le bloc échoue (ou dure
+    trop longtemps), capture d'écran et DOM avant la fermeture de la page.
+    """
+    t0 = time.perf_counter()
+    page = context.new_page()
+    try:
+        trace("Set des timeouts par défaut")
+        # Timeouts généraux
+        page.set_default_timeout(
+            max(_phase_timeouts.values(), default=DEFAULT_WAIT_MS)
+        )                                            # clics / fill...
+        page.set_default_navigation_timeout(
+            phase_timeout("session", DEFAULT_NAVIGATION_MS)
+        )                                            # navigations
+        yield page
+    except Exception:
+        # Page telle qu'au moment de l'échec
+        capture_page(page, details)
+        raise
+    finally:
+        # Exécution réussie mais lente (ou mode "always")
+        if "artifacts" not in details and should_keep(True, (time.perf_counter() - t0) * 1000):
+            capture_page(page, details)
+        page.close()
+
 
-    print("[TRACE] [main] DEBUT main, parsing des arguments éventuels")
-    if len(sys.argv) > 1:
-        arg = sys.argv[1].lower()
-        if arg in ("off", "arrete", "arrêt", "eteindre", "éteindre", "stop", "0"):
-            mode = "off"
-        elif arg in ("on", "allume", "allumer", "auto", "start", "1"):
-            mode = "on"
+def run_in_context(context, target_mode: str, details: dict = None):
+    """
+    Exécute la séquence (login, circuit, mode) dans un BrowserContext existant.
+    Utilisé tel quel par le driver persistant (okofen_driver.py).
+
+    target_mode = "status" lit le mode sans rien modifier.
+
+    Si `details` est fourni, il est complété avec les informations
+    d'exécution destinées au résumé (ex: "session_cache", "phases",
+    "verified" / "verify_ms" pour on / off, et "artifacts" si la page a été
+    capturée après un échec).
+
+    Retourne:
+        (status_before, status_after, changed)
+    """
+    if details is None:
+        details = {}
+    timer = PhaseTimer(details)
+    with open_page(context, details) as page:
+        with timer.phase("session"):
+            session_cache = open_session(page, context)
+        details["session_cache"] = session_cache
+        details["lean"] = LEAN_MODE
+        with timer.phase("circuit"):
+            open_circuit(page)
+
+        if target_mode == "status":
+            # Lecture seule : aucun clic sur la page du circuit
+            with timer.phase("read_mode"):
+                status = read_mode(page)
+            log.debug("Lecture seule du mode : %s", status)
+            return status, status, False
+
+        trace("APPEL à set_mode")
+        with timer.phase("set_mode"):
+            # Une seule lecture de la page pour set_mode et le retour Home
+            state = page_state(page)
+            changed, status_before, status_after = set_mode(page, target_mode, state)
+
+        # Valider uniquement si on a vraiment demandé un changement
+        if changed:
+            trace("Validation changement de mode (clic sur OK)")
+            with timer.phase("confirm"):
+                # click() attend l'apparition du bouton dans la popup
+                page.get_by_role("button", name="OK").click(timeout=phase_timeout("confirm"))
+            # status_after = mode réellement affiché, pas celui demandé
+            with timer.phase("verify"):
+                verified, status_after, verify_ms = verify_mode(page, target_mode)
+            details["verified"] = verified
+            details["verify_ms"] = verify_ms
+            if not verified:
+                # Changement silencieusement refusé : page telle quelle
+                capture_page(page, details)
         else:
-            print("Usage : python Okofen_Playwright.py [on|off]")
-            sys.exit(1)
+            trace("Aucun changement de mode demandé, pas de clic sur OK")
+            # Mode lu sur la page (déjà le bon), ou indéterminé
+            details["verified"] = status_after == target_mode
+            details["verify_ms"] = 0.0
+
+        # Retour éventuel à Home si dispo
+        try:
+            trace("Vérification du lien Home et retour éventuel")
+            with timer.phase("home"):
+                if state.home:
+                    page.get_by_role("link", name="Home").click()
+                    trace("Retour Home effectué")
+        except Exception as e:
+            log.debug("Impossible de cliquer sur Home : %s", e)
+
+    return status_before, status_after, changed
+
+
+# ---------------------------
+# Écriture de paramètres (okofen_params.py, POST /params)
+# ---------------------------
+
+# Texte affiché après chaque libellé, en un seul aller-retour : nœud texte
+# égal au libellé (à défaut, commençant par lui), puis reste de son élément
+# ou élément suivant (même principe que "Nom du circuit" de PAGE_STATE_JS)
+_READ_FIELDS_FN = """
+(labels) => {
+  const norm = (s) => (s || "").replace(/\\s+/g, " ").trim();
+  const skip = new Set(["SCRIPT", "STYLE", "NOSCRIPT", "TEMPLATE"]);
+  const root = document.body || document.documentElement;
+  const nodes = [];
+  const walker = document.createTreeWalker(root, NodeFilter.SHOW_TEXT);
+  while (walker.nextNode()) {
+    const node = walker.currentNode;
+    if (node.parentElement && !skip.has(node.parentElement.tagName)) nodes.push(node);
+  }
+  const values = {};
+  for (const label of labels) {
+    const node = nodes.find((n) => norm(n.nodeValue) === label)
+      || nodes.find((n) => norm(n.nodeValue).startsWith(label));
+    if (!node) {
+      values[label] = null;
+      continue;
+    }
+    const after = (el) => {
+      const text = norm(el.textContent);
+      const i = text.indexOf(label);
+      return i < 0 ? "" : text.slice(i + label.length).trim();
+    };
+    const el = node.parentElement;
+    values[label] = after(el)
+      || (el.nextElementSibling && norm(el.nextElementSibling.textContent))
+      || (el.parentElement && after(el.parentElement))
+      || null;
+  }
+  return values;
+}
+"""
+
+READ_FIELDS_JS = _READ_FIELDS_FN
+
+# Vrai quand le champ affiche la valeur attendue (nombre ou libellé de
+# choix), évalué dans la page par wait_for_function
+FIELD_MATCHES_JS = """
+({label, number, choice}) => {
+  const text = (""" + _READ_FIELDS_FN + """)([label])[label];
+  if (text === null) return false;
+  if (number !== null) {
+    const m = text.match(/-?\\d+(?:[.,]\\d+)?/);
+    return !!m && Math.abs(parseFloat(m[0].replace(",", ".")) - number) < 1e-6;
+  }
+  const t = text.toLowerCase();
+  const c = choice.toLowerCase();
+  return t === c || t.startsWith(c + " ");
+}
+"""
+
+
+def open_param_page(page, cfg: dict, fallback_ready: str):
+    """
+    Depuis l'accueil, ouvre la page `cfg` ({"link", "ready"}) et attend son
+    texte caractéristique (à défaut, le libellé d'un de ses champs).
+    """
+    trace("Ouverture de la page %s", cfg["link"])
+    # click() attend que le lien soit visible : pas d'expect préalable
+    page.get_by_role("link", name=cfg["link"]).click(timeout=phase_timeout("circuit"))
+    expect(page.get_by_text(cfg.get("ready") or fallback_ready).first).to_be_visible(
+        timeout=phase_timeout("circuit")
+    )
+
+
+def write_field(page, param, value):
+    """
+    Ouvre la popup du champ, saisit la valeur (ou choisit le bouton) et
+    valide par OK.
+    """
+    trace("Écriture de %s = %s", param.name, value)
+    row = page.get_by_text(re.compile("^" + re.escape(param.label))).first
+    row.click(timeout=phase_timeout("set_mode"))
+    if param.kind == "number":
+        box = page.get_by_role("spinbutton").or_(page.get_by_role("textbox")).first
+        box.fill(param.input_text(value), timeout=phase_timeout("set_mode"))
+    else:
+        page.get_by_role("button", name=param.input_text(value), exact=True).click(
+            timeout=phase_timeout("set_mode")
+        )
+    page.get_by_role("button", name="OK").click(timeout=phase_timeout("confirm"))
+
+
+def verify_field(page, param, value):
+    """
+    Attend (dans la page, sans aller-retour par essai) que le champ affiche
+    la nouvelle valeur. Lève une erreur Playwright au-delà du délai.
+    """
+    page.wait_for_function(
+        FIELD_MATCHES_JS,
+        arg={
+            "label": param.label,
+            "number": value if param.kind == "number" else None,
+            "choice": None if param.kind == "number" else param.input_text(value),
+        },
+        polling=100,
+        timeout=phase_timeout("confirm"),
+    )
+
+
+def write_params(page, pages: dict, params: dict, changes, details: dict, timer):
+    """
+    Applique `changes` ([{"field", "value"}] validés) depuis l'accueil d'une
+    session ouverte : chaque page n'est visitée qu'une fois, chaque champ est
+    vérifié après écriture. Un champ en échec n'arrête pas les suivants.
+
+    Retourne un résultat par champ : {"field", "value", "before", "after",
+    "changed", "verified", "ok", "ms"} (+ "error").
+    """
+    by_page = {}
+    for change in changes:
+        by_page.setdefault(params[change["field"]].page, []).append(change)
+
+    results = []
+    for n, (page_id, items) in enumerate(by_page.items()):
+        fields = [params[c["field"]] for c in items]
+        labels = [f.label for f in fields]
+        with timer.phase(f"page:{page_id}"):
+            if n:
+                goto_home(page)
+            open_param_page(page, pages[page_id], labels[0])
+            before = page.evaluate(READ_FIELDS_JS, labels)
+            page_results = []
+            reopen = False
+            for param, change in zip(fields, items):
+                if reopen:
+                    # Popup d'un champ en échec peut-être restée ouverte
+                    goto_home(page)
+                    open_param_page(page, pages[page_id], labels[0])
+                    reopen = False
+                result = {
+                    "field": param.name,
+                    "value": change["value"],
+                    "before": param.parse(before.get(param.label)),
+                    "changed": False,
+                    "verified": False,
+                }
+                t0 = time.perf_counter()
+                try:
+                    if result["before"] != change["value"]:
+                        write_field(page, param, change["value"])
+                        result["changed"] = True
+                        verify_field(page, param, change["value"])
+                    result["verified"] = True
+                    result["ok"] = True
+                except Exception as e:
+                    result["ok"] = False
+                    result["error"] = str(e)
+                    log.error("%s : %s", param.name, e)
+                    emit_event("error", message=str(e), field=param.name)
+                    if "artifacts" not in details:
+                        capture_page(page, details)
+                    reopen = True
+                result["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                emit_event("param", field=param.name, ok=result["ok"], changed=result["changed"])
+                page_results.append(result)
+
+            # Valeurs affichées à la fin (une lecture pour toute la page)
+            after = page.evaluate(READ_FIELDS_JS, labels)
+            for param, result in zip(fields, page_results):
+                result["after"] = param.parse(after.get(param.label))
+            results.extend(page_results)
+    return results
+
+
+def run_params_in_context(context, changes, details: dict = None):
+    """
+    Équivalent de run_in_context pour POST /params : une seule session pour
+    tous les changements. `changes` est revalidé avec le registre local
+    (ValueError si invalide). Retourne les résultats par champ.
+    """
+    if details is None:
+        details = {}
+    pages, params = load_params()
+    changes, errors = validate_params(changes, params)
+    if errors:
+        raise ValueError(f"Paramètres invalides : {errors}")
+    timer = PhaseTimer(details)
+    with open_page(context, details) as page:
+        with timer.phase("session"):
+            details["session_cache"] = open_session(page, context)
+        details["lean"] = LEAN_MODE
+        return write_params(page, pages, params, changes, details, timer)
+
+
+def run(playwright: Playwright, target_mode: str, details: dict = None, changes=None):
+    """
+    Exécute la séquence Playwright pour atteindre le mode demandé.
 
+    Retourne:
+        (status_before, status_after, changed), ou les résultats par champ
+        si target_mode = "params"
+    """
+    trace("=== DEBUT run() pour target_mode=%s ===", target_mode)
+    check_credentials()
+    if details is None:
+        details = {}
+    timer = PhaseTimer(details)
+
+    trace("Lancement du navigateur Playwright Chromium")
+    with timer.phase("launch"):
+        browser = playwright.chromium.launch(**launch_options())
+        context = new_context(browser, storage_state=load_storage_state())
+        enable_lean_routing(context)
+        start_tracing(context)
     try:
-        print(f"[TRACE] [main] Lancement de run() avec mode={mode}")
-        with sync_playwright() as playwright:
-            status_before, status_after, changed = run(playwright, mode)
-        ok = True
-    except Exception as e:
-        ok = False
-        error_msg = str(e)
-        print(f"[ERROR] [main] Exception: {e}")
+        return run_captured(context, target_mode, details, changes)
+    finally:
+        trace("Fermeture du contexte et du navigateur")
+        with timer.phase("close"):
+            context.close()
+            browser.close()
+
+
+def parse_mode(arg: str):
+    """
+    Normalise un argument utilisateur en "on" / "off" / "status"
+    (None si inconnu).
+    """
+    arg = arg.lower()
+    if arg in ("status", "etat", "état"):
+        return "status"
+    if arg in ("off", "arrete", "arrêt", "eteindre", "éteindre", "stop", "0"):
+        return "off"
+    if arg in ("on", "allume", "allumer", "auto", "start", "1"):
+        return "on"
+    return None
 
-    duration_ms = int((time.time() - start) * 1000)
 
+def build_summary(mode: str, ok: bool, status_before, status_after, changed,
+                  duration_ms: int, error_msg: str = "", details: dict = None):
+    """
+    Construit le dict OKOFEN_SUMMARY consommé par app.py.
+    """
     summary = {
         "ok": ok,
         "action": mode,
@@ -239,10 +1064,26 @@ if __name__ == "__main__":
         "changed": changed,
         "duration_ms": duration_ms,
     }
+    if details:
+        summary.update(details)
+
+    # Séquence terminée mais nouveau mode jamais affiché : échec
+    if ok and summary.get("verified") is False:
+        ok = summary["ok"] = False
+        error_msg = error_msg or (
+            f"Mode {mode} non confirmé par l'interface (affiché : {status_after})."
+        )
 
     if not ok:
         summary["error"] = error_msg
         summary["message"] = "Une erreur est survenue pendant le pilotage de la chaudière."
+    elif mode == "status":
+        if status_after == "on":
+            summary["message"] = "La chaudière est en mode Auto."
+        elif status_after == "off":
+            summary["message"] = "La chaudière est à l'arrêt."
+        else:
+            summary["message"] = "Le mode de la chaudière n'a pas pu être déterminé."
     else:
         if changed:
             if mode == "on":
@@ -255,7 +1096,115 @@ if __name__ == "__main__":
             else:
                 summary["message"] = "La chaudière était déjà à l'arrêt."
 
+    return summary
+
+
+def build_params_summary(ok: bool, changes, results, duration_ms: int, error_msg: str = "",
+                         details: dict = None):
+    """
+    Résumé OKOFEN_SUMMARY d'un POST /params : un résultat par champ demandé
+    (les champs non atteints après une erreur sont en échec).
+    """
+    results = list(results or [])
+    done = {r["field"] for r in results}
+    for change in changes or []:
+        if isinstance(change, dict) and change.get("field") not in done:
+            results.append({
+                "field": change.get("field"),
+                "value": change.get("value"),
+                "changed": False,
+                "verified": False,
+                "ok": False,
+                "error": error_msg or "non appliqué",
+            })
+    ok = ok and bool(results) and all(r["ok"] for r in results)
+    summary = {
+        "ok": ok,
+        "action": "params",
+        "changed": any(r["changed"] for r in results),
+        "results": results,
+        "duration_ms": duration_ms,
+    }
+    if details:
+        summary.update(details)
+
+    applied = sum(1 for r in results if r["ok"])
+    if ok:
+        summary["message"] = "Paramètres appliqués."
+    else:
+        if error_msg:
+            summary["error"] = error_msg
+        summary["message"] = f"{applied} paramètre(s) appliqué(s) sur {len(results)}."
+    return summary
+
+
+if __name__ == "__main__":
+    start = time.time()
+    mode = "off"
+    ok = False
+    error_msg = ""
+    status_before = "unknown"
+    status_after = "unknown"
+    changed = None
+    # Identifiant d'exécution fourni par app.py (répertoire des captures)
+    details = {"run_id": os.getenv("OKOFEN_RUN_ID") or new_run_id()}
+    set_event_sink(print_event)
+    # Journaux transmis en événements "log" sur stdout (pas de sortie en double)
+    configure_logging()
+    logging.getLogger("okofen").propagate = False
+    # Délais par phase transmis par app.py (délais adaptatifs)
+    set_phase_timeouts(json.loads(os.getenv("OKOFEN_PHASE_TIMEOUTS") or "{}"))
+
+    trace("DEBUT main, parsing des arguments éventuels")
+    changes = None
+    results = []
+    if len(sys.argv) > 2 and sys.argv[1] == "params":
+        # Changements validés par app.py : '[{"field": ..., "value": ...}]'
+        mode = "params"
+        try:
+            changes = json.loads(sys.argv[2])
+        except ValueError:
+            changes = None
+        if changes is None:
+            print("Usage : python Okofen_Playwright.py params '<JSON>'")
+            sys.exit(1)
+    elif len(sys.argv) > 1:
+        mode = parse_mode(sys.argv[1])
+        if mode is None:
+            print("Usage : python Okofen_Playwright.py [on|off|status]")
+            print("        python Okofen_Playwright.py params '<JSON>'")
+            sys.exit(1)
+
+    try:
+        trace("Lancement de run() avec mode=%s", mode)
+        t0 = time.perf_counter()
+        # Pic de RSS / CPU de ce processus, du driver Node et de Chromium
+        with ResourceMonitor(details), sync_playwright() as playwright:
+            # Démarrage du driver Node de Playwright (hors lancement Chromium)
+            details.setdefault("phases", {})["playwright_start"] = round(
+                (time.perf_counter() - t0) * 1000, 1
+            )
+            if mode == "params":
+                results = run(playwright, mode, details, changes)
+            else:
+                status_before, status_after, changed = run(playwright, mode, details)
+        ok = True
+    except Exception as e:
+        ok = False
+        error_msg = str(e)
+        log.error("Exception: %s", e)
+        emit_event("error", message=error_msg)
+
+    duration_ms = int((time.time() - start) * 1000)
+
+    if mode == "params":
+        summary = build_params_summary(ok, changes, results, duration_ms, error_msg, details)
+    else:
+        summary = build_summary(
+            mode, ok, status_before, status_after, changed, duration_ms, error_msg, details
+        )
+
     # Ligne spéciale pour l'API HTTP (app.py)
     print("OKOFEN_SUMMARY:" + json.dumps(summary, ensure_ascii=False))
 
-    sys.exit(0 if ok else 1)
+    sys.exit(0 if summary["ok"] else 1)
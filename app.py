@@ -3,21 +3,120 @@ import os
 import sys
 import time
 import json
+import queue
 import logging
+import socket
+import atexit
+import collections
 import subprocess
 import threading
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from functools import wraps
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from dotenv import load_dotenv
 
-_lock = threading.Lock()
+from okofen_http import HttpDriver, FastPathError
+from okofen_store import ProcessLock, ResultStore, DesiredState
+from okofen_reconciler import Reconciler
+from okofen_metrics import Metrics
+from okofen_targets import load_boilers, normalize_target, default_target
+from okofen_scheduler import (
+    ScheduleStore, Scheduler, parse_days, parse_time_of_day, parse_when,
+)
+from okofen_csv import CsvStore, CsvIngestor, CsvWatcher, BUCKETS
+from okofen_telemetry import (
+    RingBuffer, TelemetryStore, TelemetryPoller, load_keys, query_series, MAX_POINTS,
+)
+from okofen_health import CircuitBreaker, ReachabilityProbe, AdaptiveTimeouts, unreachable
+from okofen_trace import RunTrace, TraceRing
+from okofen_artifacts import ArtifactStore, new_run_id
+from okofen_params import load_params, validate as validate_params
+from okofen_resources import MemoryBudget
+from okofen_mqtt import MqttPublisher
 
+# SCRIPT_TIMEOUT par défaut (s), commun à app.py et okofen_asgi.py
+SCRIPT_TIMEOUT_DEFAULT = "40"
 
-def _setup_logging(log_path: str, level: str = "INFO"):
+
+class StatusCache:
+    """
+    Cache mémoire du mode lu sur la chaudière ("on" / "off"), avec TTL.
+
+    Coalescence : pendant un rafraîchissement, les autres appelants attendent
+    le résultat de la lecture en cours au lieu de lancer la leur.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.status = None
+        self.fetched_at = None
+        self._cond = threading.Condition()
+        self._refreshing = False
+        self._generation = 0
+        self._last = (None, None)  # (status, erreur) de la dernière lecture
+
+    def age(self):
+        if self.fetched_at is None:
+            return None
+        return time.time() - self.fetched_at
+
+    def update(self, status):
+        if status not in ("on", "off"):
+            return
+        with self._cond:
+            self.status = status
+            self.fetched_at = time.time()
+
+    def get(self, refresh, max_age: float = None):
+        """
+        Retourne (status, age_s, refreshed).
+        `refresh()` lit le mode sur la chaudière (ou lève une exception).
+        """
+        max_age = self.ttl if max_age is None else max_age
+        with self._cond:
+            age = self.age()
+            if age is not None and age <= max_age:
+                return self.status, age, False
+            if self._refreshing:
+                # Une lecture est déjà en vol : on partage son résultat
+                generation = self._generation
+                while self._refreshing and self._generation == generation:
+                    self._cond.wait()
+                status, error = self._last
+                if error is not None:
+                    raise error
+                return status, 0.0, True
+            self._refreshing = True
+
+        status, error = None, None
+        try:
+            status = refresh()
+        except Exception as e:
+            error = e
+
+        with self._cond:
+            self._refreshing = False
+            self._generation += 1
+            self._last = (status, error)
+            if error is None and status in ("on", "off"):
+                self.status = status
+                self.fetched_at = time.time()
+            self._cond.notify_all()
+
+        if error is not None:
+            raise error
+        return status, 0.0, True
+
+
+def setup_logging(log_path: str, level: str = "INFO"):
+    """
+    Les threads de requête ne font que déposer les enregistrements dans une
+    file ; un thread dédié (QueueListener) écrit console et fichier rotatif.
+    """
     logger = logging.getLogger()
-    logger.setLevel(getattr(logging, level.upper(), logging.INFO))
+    level = getattr(logging, level.upper(), logging.INFO)
+    logger.setLevel(level)
 
     formatter = logging.Formatter(
         fmt="%(asctime)s %(levelname)s %(name)s %(message)s",
@@ -27,38 +126,275 @@ def _setup_logging(log_path: str, level: str = "INFO"):
     # Console
     ch = logging.StreamHandler(sys.stdout)
     ch.setFormatter(formatter)
-    logger.addHandler(ch)
+    handlers = [ch]
 
     # Fichier rotatif
     if log_path:
         os.makedirs(os.path.dirname(log_path), exist_ok=True)
         fh = RotatingFileHandler(log_path, maxBytes=2 * 1024 * 1024, backupCount=5)
         fh.setFormatter(formatter)
-        logger.addHandler(fh)
+        handlers.append(fh)
+
+    listener = QueueListener(queue.SimpleQueue(), *handlers)
+    qh = QueueHandler(listener.queue)
+    # Filtre aussi les enregistrements propagés depuis des loggers plus bavards
+    # (okofen.* au niveau DRIVER_LOG_LEVEL)
+    qh.setLevel(level)
+    logger.addHandler(qh)
+    listener.start()
+    atexit.register(listener.stop)
 
     return logger
 
 
-def _extract_summary_from_stdout(stdout: str):
+def _parse_script_line(line: str):
     """
-    Cherche une ligne du type:
-      OKOFEN_SUMMARY:{...json...}
-    et retourne le dict JSON si trouvé, sinon None.
+    Analyse une ligne de sortie du driver :
+      OKOFEN_SUMMARY:{...json...} -> ("summary", dict)
+      OKOFEN_EVENT:{...json...}   -> ("event", dict)
+    et retourne (None, None) pour une simple ligne de log.
     """
-    if not stdout:
-        return None
-
-    lines = stdout.strip().splitlines()
-    for line in reversed(lines):
-        line = line.strip()
-        if line.startswith("OKOFEN_SUMMARY:"):
-            raw = line[len("OKOFEN_SUMMARY:"):]
+    line = line.strip()
+    for kind, prefix in (("summary", "OKOFEN_SUMMARY:"), ("event", "OKOFEN_EVENT:")):
+        if line.startswith(prefix):
+            raw = line[len(prefix):]
             try:
-                return json.loads(raw)
+                return kind, json.loads(raw)
             except Exception:
-                logging.warning("Impossible de parser le JSON de résumé: %s", raw)
-                return None
-    return None
+                logging.warning("Impossible de parser le JSON (%s): %s", kind, raw)
+                return None, None
+    return None, None
+
+
+def _stream_script(cmd, timeout: float, stall_timeout: float, on_event=None, tail_size: int = 50,
+                   env: dict = None):
+    """
+    Lance le driver avec Popen et lit sa sortie ligne par ligne, sans la
+    garder en mémoire (seules les `tail_size` dernières lignes de log sont
+    conservées pour le diagnostic).
+
+    Le processus est tué si :
+      - le délai global `timeout` est dépassé ("timeout")
+      - aucun événement n'arrive pendant `stall_timeout` s ("stalled")
+      - il ne se termine pas peu après un événement "error"
+
+    `env` complète l'environnement du processus.
+
+    Retourne (returncode, summary, failure, last_phase, tail).
+    """
+    proc = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+        env={**os.environ, "PYTHONUNBUFFERED": "1", **(env or {})},
+    )
+    lines = queue.Queue()
+
+    def reader():
+        for line in proc.stdout:
+            lines.put(line)
+        lines.put(None)
+
+    threading.Thread(target=reader, daemon=True).start()
+
+    deadline = time.monotonic() + timeout
+    last_activity = time.monotonic()
+    summary, failure, last_phase = None, None, None
+    tail = collections.deque(maxlen=tail_size)
+
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            failure = "timeout"
+            break
+        wait = deadline - now
+        if stall_timeout > 0:
+            if now - last_activity >= stall_timeout:
+                failure = "stalled"
+                break
+            wait = min(wait, last_activity + stall_timeout - now)
+        try:
+            line = lines.get(timeout=max(wait, 0.01))
+        except queue.Empty:
+            continue
+        if line is None:
+            break
+
+        kind, obj = _parse_script_line(line)
+        if kind == "summary":
+            summary = obj
+        elif kind == "event":
+            last_activity = time.monotonic()
+            if obj.get("event") == "phase_start":
+                last_phase = obj.get("phase")
+            elif obj.get("event") == "error":
+                # Échec connu : on laisse quelques secondes pour le résumé
+                deadline = min(deadline, time.monotonic() + 5)
+            if on_event is not None:
+                on_event(obj)
+        else:
+            tail.append(line.rstrip())
+            logging.debug("[script] %s", line.rstrip())
+
+    if failure is not None:
+        proc.kill()
+    returncode = proc.wait()
+    return returncode, summary, failure, last_phase, list(tail)
+
+
+def _driver_request(socket_path: str, req: dict, timeout: float, on_event=None,
+                    stall_timeout: float = 0):
+    """
+    Envoie une requête JSON (une ligne) au driver persistant (okofen_driver.py)
+    et retourne sa réponse JSON. Les lignes d'événements ({"event": ...})
+    reçues avant la réponse sont passées à `on_event`.
+
+    Lève socket.timeout si `timeout` est dépassé ou si rien n'arrive pendant
+    `stall_timeout` secondes.
+    """
+    deadline = time.monotonic() + timeout
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(stall_timeout if 0 < stall_timeout < timeout else timeout)
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(req) + "\n").encode("utf-8"))
+        with sock.makefile("r", encoding="utf-8") as f:
+            while True:
+                line = f.readline()
+                if not line:
+                    raise ConnectionError("Réponse vide du driver")
+                obj = json.loads(line)
+                if "event" not in obj:
+                    return obj
+                if on_event is not None:
+                    on_event(obj)
+                if time.monotonic() >= deadline:
+                    raise socket.timeout("Délai global dépassé")
+
+
+def payload_from_summary(action: str, summary: dict, duration: int):
+    """
+    Réponse HTTP (http_code, payload) construite à partir d'un résumé
+    OKOFEN_SUMMARY. Partagée par app.py et okofen_asgi.py.
+    """
+    ok = bool(summary.get("ok"))
+    status_after = summary.get("status_after", "unknown")
+    changed = summary.get("changed")
+    duration_ms = summary.get("duration_ms", duration)
+    message = summary.get("message")
+
+    payload = {
+        "ok": ok,
+        "action": summary.get("action", action),
+        "status": status_after,
+        "changed": changed,
+        "duration_ms": duration_ms,
+        "speech": message,
+        "summary": summary,
+    }
+
+    http_code = 200 if ok else 500
+    if ok:
+        logging.info(
+            "Script success action=%s status=%s changed=%s duration_ms=%s",
+            action,
+            status_after,
+            changed,
+            duration_ms,
+        )
+    else:
+        logging.warning(
+            "Script failure action=%s status=%s changed=%s duration_ms=%s error=%s",
+            action,
+            status_after,
+            changed,
+            duration_ms,
+            summary.get("error"),
+        )
+
+    return http_code, payload
+
+
+def memory_payload(action: str, used_mb, estimate_mb, budget_mb):
+    """
+    Réponse immédiate (503) quand l'exécution dépasserait le budget mémoire.
+    Partagée par app.py et okofen_asgi.py.
+    """
+    payload = {
+        "ok": False,
+        "action": action,
+        "status": "unknown",
+        "changed": None,
+        "error_code": "memory_budget",
+        "error_message": (
+            f"Mémoire insuffisante : {used_mb} Mo utilisés + {estimate_mb} Mo estimés "
+            f"pour l'exécution > budget de {budget_mb} Mo."
+        ),
+        "memory": {"used_mb": used_mb, "estimate_mb": estimate_mb, "budget_mb": budget_mb},
+        "speech": "Mémoire insuffisante pour piloter la chaudière, réessayez dans un instant.",
+    }
+    return 503, payload
+
+
+def params_payload(summary: dict, duration: int):
+    """
+    Réponse d'un POST /params : un résultat par champ (200 tout appliqué,
+    207 partiel, 500 aucun).
+    """
+    _code, payload = payload_from_summary("params", summary, duration)
+    payload.pop("status", None)
+    results = summary.get("results") or []
+    ok_count = sum(1 for r in results if r.get("ok"))
+    if results and ok_count == len(results):
+        http_code = 200
+    elif ok_count:
+        http_code = 207
+    else:
+        http_code = 500
+    payload["ok"] = http_code == 200
+    payload["results"] = results
+    payload["summary"] = {k: v for k, v in summary.items() if k != "results"}
+    if summary.get("error"):
+        payload["error_message"] = summary["error"]
+    return http_code, payload
+
+
+def timeout_payload(action: str, duration: int, stalled_phase: str = None):
+    payload = {
+        "ok": False,
+        "action": action,
+        "status": "unknown",
+        "changed": None,
+        "duration_ms": duration,
+        "error_code": "timeout",
+        "error_message": "La chaudière ne répond pas (timeout).",
+        "speech": "Je n'arrive pas à contacter la chaudière pour l'instant.",
+    }
+    if stalled_phase is not None:
+        payload["error_code"] = "stalled"
+        payload["error_message"] = (
+            f"La chaudière ne répond plus (phase {stalled_phase} bloquée)."
+        )
+        payload["stalled_phase"] = stalled_phase
+    return 504, payload
+
+
+def unreachable_payload(action: str, retry_in_s=None):
+    """
+    Réponse immédiate quand le disjoncteur est ouvert (okofen_health).
+    """
+    return 503, {
+        "ok": False,
+        "action": action,
+        "status": "unknown",
+        "changed": None,
+        "duration_ms": 0,
+        "error_code": "unreachable",
+        "error_message": "La chaudière est injoignable (disjoncteur ouvert).",
+        "retry_in_s": retry_in_s,
+        "speech": "La chaudière est injoignable pour l'instant.",
+    }
 
 
 def create_app():
@@ -73,20 +409,175 @@ def create_app():
         "SCRIPT_PATH",
         os.path.abspath("Okofen_Playwright.py"),
     )
-    app.config["SCRIPT_TIMEOUT"] = int(os.environ.get("SCRIPT_TIMEOUT", "40"))
+    app.config["SCRIPT_TIMEOUT"] = int(os.environ.get("SCRIPT_TIMEOUT", SCRIPT_TIMEOUT_DEFAULT))
+    # Pilotage multi-cibles (okofen_batch.py, un Chromium pour toutes les cibles)
+    app.config["BATCH_SCRIPT_PATH"] = os.environ.get(
+        "BATCH_SCRIPT_PATH",
+        os.path.join(os.path.dirname(app.config["SCRIPT_PATH"]), "okofen_batch.py"),
+    )
+    app.config["BATCH_TIMEOUT"] = int(os.environ.get("BATCH_TIMEOUT", "120"))
+    # POST /params : toutes les pages visitées dans une seule exécution
+    app.config["PARAMS_TIMEOUT"] = int(os.environ.get("PARAMS_TIMEOUT", "90"))
+    # Driver tué si aucun événement de progression pendant N s (0 = désactivé,
+    # par défaut). Les événements ne sont émis qu'en changement de phase : à
+    # régler au-dessus de la phase la plus longue (login + networkidle)
+    app.config["SCRIPT_STALL_TIMEOUT"] = float(os.environ.get("SCRIPT_STALL_TIMEOUT", "0"))
     app.config["LOG_PATH"] = os.environ.get(
         "LOG_PATH",
         "/opt/Okofen_Playwright/logs/okofen-web.log",
     )
     app.config["LOG_LEVEL"] = os.environ.get("LOG_LEVEL", "INFO")
+    # Niveau des journaux du driver Playwright (TRACE, DEBUG, INFO...), gardés
+    # dans les traces d'exécution (GET /traces) ; TRACE_RING_SIZE dernières
+    app.config["DRIVER_LOG_LEVEL"] = os.environ.get("DRIVER_LOG_LEVEL", "DEBUG")
+    app.config["TRACE_RING_SIZE"] = int(os.environ.get("TRACE_RING_SIZE", "20"))
+    # Captures des exécutions en échec (trace.zip, capture d'écran, DOM)
+    app.config["ARTIFACTS_DIR"] = os.environ.get("ARTIFACTS_DIR", "/tmp/okofen-artifacts")
+    app.config["ARTIFACTS_MAX_BYTES"] = int(
+        os.environ.get("ARTIFACTS_MAX_BYTES", str(50 * 1024 * 1024))
+    )
+    # "subprocess" (un Chromium par commande) ou "daemon" (okofen_driver.py)
+    app.config["DRIVER_MODE"] = os.environ.get("DRIVER_MODE", "subprocess")
+    app.config["DRIVER_SOCKET"] = os.environ.get("DRIVER_SOCKET", "/tmp/okofen-driver.sock")
+    # Chemin rapide HTTP (okofen_http.py) tenté avant Playwright
+    app.config["FAST_PATH"] = os.environ.get("FAST_PATH", "0") == "1"
+    # Durée de validité (s) du mode en cache servi par GET /status
+    app.config["STATUS_TTL"] = float(os.environ.get("STATUS_TTL", "60"))
+    # État partagé entre workers gunicorn : verrou d'exécution et résultats
+    app.config["LOCK_PATH"] = os.environ.get("LOCK_PATH", "/tmp/okofen-command.lock")
+    app.config["RESULTS_DB"] = os.environ.get(
+        "RESULTS_DB",
+        "/opt/Okofen_Playwright/data/okofen.sqlite3",
+    )
+    # Âge max (s) d'un état vérifié permettant de sauter une commande déjà
+    # satisfaite (0 = toujours piloter)
+    app.config["VERIFIED_TTL"] = float(os.environ.get("VERIFIED_TTL", "300"))
+    # Suivi des jobs (/jobs/<id>?wait=N et flux SSE /jobs/<id>/events)
+    app.config["JOB_MAX_WAIT"] = float(os.environ.get("JOB_MAX_WAIT", "120"))
+    app.config["JOB_POLL_INTERVAL"] = float(os.environ.get("JOB_POLL_INTERVAL", "0.2"))
+
+    # Télémétrie (okofen_telemetry.py) : période d'échantillonnage (0 = désactivée)
+    app.config["TELEMETRY_INTERVAL"] = float(os.environ.get("TELEMETRY_INTERVAL", "0"))
+    app.config["TELEMETRY_RING_PATH"] = os.environ.get(
+        "TELEMETRY_RING_PATH", "/tmp/okofen-telemetry.ring"
+    )
+    # Échantillons bruts gardés (7 jours à 60 s)
+    app.config["TELEMETRY_RING_SIZE"] = int(os.environ.get("TELEMETRY_RING_SIZE", "10080"))
+    app.config["TELEMETRY_LOCK_PATH"] = os.environ.get(
+        "TELEMETRY_LOCK_PATH", "/tmp/okofen-telemetry.lock"
+    )
 
-    _setup_logging(app.config["LOG_PATH"], app.config["LOG_LEVEL"])
+    # Journaux touch_*.csv de la chaudière (okofen_csv.py), vide = désactivé
+    app.config["TOUCH_CSV_DIR"] = os.environ.get("TOUCH_CSV_DIR", "")
+    app.config["TOUCH_CSV_INTERVAL"] = float(os.environ.get("TOUCH_CSV_INTERVAL", "300"))
+    app.config["TOUCH_CSV_LOCK_PATH"] = os.environ.get(
+        "TOUCH_CSV_LOCK_PATH", "/tmp/okofen-csv.lock"
+    )
+
+    # Programmation on/off intégrée (okofen_scheduler.py)
+    app.config["SCHEDULER"] = os.environ.get("SCHEDULER", "1") == "1"
+    app.config["SCHEDULER_LOCK_PATH"] = os.environ.get(
+        "SCHEDULER_LOCK_PATH", "/tmp/okofen-scheduler.lock"
+    )
+    # Échéance manquée (service arrêté) rattrapée si elle date de moins de N s
+    app.config["SCHEDULER_CATCHUP"] = float(os.environ.get("SCHEDULER_CATCHUP", "3600"))
+
+    # Sonde de joignabilité de OKOFEN_URL (0 = désactivée) et disjoncteur
+    app.config["PROBE_INTERVAL"] = float(os.environ.get("PROBE_INTERVAL", "0"))
+    app.config["PROBE_TIMEOUT"] = float(os.environ.get("PROBE_TIMEOUT", "3"))
+    app.config["BREAKER_THRESHOLD"] = int(os.environ.get("BREAKER_THRESHOLD", "3"))
+    app.config["BREAKER_RESET"] = float(os.environ.get("BREAKER_RESET", "60"))
+    # Délais par phase = p95 observé x ADAPTIVE_FACTOR (bornés par les délais fixes)
+    app.config["ADAPTIVE_TIMEOUTS"] = os.environ.get("ADAPTIVE_TIMEOUTS", "0") == "1"
+    app.config["ADAPTIVE_FACTOR"] = float(os.environ.get("ADAPTIVE_FACTOR", "3"))
+    app.config["ADAPTIVE_MIN_MS"] = int(os.environ.get("ADAPTIVE_MIN_MS", "3000"))
+    # Budget mémoire du conteneur (Mo, 0 = désactivé) : une exécution qui le
+    # dépasserait attend MEMORY_WAIT s puis est refusée (503)
+    app.config["MEMORY_BUDGET_MB"] = float(os.environ.get("MEMORY_BUDGET_MB", "0"))
+    app.config["RUN_MEMORY_ESTIMATE_MB"] = float(os.environ.get("RUN_MEMORY_ESTIMATE_MB", "300"))
+    app.config["MEMORY_WAIT"] = float(os.environ.get("MEMORY_WAIT", "10"))
+
+    # Publication MQTT des résultats et du mode vérifié (vide = désactivée)
+    app.config["MQTT_HOST"] = os.environ.get("MQTT_HOST", "")
+    app.config["MQTT_PORT"] = int(os.environ.get("MQTT_PORT", "1883"))
+    app.config["MQTT_USERNAME"] = os.environ.get("MQTT_USERNAME") or None
+    app.config["MQTT_PASSWORD"] = os.environ.get("MQTT_PASSWORD") or None
+    app.config["MQTT_TOPIC_PREFIX"] = os.environ.get("MQTT_TOPIC_PREFIX", "okofen")
+    app.config["MQTT_DISCOVERY_PREFIX"] = os.environ.get("MQTT_DISCOVERY_PREFIX", "homeassistant")
+    app.config["MQTT_NODE_ID"] = os.environ.get("MQTT_NODE_ID", "okofen")
+    app.config["MQTT_QOS"] = int(os.environ.get("MQTT_QOS", "1"))
+    app.config["MQTT_QUEUE_SIZE"] = int(os.environ.get("MQTT_QUEUE_SIZE", "100"))
+    app.config["MQTT_RECONNECT_MIN"] = float(os.environ.get("MQTT_RECONNECT_MIN", "1"))
+    app.config["MQTT_RECONNECT_MAX"] = float(os.environ.get("MQTT_RECONNECT_MAX", "60"))
+    app.config["MQTT_POLL_INTERVAL"] = float(os.environ.get("MQTT_POLL_INTERVAL", "1"))
+    app.config["MQTT_LOCK_PATH"] = os.environ.get("MQTT_LOCK_PATH", "/tmp/okofen-mqtt.lock")
+
+    setup_logging(app.config["LOG_PATH"], app.config["LOG_LEVEL"])
 
     logging.info("Okofen web service starting…")
     logging.info("Using script: %s", app.config["SCRIPT_PATH"])
+    logging.info("Driver mode: %s", app.config["DRIVER_MODE"])
 
-    # Variable pour stocker le dernier résultat structuré
-    last_result = None
+    # Un seul pilotage de la chaudière à la fois, tous workers confondus
+    _lock = ProcessLock(app.config["LOCK_PATH"])
+    # Résultats structurés (partagés entre workers, lus par /last et /results)
+    results = ResultStore(app.config["RESULTS_DB"])
+    # Compteurs / histogrammes Prometheus (même base, agrégés entre workers)
+    metrics = Metrics(app.config["RESULTS_DB"])
+    # Traces détaillées des dernières exécutions (anneau de taille fixe)
+    traces = TraceRing(app.config["RESULTS_DB"], app.config["TRACE_RING_SIZE"])
+    # Captures écrites par le driver, servies par /runs/<run_id>/artifacts
+    artifacts = ArtifactStore(app.config["ARTIFACTS_DIR"], app.config["ARTIFACTS_MAX_BYTES"])
+    # Client HTTP keep-alive du chemin rapide (créé à la première commande)
+    http_driver = None
+    # Dernier mode connu de la chaudière (lectures /status et commandes réussies)
+    status_cache = StatusCache(app.config["STATUS_TTL"])
+    # Chaudières / circuits pilotables par /batch (OKOFEN_BOILERS)
+    boilers = load_boilers()
+    # Cible pilotée par /on et /off (OKOFEN_URL, Chf1), si déclarée
+    main_target = default_target(boilers)
+    # Champs réglables par POST /params
+    param_pages, params_registry = load_params()
+    # Chaudière injoignable : échec immédiat plutôt que SCRIPT_TIMEOUT
+    breaker = CircuitBreaker(app.config["BREAKER_THRESHOLD"], app.config["BREAKER_RESET"])
+    probe = None
+    if app.config["PROBE_INTERVAL"] > 0 and os.environ.get("OKOFEN_URL"):
+        probe = ReachabilityProbe(
+            os.environ["OKOFEN_URL"],
+            breaker,
+            app.config["PROBE_INTERVAL"],
+            app.config["PROBE_TIMEOUT"],
+        )
+        probe.start()
+    memory = MemoryBudget(
+        results, app.config["MEMORY_BUDGET_MB"], app.config["RUN_MEMORY_ESTIMATE_MB"]
+    )
+    # Résultats poussés vers MQTT par un seul worker (connexion persistante)
+    mqtt = MqttPublisher(
+        results,
+        app.config["MQTT_HOST"],
+        app.config["MQTT_PORT"],
+        app.config["MQTT_USERNAME"],
+        app.config["MQTT_PASSWORD"],
+        prefix=app.config["MQTT_TOPIC_PREFIX"],
+        discovery_prefix=app.config["MQTT_DISCOVERY_PREFIX"],
+        node_id=app.config["MQTT_NODE_ID"],
+        qos=app.config["MQTT_QOS"],
+        queue_size=app.config["MQTT_QUEUE_SIZE"],
+        reconnect_min=app.config["MQTT_RECONNECT_MIN"],
+        reconnect_max=app.config["MQTT_RECONNECT_MAX"],
+        poll_interval=app.config["MQTT_POLL_INTERVAL"],
+        lock_path=app.config["MQTT_LOCK_PATH"],
+        metrics=metrics,
+    )
+    mqtt.start()
+    phase_timeouts = None
+    if app.config["ADAPTIVE_TIMEOUTS"]:
+        phase_timeouts = AdaptiveTimeouts(
+            results,
+            factor=app.config["ADAPTIVE_FACTOR"],
+            min_ms=app.config["ADAPTIVE_MIN_MS"],
+        )
 
     # ---------------------------
     # Auth Bearer
@@ -106,174 +597,395 @@ def create_app():
         return wrapper
 
     # ---------------------------
-    # Exécution script (synchrone)
+    # Exécution (réconciliation de l'état désiré)
     # ---------------------------
 
-    def _run_script_sync(action: str):
-        nonlocal last_result
+    def _record(action: str, http_code: int, payload: dict, update_status: bool = True):
+        results.append(action, http_code, payload)
+        # Publication MQTT hors du chemin de commande (simple réveil du publieur)
+        mqtt.notify()
+        try:
+            metrics.record_result(action, http_code, payload)
+        except Exception:
+            logging.exception("Impossible de mettre à jour les métriques")
+        if update_status and payload.get("ok") and not payload.get("skipped"):
+            status_cache.update(payload.get("status"))
 
-        start = time.time()
+    def _verified_status():
+        """
+        Dernier mode vérifié assez récent pour éviter une session chaudière.
+        """
+        ttl = app.config["VERIFIED_TTL"]
+        if ttl <= 0:
+            return None
+        age = status_cache.age()
+        if age is not None and age <= ttl:
+            return status_cache.status
+        return results.last_verified(ttl)
 
-        if action not in {"on", "off"}:
-            payload = {
-                "ok": False,
-                "action": action,
-                "status": "unknown",
-                "changed": None,
-                "duration_ms": 0,
-                "error_code": "invalid_action",
-                "error_message": "Action invalide.",
-                "speech": "L'action demandée est invalide.",
-            }
-            last_result = payload
-            return 400, payload
+    def _execute(action: str, start: float, progress=None, changes=None):
+        """
+        Exécute l'action ("on" / "off" / "status", ou "params" avec les
+        `changes` validés) via le driver configuré. Doit être appelé avec
+        _lock détenu. `progress(dict)` reçoit la phase en cours au fil des
+        événements du driver Playwright.
+
+        Échoue immédiatement (503) tant que le disjoncteur est ouvert, et
+        après MEMORY_WAIT s si l'exécution dépasserait le budget mémoire.
+        """
+        if not breaker.allow():
+            logging.warning("Chaudière injoignable, commande %s refusée", action)
+            return unreachable_payload(action, breaker.retry_in())
+        allowed, used, estimate = memory.wait(app.config["MEMORY_WAIT"])
+        if not allowed:
+            logging.warning(
+                "Budget mémoire dépassé (%s + %s > %s Mo), commande %s refusée",
+                used, estimate, memory.budget_mb, action,
+            )
+            # Essai du disjoncteur demi-ouvert non tenté : place libérée
+            breaker.release_trial()
+            return memory_payload(action, used, estimate, memory.budget_mb)
+        trace = RunTrace(action, new_run_id())
+        try:
+            http_code, payload = _dispatch(action, start, progress, trace, changes)
+        except Exception:
+            # Erreur locale (driver, script) : rien à conclure sur la chaudière
+            breaker.release_trial()
+            raise
+        payload["run_id"] = trace.run_id
+        if (payload.get("summary") or {}).get("artifacts"):
+            payload["artifacts_url"] = f"/runs/{trace.run_id}/artifacts"
+        try:
+            payload["trace_id"] = traces.append(trace.to_dict(http_code, payload))
+        except Exception:
+            logging.exception("Impossible d'enregistrer la trace d'exécution")
+        _record_reachability(payload)
+        return http_code, payload
+
+    def _record_reachability(payload: dict):
+        """
+        Alimente le disjoncteur avec le résultat d'une exécution. Batch :
+        chaudière injoignable seulement si aucune cible n'a répondu.
+        """
+        items = payload.get("results") or [payload]
+        if all(unreachable(item) for item in items):
+            item = items[0]
+            breaker.record_failure(
+                item.get("error_message")
+                or (item.get("summary") or {}).get("error")
+                or item.get("error_code")
+            )
+        else:
+            breaker.record_success()
+
+    def _phase_timeouts():
+        return phase_timeouts.get() if phase_timeouts is not None else {}
+
+    def _dispatch(action: str, start: float, progress=None, trace=None, changes=None):
+        # Le chemin HTTP ne sait que lire / changer le mode
+        if app.config["FAST_PATH"] and changes is None:
+            try:
+                return _run_via_http(action, start)
+            except FastPathError as e:
+                # Situation non gérée par le chemin HTTP : Playwright prend le relais
+                logging.warning("Fast path HTTP en échec (%s), fallback Playwright", e)
+                code, payload = _run_via_playwright(action, start, progress, trace)
+                payload["fallback_reason"] = str(e)
+                return code, payload
+        return _run_via_playwright(action, start, progress, trace, changes)
+
+    # ---------------------------
+    # Exécution via HTTP / subprocess / driver persistant
+    # ---------------------------
+
+    def _run_via_playwright(action: str, start: float, progress=None, trace=None, changes=None):
+        if app.config["DRIVER_MODE"] == "daemon":
+            try:
+                return _run_via_driver(action, start, progress, trace, changes)
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                # Driver absent : on retombe sur le mode subprocess
+                logging.warning("Driver indisponible (%s), fallback subprocess", e)
+                code, payload = _run_via_subprocess(action, start, progress, trace, changes)
+                payload["driver_fallback_reason"] = str(e)
+                return code, payload
+        return _run_via_subprocess(action, start, progress, trace, changes)
 
-        # Empêcher deux exécutions simultanées
-        if not _lock.acquire(blocking=False):
-            logging.warning("Concurrent invocation refused (action=%s)", action)
+    def _progress_listener(progress, trace=None):
+        """
+        Transforme les événements du driver en progression de job
+        (phase en cours), et retient la dernière phase commencée.
+        Tous les événements (journaux compris) vont dans `trace`.
+        """
+        last = {"phase": None}
+
+        def on_event(event):
+            if trace is not None:
+                trace.add(event)
+            kind = event.get("event")
+            if kind == "phase_start":
+                last["phase"] = event.get("phase")
+            elif kind not in ("state", "error"):
+                return
+            if progress is not None:
+                info = {"phase": last["phase"], "event": kind}
+                if kind == "state":
+                    info["status"] = event.get("status")
+                progress(info)
+
+        return on_event, last
+
+    def _run_via_http(action: str, start: float):
+        nonlocal http_driver
+        if http_driver is None:
+            http_driver = HttpDriver()
+        logging.info("Running via HTTP fast path")
+        summary = http_driver.run(action)
+        duration = int((time.time() - start) * 1000)
+        return payload_from_summary(action, summary, duration)
+
+    def _run_via_driver(action: str, start: float, progress=None, trace=None, changes=None):
+        socket_path = app.config["DRIVER_SOCKET"]
+        timeout = app.config["PARAMS_TIMEOUT" if changes is not None else "SCRIPT_TIMEOUT"]
+        logging.info("Running via driver %s (timeout=%ss)", socket_path, timeout)
+        on_event, last = _progress_listener(progress, trace)
+        req = {
+            "cmd": "run",
+            "action": action,
+            "timeouts": _phase_timeouts(),
+            "run_id": trace.run_id if trace is not None else None,
+        }
+        if changes is not None:
+            req.update(cmd="params", params=changes)
+            del req["action"]
+        try:
+            summary = _driver_request(
+                socket_path,
+                req,
+                timeout,
+                on_event=on_event,
+                stall_timeout=app.config["SCRIPT_STALL_TIMEOUT"],
+            )
+        except socket.timeout:
+            duration = int((time.time() - start) * 1000)
+            logging.error(
+                "Driver timeout after %sms for action=%s (phase=%s)",
+                duration,
+                action,
+                last["phase"],
+            )
+            return timeout_payload(action, duration, last["phase"])
+
+        duration = int((time.time() - start) * 1000)
+        if changes is not None:
+            return params_payload(summary, duration)
+        return payload_from_summary(action, summary, duration)
+
+    def _run_via_subprocess(action: str, start: float, progress=None, trace=None, changes=None):
+        cmd = [sys.executable, app.config["SCRIPT_PATH"], action]
+        timeout = app.config["SCRIPT_TIMEOUT"]
+        if changes is not None:
+            cmd.append(json.dumps(changes, ensure_ascii=False))
+            timeout = app.config["PARAMS_TIMEOUT"]
+        logging.info("Running %s (timeout=%ss)", cmd, timeout)
+
+        on_event, _last = _progress_listener(progress, trace)
+        returncode, summary, failure, last_phase, tail = _stream_script(
+            cmd,
+            timeout,
+            app.config["SCRIPT_STALL_TIMEOUT"],
+            on_event=on_event,
+            env={
+                "OKOFEN_PHASE_TIMEOUTS": json.dumps(_phase_timeouts()),
+                "OKOFEN_LOG_LEVEL": app.config["DRIVER_LOG_LEVEL"],
+                "OKOFEN_RUN_ID": trace.run_id if trace is not None else "",
+                "ARTIFACTS_DIR": app.config["ARTIFACTS_DIR"],
+                "ARTIFACTS_MAX_BYTES": str(app.config["ARTIFACTS_MAX_BYTES"]),
+            },
+        )
+        duration = int((time.time() - start) * 1000)
+        if trace is not None:
+            # Sortie hors événements (traceback, messages de Playwright...)
+            trace.tail = list(tail)
+
+        if failure is not None:
+            logging.error(
+                "Script %s after %sms for action=%s (phase=%s)",
+                failure,
+                duration,
+                action,
+                last_phase,
+            )
+            if tail:
+                logging.warning("Script output (tail):\n%s", "\n".join(tail))
+            return timeout_payload(
+                action, duration, last_phase if failure == "stalled" else None
+            )
+
+        if returncode != 0 and tail:
+            logging.warning("Script output (tail):\n%s", "\n".join(tail))
+
+        if summary is None:
+            # fallback générique
+            ok = (returncode == 0)
             payload = {
-                "ok": False,
+                "ok": ok,
                 "action": action,
                 "status": "unknown",
                 "changed": None,
-                "duration_ms": 0,
-                "error_code": "busy",
-                "error_message": "Une commande est déjà en cours d'exécution.",
-                "speech": "Une commande de pilotage de la chaudière est déjà en cours, réessaie dans quelques secondes.",
+                "duration_ms": duration,
+                "speech": "Commande exécutée, mais sans résumé structuré.",
             }
-            last_result = payload
-            return 429, payload
-
-        try:
-            cmd = [sys.executable, app.config["SCRIPT_PATH"], action]
-            logging.info("Running %s (timeout=%ss)", cmd, app.config["SCRIPT_TIMEOUT"])
-
-            try:
-                proc = subprocess.run(
-                    cmd,
-                    capture_output=True,
-                    text=True,
-                    timeout=app.config["SCRIPT_TIMEOUT"],
-                    env={**os.environ},
+            if not ok:
+                payload["error_code"] = "script_error"
+                payload["error_message"] = "Erreur lors de l'exécution du script."
+                logging.warning(
+                    "Script terminé avec rc=%s sans résumé JSON",
+                    returncode,
                 )
+            http_code = 200 if ok else 500
+            return http_code, payload
 
-                duration = int((time.time() - start) * 1000)
-
-                # Logs bruts côté serveur
-                if proc.stdout:
-                    logging.debug("Script stdout:\n%s", proc.stdout)
-                if proc.stderr:
-                    level = logging.WARNING if proc.returncode != 0 else logging.DEBUG
-                    logging.log(level, "Script stderr:\n%s", proc.stderr)
+        if changes is not None:
+            return params_payload(summary, duration)
+        return payload_from_summary(action, summary, duration)
 
-                summary = _extract_summary_from_stdout(proc.stdout or "")
+    def _run_batch(action: str, targets, start: float):
+        """
+        Applique l'action à plusieurs cibles (okofen_batch.py).
+        Doit être appelé avec _lock détenu. Retourne (http_code, payload).
+        """
+        cmd = [sys.executable, app.config["BATCH_SCRIPT_PATH"], action, *targets]
+        logging.info("Running %s (timeout=%ss)", cmd, app.config["BATCH_TIMEOUT"])
 
-                if summary is None:
-                    # fallback générique
-                    ok = (proc.returncode == 0)
-                    payload = {
-                        "ok": ok,
-                        "action": action,
-                        "status": "unknown",
-                        "changed": None,
-                        "duration_ms": duration,
-                        "speech": "Commande exécutée, mais sans résumé structuré.",
-                    }
-                    if not ok:
-                        payload["error_code"] = "script_error"
-                        payload["error_message"] = "Erreur lors de l'exécution du script."
-                        logging.warning(
-                            "Script terminé avec rc=%s sans résumé JSON",
-                            proc.returncode,
-                        )
-                    http_code = 200 if ok else 500
-                    last_result = payload
-                    return http_code, payload
-
-                # Construction de la réponse à partir du résumé
-                ok = bool(summary.get("ok"))
-                status_after = summary.get("status_after", "unknown")
-                changed = summary.get("changed")
-                duration_ms = summary.get("duration_ms", duration)
-                message = summary.get("message")
-
-                payload = {
-                    "ok": ok,
-                    "action": summary.get("action", action),
-                    "status": status_after,
-                    "changed": changed,
-                    "duration_ms": duration_ms,
-                    "speech": message,
-                    "summary": summary,
-                }
+        returncode, summary, failure, last_phase, tail = _stream_script(
+            cmd,
+            app.config["BATCH_TIMEOUT"],
+            app.config["SCRIPT_STALL_TIMEOUT"],
+        )
+        duration = int((time.time() - start) * 1000)
 
-                http_code = 200 if ok else 500
-                if ok:
-                    logging.info(
-                        "Script success action=%s status=%s changed=%s duration_ms=%s",
-                        action,
-                        status_after,
-                        changed,
-                        duration_ms,
-                    )
-                else:
-                    logging.warning(
-                        "Script failure action=%s status=%s changed=%s duration_ms=%s error=%s",
-                        action,
-                        status_after,
-                        changed,
-                        duration_ms,
-                        summary.get("error"),
-                    )
-
-                last_result = payload
-                return http_code, payload
-
-            except subprocess.TimeoutExpired as e:
-                duration = int((time.time() - start) * 1000)
-                logging.error("Timeout after %sms for action=%s", duration, action)
-
-                stdout = (e.stdout or "")
-                stderr = (e.stderr or "")
-
-                if stdout:
-                    logging.debug("Script stdout (timeout):\n%s", stdout)
-                if stderr:
-                    logging.warning("Script stderr (timeout):\n%s", stderr)
-
-                payload = {
+        if failure is not None or summary is None:
+            if tail:
+                logging.warning("Batch output (tail):\n%s", "\n".join(tail))
+            if failure is not None:
+                code, payload = timeout_payload(
+                    action, duration, last_phase if failure == "stalled" else None
+                )
+            else:
+                code, payload = 500, {
                     "ok": False,
                     "action": action,
-                    "status": "unknown",
-                    "changed": None,
                     "duration_ms": duration,
-                    "error_code": "timeout",
-                    "error_message": "La chaudière ne répond pas (timeout).",
-                    "speech": "Je n'arrive pas à contacter la chaudière pour l'instant.",
+                    "error_code": "script_error",
+                    "error_message": f"Batch terminé avec rc={returncode} sans résumé JSON.",
                 }
-                last_result = payload
-                return 504, payload
+            payload["targets"] = targets
+            return code, payload
 
-        finally:
-            _lock.release()
+        items = []
+        for target_summary in summary.get("results") or []:
+            code, item = payload_from_summary(action, target_summary, duration)
+            item["target"] = target_summary.get("target")
+            if item["target"] == main_target and action in ("on", "off", "status"):
+                # Garde à jour l'état vérifié utilisé par le réconciliateur
+                _record(action, code, dict(item))
+            items.append(item)
+
+        ok_count = sum(1 for item in items if item["ok"])
+        if items and ok_count == len(items):
+            http_code = 200
+        elif ok_count:
+            http_code = 207
+        else:
+            http_code = 500
+        payload = {
+            "ok": http_code == 200,
+            "action": action,
+            "targets": targets,
+            "results": items,
+            "duration_ms": summary.get("duration_ms", duration),
+            "summary": {k: v for k, v in summary.items() if k != "results"},
+        }
+        if not summary.get("results") and summary.get("error"):
+            payload["error_message"] = summary["error"]
+        return http_code, payload
 
     # ---------------------------
-    # Wrapper asynchrone
+    # Lecture seule du mode
     # ---------------------------
 
-    def _run_script_async(action: str):
-        def worker():
-            code, body = _run_script_sync(action)
-            logging.info(
-                "Async script finished action=%s http_code=%s ok=%s status=%s",
-                action,
-                code,
-                body.get("ok"),
-                body.get("status"),
+    def _read_status():
+        # On attend une éventuelle commande en cours plutôt que de la refuser
+        if not _lock.acquire(timeout=app.config["SCRIPT_TIMEOUT"]):
+            metrics.inc("okofen_busy_total")
+            raise RuntimeError("Une commande est déjà en cours d'exécution.")
+        try:
+            http_code, payload = _execute("status", time.time())
+        finally:
+            _lock.release()
+        if not payload.get("ok"):
+            raise RuntimeError(
+                payload.get("error_message")
+                or (payload.get("summary") or {}).get("error")
+                or "Lecture du mode impossible."
             )
+        return payload.get("status", "unknown")
 
-        t = threading.Thread(target=worker, daemon=True)
-        t.start()
+    # Télémétrie : tampon brut partagé (mmap) + agrégats SQLite ; un seul
+    # worker échantillonne
+    telemetry_keys = load_keys()
+    telemetry_ring = RingBuffer(
+        app.config["TELEMETRY_RING_PATH"],
+        list(telemetry_keys),
+        app.config["TELEMETRY_RING_SIZE"],
+    )
+    telemetry_store = TelemetryStore(app.config["RESULTS_DB"])
+    telemetry = None
+    if app.config["TELEMETRY_INTERVAL"] > 0:
+        telemetry = TelemetryPoller(
+            telemetry_ring,
+            telemetry_store,
+            telemetry_keys,
+            app.config["TELEMETRY_INTERVAL"],
+            app.config["TELEMETRY_LOCK_PATH"],
+            driver_factory=HttpDriver,
+            metrics=metrics,
+        )
+        telemetry.start()
+
+    # Journaux CSV : ingestion incrémentale par un seul worker, requêtes
+    # servies depuis SQLite par tous
+    csv_store = CsvStore(app.config["RESULTS_DB"])
+    csv_watcher = None
+    if app.config["TOUCH_CSV_DIR"]:
+        csv_watcher = CsvWatcher(
+            CsvIngestor(csv_store, app.config["TOUCH_CSV_DIR"]),
+            app.config["TOUCH_CSV_INTERVAL"],
+            app.config["TOUCH_CSV_LOCK_PATH"],
+        )
+        csv_watcher.start()
+
+    desired = DesiredState(app.config["RESULTS_DB"])
+    reconciler = Reconciler(
+        desired,
+        _lock,
+        execute=lambda action, progress: _execute(action, time.time(), progress),
+        record=_record,
+        verified_status=_verified_status,
+    )
+    reconciler.start()
+
+    # Programmation : les échéances passent par le réconciliateur, comme /on et /off
+    schedule = ScheduleStore(app.config["RESULTS_DB"])
+    scheduler = None
+    if app.config["SCHEDULER"]:
+        scheduler = Scheduler(
+            schedule,
+            reconciler.submit,
+            app.config["SCHEDULER_LOCK_PATH"],
+            catchup=app.config["SCHEDULER_CATCHUP"],
+        )
+        scheduler.start()
 
     # ---------------------------
     # Routes HTTP
@@ -285,26 +997,52 @@ def create_app():
             os.path.isfile(app.config["SCRIPT_PATH"])
             and os.access(app.config["SCRIPT_PATH"], os.R_OK)
         )
-        return jsonify(
-            {
-                "ok": True,
-                "script_path": app.config["SCRIPT_PATH"],
-                "script_readable": script_ok,
-                "timeout_s": app.config["SCRIPT_TIMEOUT"],
-            }
-        )
+        body = {
+            "ok": True,
+            "script_path": app.config["SCRIPT_PATH"],
+            "script_readable": script_ok,
+            "timeout_s": app.config["SCRIPT_TIMEOUT"],
+            "driver_mode": app.config["DRIVER_MODE"],
+            "fast_path": app.config["FAST_PATH"],
+            "reconciler": reconciler.stats(),
+            "telemetry": telemetry.stats() if telemetry is not None else None,
+            "csv": csv_watcher.stats() if csv_watcher is not None else None,
+            "scheduler": scheduler.stats() if scheduler is not None else None,
+            "probe": probe.stats() if probe is not None else None,
+            "breaker": breaker.stats(),
+            "phase_timeouts_ms": _phase_timeouts(),
+            "artifacts": artifacts.usage(),
+            "memory": memory.stats(),
+            "mqtt": mqtt.stats() if mqtt.enabled else None,
+        }
+        if app.config["DRIVER_MODE"] == "daemon":
+            try:
+                body["driver"] = _driver_request(
+                    app.config["DRIVER_SOCKET"], {"cmd": "ping"}, 2
+                )
+            except Exception as e:
+                body["driver"] = {"ok": False, "error": str(e)}
+        return jsonify(body)
+
+    @app.get("/metrics")
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
     @app.post("/on")
     @require_token
     def turn_on():
-        # On lance le script en arrière-plan, on répond vite à HA/Alexa
-        _run_script_async("on")
+        # On enregistre l'état désiré, le réconciliateur pilote en arrière-plan :
+        # on répond vite à HA/Alexa
+        queue = reconciler.submit("on")
         body = {
             "ok": True,
             "action": "on",
             "status": "pending",
             "changed": None,
             "duration_ms": 0,
+            "job_id": queue["job_id"],
+            "queue_depth": queue["queue_depth"],
+            "coalesced": queue["coalesced"],
             "speech": "Commande d'allumage envoyée à la chaudière.",
         }
         return jsonify(body), 202
@@ -312,22 +1050,428 @@ def create_app():
     @app.post("/off")
     @require_token
     def turn_off():
-        _run_script_async("off")
+        queue = reconciler.submit("off")
         body = {
             "ok": True,
             "action": "off",
             "status": "pending",
             "changed": None,
             "duration_ms": 0,
+            "job_id": queue["job_id"],
+            "queue_depth": queue["queue_depth"],
+            "coalesced": queue["coalesced"],
             "speech": "Commande d'arrêt envoyée à la chaudière.",
         }
         return jsonify(body), 202
 
+    def _wait_job(job_id: str, timeout: float, known_state=None, known_progress=None):
+        """
+        Attend que le job change d'état (ou de progression) ou se termine,
+        au plus `timeout` secondes. Les jobs sont dans SQLite, partagés entre
+        workers : on relit à intervalle court.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = desired.job(job_id)
+            if (
+                job is None
+                or job["state"] == "done"
+                or (known_state is not None and job["state"] != known_state)
+                or (known_progress is not None and job["progress"] != known_progress)
+                or time.monotonic() >= deadline
+            ):
+                return job
+            time.sleep(app.config["JOB_POLL_INTERVAL"])
+
+    @app.get("/jobs/<job_id>")
+    @require_token
+    def get_job(job_id):
+        # Long-poll : ?wait=N attend jusqu'à N secondes la fin du job
+        wait = min(max(request.args.get("wait", default=0, type=float), 0), app.config["JOB_MAX_WAIT"])
+        job = desired.job(job_id)
+        if job is not None and job["state"] != "done" and wait > 0:
+            job = _wait_job(job_id, wait)
+        if job is None:
+            return jsonify({"ok": False, "error": "unknown_job"}), 404
+        return jsonify(job), 200
+
+    @app.get("/jobs/<job_id>/events")
+    @require_token
+    def job_events(job_id):
+        if desired.job(job_id) is None:
+            return jsonify({"ok": False, "error": "unknown_job"}), 404
+
+        def stream():
+            state, progress = None, None
+            deadline = time.monotonic() + app.config["JOB_MAX_WAIT"]
+            job = desired.job(job_id)
+            while job is not None:
+                if job["state"] != state or job["progress"] != progress:
+                    state, progress = job["state"], job["progress"]
+                    event = "result" if state == "done" else "progress"
+                    yield f"event: {event}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+                    if state == "done":
+                        return
+                else:
+                    # Rien de nouveau : commentaire pour garder la connexion ouverte
+                    yield ": keep-alive\n\n"
+                if time.monotonic() >= deadline:
+                    return
+                job = _wait_job(job_id, 15, known_state=state, known_progress=progress)
+
+        return Response(
+            stream_with_context(stream()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.get("/status")
+    @require_token
+    def status():
+        max_age = request.args.get("max_age", type=float)
+        try:
+            value, age, refreshed = status_cache.get(_read_status, max_age)
+        except Exception as e:
+            logging.warning("Lecture du mode impossible : %s", e)
+            age = status_cache.age()
+            if age is None:
+                return jsonify(
+                    {
+                        "ok": False,
+                        "status": "unknown",
+                        "error_code": "status_unavailable",
+                        "error_message": str(e),
+                        "speech": "Je n'arrive pas à lire l'état de la chaudière pour l'instant.",
+                    }
+                ), 503
+            # Valeur périmée mais connue : mieux que rien pour un poller
+            return jsonify(
+                {
+                    "ok": True,
+                    "status": status_cache.status,
+                    "age_s": round(age, 1),
+                    "cached": True,
+                    "stale": True,
+                    "error_message": str(e),
+                }
+            ), 200
+
+        body = {
+            "ok": True,
+            "status": value,
+            "age_s": round(age, 1),
+            "cached": not refreshed,
+            "stale": False,
+        }
+        return jsonify(body), 200
+
+    @app.get("/telemetry")
+    @require_token
+    def get_telemetry():
+        """
+        Séries de télémétrie : ?from=&to= (epoch s, défaut : dernière heure),
+        &step= (s, défaut : ~500 points).
+        """
+        end = request.args.get("to", default=time.time(), type=float)
+        start = request.args.get("from", default=end - 3600, type=float)
+        if start >= end:
+            return jsonify({"ok": False, "error": "invalid_range"}), 400
+        step = request.args.get("step", type=float)
+        if step is None:
+            step = max(app.config["TELEMETRY_INTERVAL"] or 60, (end - start) / 500)
+        if step <= 0 or (end - start) / step > MAX_POINTS:
+            return jsonify(
+                {"ok": False, "error": "invalid_step", "max_points": MAX_POINTS}
+            ), 400
+
+        source, series = query_series(telemetry_ring, telemetry_store, start, end, step)
+        return jsonify(
+            {
+                "ok": True,
+                "from": start,
+                "to": end,
+                "step": step,
+                "source": source,
+                "series": series,
+            }
+        ), 200
+
+    def _csv_range():
+        end = request.args.get("to", default=time.time(), type=float)
+        start = request.args.get("from", default=end - 86400, type=float)
+        return start, end
+
+    @app.get("/csv/columns")
+    @require_token
+    def csv_columns():
+        return jsonify(
+            {"ok": True, "columns": csv_store.columns(), "files": csv_store.files()}
+        ), 200
+
+    @app.get("/csv/series")
+    @require_token
+    def csv_series():
+        """
+        ?column=&from=&to= (epoch s, défaut : dernières 24 h)&limit=
+        """
+        column = request.args.get("column", "")
+        start, end = _csv_range()
+        limit = max(1, min(request.args.get("limit", default=10000, type=int), 100000))
+        points = csv_store.series(column, start, end, limit)
+        if points is None:
+            return jsonify({"ok": False, "error": "unknown_column", "column": column}), 404
+        return jsonify(
+            {"ok": True, "column": column, "from": start, "to": end, "points": points}
+        ), 200
+
+    @app.get("/csv/aggregate")
+    @require_token
+    def csv_aggregate():
+        """
+        ?column=&from=&to=&bucket=hour|day : min / max / moyenne par tranche.
+        """
+        column = request.args.get("column", "")
+        bucket = request.args.get("bucket", "hour")
+        if bucket not in BUCKETS:
+            return jsonify({"ok": False, "error": "invalid_bucket"}), 400
+        start, end = _csv_range()
+        rows = csv_store.aggregate(column, start, end, bucket)
+        if rows is None:
+            return jsonify({"ok": False, "error": "unknown_column", "column": column}), 404
+        return jsonify(
+            {
+                "ok": True,
+                "column": column,
+                "bucket": bucket,
+                "from": start,
+                "to": end,
+                "buckets": rows,
+            }
+        ), 200
+
+    @app.get("/schedule")
+    @require_token
+    def get_schedule():
+        return jsonify(
+            {
+                "ok": True,
+                "enabled": scheduler is not None,
+                "weekly": schedule.weekly(),
+                "overrides": schedule.overrides(),
+                "next": schedule.upcoming(time.time()),
+            }
+        ), 200
+
+    @app.post("/schedule/weekly")
+    @require_token
+    def add_weekly():
+        """
+        Body JSON : {"days": "lun-ven", "time": "06:30", "action": "on"}
+        """
+        body = request.get_json(silent=True) or {}
+        action = body.get("action")
+        if action not in ("on", "off"):
+            return jsonify({"ok": False, "error": "invalid_action"}), 400
+        try:
+            days = parse_days(body.get("days", "*"))
+            hour, minute = parse_time_of_day(body.get("time", ""))
+        except ValueError as e:
+            return jsonify({"ok": False, "error": "invalid_schedule", "error_message": str(e)}), 400
+        entry_id = schedule.add_weekly(days, hour, minute, action)
+        if scheduler is not None:
+            scheduler.wake()
+        return jsonify({"ok": True, "id": entry_id, "days": days,
+                        "time": f"{hour:02d}:{minute:02d}", "action": action}), 201
+
+    @app.post("/schedule/overrides")
+    @require_token
+    def add_override():
+        """
+        Body JSON : {"at": "2026-10-20T06:30" | epoch, "action": "off"}
+        """
+        body = request.get_json(silent=True) or {}
+        action = body.get("action")
+        if action not in ("on", "off"):
+            return jsonify({"ok": False, "error": "invalid_action"}), 400
+        try:
+            at = parse_when(body.get("at"))
+        except (TypeError, ValueError) as e:
+            return jsonify({"ok": False, "error": "invalid_schedule", "error_message": str(e)}), 400
+        # Une dérogation passée ne serait jamais exécutée (seul le rattrapage
+        # au démarrage résout les échéances passées)
+        if at <= time.time():
+            return jsonify(
+                {"ok": False, "error": "invalid_schedule", "error_message": "Date déjà passée."}
+            ), 400
+        entry_id = schedule.add_override(at, action)
+        if scheduler is not None:
+            scheduler.wake()
+        return jsonify({"ok": True, "id": entry_id, "at": at, "action": action}), 201
+
+    @app.delete("/schedule/<kind>/<int:entry_id>")
+    @require_token
+    def delete_schedule(kind, entry_id):
+        if kind not in ("weekly", "overrides"):
+            return jsonify({"ok": False, "error": "not_found"}), 404
+        if not schedule.delete(kind, entry_id):
+            return jsonify({"ok": False, "error": "not_found"}), 404
+        if scheduler is not None:
+            scheduler.wake()
+        return jsonify({"ok": True, "id": entry_id}), 200
+
+    @app.get("/targets")
+    @require_token
+    def list_targets():
+        return jsonify(
+            {
+                "ok": True,
+                "boilers": {boiler_id: b.describe() for boiler_id, b in boilers.items()},
+                "targets": [t for b in boilers.values() for t in b.targets()],
+                "default_target": main_target,
+            }
+        ), 200
+
+    @app.post("/batch")
+    @require_token
+    def batch():
+        """
+        Body JSON : {"action": "on" | "off" | "status", "targets": ["maison/Chf1", ...]}
+        Réponse : un résultat par cible (200 tout OK, 207 partiel, 500 échec).
+        """
+        body = request.get_json(silent=True) or {}
+        action = body.get("action")
+        if action not in ("on", "off", "status"):
+            return jsonify({"ok": False, "error": "invalid_action"}), 400
+        raw_targets = body.get("targets")
+        if not isinstance(raw_targets, list) or not raw_targets:
+            return jsonify({"ok": False, "error": "missing_targets"}), 400
+        targets = []
+        for raw in raw_targets:
+            try:
+                target = normalize_target(raw, boilers)
+            except ValueError as e:
+                return jsonify(
+                    {"ok": False, "error": "invalid_target", "error_message": str(e)}
+                ), 400
+            if target not in targets:
+                targets.append(target)
+
+        start = time.time()
+        if not _lock.acquire(timeout=app.config["SCRIPT_TIMEOUT"]):
+            metrics.inc("okofen_busy_total")
+            return jsonify(
+                {
+                    "ok": False,
+                    "error": "busy",
+                    "speech": "Une commande est déjà en cours, réessayez dans un instant.",
+                }
+            ), 503
+        try:
+            # Même disjoncteur et même budget mémoire que _execute
+            if not breaker.allow():
+                logging.warning("Chaudière injoignable, batch %s refusé", action)
+                http_code, payload = unreachable_payload(action, breaker.retry_in())
+                payload["targets"] = targets
+            else:
+                allowed, used, estimate = memory.wait(app.config["MEMORY_WAIT"])
+                if allowed:
+                    http_code, payload = _run_batch(action, targets, start)
+                    _record_reachability(payload)
+                else:
+                    breaker.release_trial()
+                    http_code, payload = memory_payload(action, used, estimate, memory.budget_mb)
+                    payload["targets"] = targets
+            _record("batch", http_code, payload, update_status=False)
+        finally:
+            _lock.release()
+        return jsonify(payload), http_code
+
+    @app.get("/params")
+    @require_token
+    def list_params():
+        return jsonify(
+            {
+                "ok": True,
+                "pages": param_pages,
+                "fields": {name: p.describe() for name, p in params_registry.items()},
+            }
+        ), 200
+
+    @app.post("/params")
+    @require_token
+    def write_params():
+        """
+        Body JSON : {"params": {"comfort_temp": 21, ...}}
+                 ou {"params": [{"field": "comfort_temp", "value": 21}, ...]}
+        Tous les champs sont validés avant d'ouvrir le navigateur, puis
+        appliqués et vérifiés dans une seule session. Réponse : un résultat
+        par champ (200 tout appliqué, 207 partiel, 500 échec).
+        """
+        body = request.get_json(silent=True) or {}
+        changes, errors = validate_params(body.get("params"), params_registry)
+        if errors:
+            return jsonify({"ok": False, "error": "invalid_params", "errors": errors}), 400
+
+        start = time.time()
+        if not _lock.acquire(timeout=app.config["SCRIPT_TIMEOUT"]):
+            metrics.inc("okofen_busy_total")
+            return jsonify(
+                {
+                    "ok": False,
+                    "error": "busy",
+                    "speech": "Une commande est déjà en cours, réessayez dans un instant.",
+                }
+            ), 503
+        try:
+            http_code, payload = _execute("params", start, changes=changes)
+            _record("params", http_code, payload, update_status=False)
+        finally:
+            _lock.release()
+        return jsonify(payload), http_code
+
+    @app.get("/traces")
+    @require_token
+    def get_traces():
+        """
+        Traces détaillées des dernières exécutions (?limit=N), ou d'une
+        seule (?id=, cf. "trace_id" des résultats).
+        """
+        trace_id = request.args.get("id", type=int)
+        if trace_id is not None:
+            trace = traces.get(trace_id)
+            if trace is None:
+                return jsonify({"ok": False, "error": "unknown_trace"}), 404
+            return jsonify({"ok": True, "traces": [trace]}), 200
+        limit = request.args.get("limit", default=traces.size, type=int)
+        return jsonify({"ok": True, "size": traces.size, "traces": traces.last(max(1, limit))}), 200
+
+    @app.get("/runs/<run_id>/artifacts")
+    @require_token
+    def list_artifacts(run_id):
+        """
+        Captures d'une exécution en échec (cf. "run_id" / "artifacts_url"
+        des résultats).
+        """
+        files = artifacts.list(run_id)
+        if files is None:
+            return jsonify({"ok": False, "error": "unknown_run"}), 404
+        for f in files:
+            f["url"] = f"/runs/{run_id}/artifacts/{f['name']}"
+        return jsonify({"ok": True, "run_id": run_id, "artifacts": files}), 200
+
+    @app.get("/runs/<run_id>/artifacts/<name>")
+    @require_token
+    def get_artifact(run_id, name):
+        path = artifacts.file_path(run_id, name)
+        if path is None:
+            return jsonify({"ok": False, "error": "unknown_artifact"}), 404
+        return send_file(path, as_attachment=name.endswith(".zip"))
+
     @app.get("/last")
     @require_token
     def last():
-        nonlocal last_result
-        if last_result is None:
+        rows = results.last(1)
+        if not rows:
             return jsonify(
                 {
                     "ok": False,
@@ -335,7 +1479,21 @@ def create_app():
                     "speech": "Aucune commande chaudière n'a encore été exécutée.",
                 }
             ), 404
-        return jsonify(last_result), 200
+        return jsonify(rows[0]["payload"]), 200
+
+    @app.get("/results")
+    @require_token
+    def last_results():
+        limit = max(1, min(request.args.get("limit", default=10, type=int), 500))
+        return jsonify(
+            {
+                "ok": True,
+                "results": [
+                    {"id": r["id"], "ts": r["ts"], "http_code": r["http_code"], **r["payload"]}
+                    for r in results.last(limit, request.args.get("action"))
+                ],
+            }
+        ), 200
 
     return app
 
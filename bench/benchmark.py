@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Banc de mesure de latence bout en bout : N cycles off/on.
+
+Cibles :
+  - script : python Okofen_Playwright.py off|on (un processus par commande)
+  - http   : okofen_http.HttpDriver (chemin rapide, dans ce processus)
+  - api    : API Flask (POST /off|/on puis GET /jobs/<id>?wait=)
+
+Avec --mock, un mock Pellematic (bench/mock_pellematic.py) est démarré
+localement et OKOFEN_URL / OKOFEN_USER / OKOFEN_PASSWORD pointent dessus
+(cibles script et http ; pour la cible api, lancer l'API avec OKOFEN_URL
+pointant sur un mock démarré à part).
+
+Rapporte p50 / p95 / p99, débit et RSS max (processus + enfants).
+
+    python bench/benchmark.py --target script --cycles 10 --mock
+    python bench/benchmark.py --target api --api http://127.0.0.1:5000 --token XXX
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, pct: float):
+    """
+    Percentile par interpolation linéaire (values non vide).
+    """
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def max_rss_mb():
+    """
+    RSS max (Mo) de ce processus et de ses enfants terminés.
+    ru_maxrss est en Ko sous Linux.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(own / 1024.0, 1), round(children / 1024.0, 1)
+
+
+# ---------------------------
+# Cibles
+# ---------------------------
+
+def run_script(action: str, opts):
+    proc = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "Okofen_Playwright.py"), action],
+        capture_output=True,
+        text=True,
+        timeout=opts.timeout,
+        env={**os.environ},
+    )
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith("OKOFEN_SUMMARY:"):
+            return json.loads(line[len("OKOFEN_SUMMARY:"):])
+    return {"ok": False, "error": f"rc={proc.returncode}, pas de résumé"}
+
+
+def make_http_target():
+    from okofen_http import HttpDriver, FastPathError
+
+    driver = HttpDriver()
+
+    def run_http(action: str, opts):
+        try:
+            return driver.run(action)
+        except FastPathError as e:
+            return {"ok": False, "error": str(e)}
+
+    return run_http
+
+
+def make_api_target(opts):
+    session = requests.Session()
+    session.headers["Authorization"] = f"Bearer {opts.token}"
+
+    def run_api(action: str, opts):
+        resp = session.post(f"{opts.api}/{action}", timeout=10)
+        job_id = resp.json().get("job_id")
+        if not job_id:
+            return {"ok": False, "error": f"HTTP {resp.status_code} sans job_id"}
+        resp = session.get(
+            f"{opts.api}/jobs/{job_id}", params={"wait": opts.timeout}, timeout=opts.timeout + 10
+        )
+        job = resp.json()
+        result = job.get("result") or {}
+        return {"ok": bool(result.get("ok")), "error": result.get("error_message")}
+
+    return run_api
+
+
+# ---------------------------
+# Boucle de mesure
+# ---------------------------
+
+def bench(target, opts):
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    for cycle in range(opts.cycles):
+        for action in ("off", "on"):
+            t0 = time.perf_counter()
+            try:
+                summary = target(action, opts)
+            except Exception as e:
+                summary = {"ok": False, "error": str(e)}
+            elapsed = time.perf_counter() - t0
+            latencies.append(elapsed)
+            if not summary.get("ok"):
+                errors.append(summary.get("error"))
+            if opts.verbose:
+                print(f"cycle={cycle} action={action} {elapsed * 1000:.0f} ms ok={summary.get('ok')}")
+    total = time.perf_counter() - start
+
+    rss_self, rss_children = max_rss_mb()
+    return {
+        "target": opts.target,
+        "commands": len(latencies),
+        "errors": len(errors),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 1),
+        "throughput_per_s": round(len(latencies) / total, 3),
+        "max_rss_mb": rss_self,
+        "max_rss_children_mb": rss_children,
+        "first_errors": errors[:3],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc de latence Okofen (cycles off/on)")
+    parser.add_argument("--target", choices=("script", "http", "api"), default="script")
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--mock", action="store_true",
+                        help="démarre un mock Pellematic local et l'utilise comme OKOFEN_URL")
+    parser.add_argument("--mock-args", default="",
+                        help="options passées au mock, ex: \"--delay-ms 50 --fail-rate 0.05\"")
+    parser.add_argument("--api", default="http://127.0.0.1:5000")
+    parser.add_argument("--token", default=os.getenv("OKOFEN_TOKEN", "change-me"))
+    parser.add_argument("--json", action="store_true", help="sortie JSON brute")
+    parser.add_argument("--verbose", action="store_true")
+    opts = parser.parse_args(argv)
+
+    if opts.mock:
+        sys.path.insert(0, os.path.join(ROOT, "bench"))
+        import mock_pellematic
+
+        server, _state = mock_pellematic.start(0, opts.mock_args.split())
+        mock_opts = mock_pellematic.parse_args(opts.mock_args.split())
+        os.environ["OKOFEN_URL"] = f"http://{mock_opts.host}:{server.server_address[1]}"
+        os.environ["OKOFEN_USER"] = mock_opts.user
+        os.environ["OKOFEN_PASSWORD"] = mock_opts.password
+        # Cache de session propre au banc (ne pas toucher à celui de prod)
+        os.environ.setdefault("STORAGE_STATE_PATH", "/tmp/okofen-bench-storage-state.json")
+        print(f"Mock Pellematic : {os.environ['OKOFEN_URL']}", file=sys.stderr)
+
+    if opts.target == "script":
+        target = run_script
+    elif opts.target == "http":
+        target = make_http_target()
+    else:
+        target = make_api_target(opts)
+
+    report = bench(target, opts)
+    if opts.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            print(f"{key:>22} : {value}")
+
+
+if __name__ == "__main__":
+    main()
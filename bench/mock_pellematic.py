@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Serveur local imitant l'interface web Pellematic utilisée par
+Okofen_Playwright.py et okofen_http.py, pour tester et mesurer sans chaudière.
+
+Pages reproduites :
+  - /login.cgi      ligne "Francais", champs "Identifiant:" / "Mot de passe:",
+                    bouton "Accès" (POST vers /index.cgi)
+  - /               accueil avec les liens "Chf1 Chauffage"... (+ polling de fond)
+  - /hk1 ... /hkN   page du circuit : "Nom du circuitChauffage", "ModeAuto" /
+                    "ModeArrêt", popup Auto / Arrêt puis bouton "OK"
+                    (circuits déclarés par --circuits)
+  - POST /?action=get&attr=1 et /?action=set : API JSON du chemin rapide
+
+Injection de latence et de pannes par options (voir --help).
+
+    python bench/mock_pellematic.py --port 8080 --delay-ms 50 --fail-rate 0.05
+"""
+import sys
+import json
+import time
+import random
+import secrets
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+MODE_KEY = "CAPPL:LOCAL.hk[0].betriebsart[1]"
+
+
+def mode_key(circuit: int):
+    return f"CAPPL:LOCAL.hk[{circuit - 1}].betriebsart[1]"
+
+
+# Capteurs lus par la télémétrie (okofen_telemetry.DEFAULT_KEYS) :
+# clé -> (valeur initiale brute, pas max de la marche aléatoire)
+SENSORS = {
+    "CAPPL:LOCAL.L_aussentemperatur_ist": (52, 3),
+    "CAPPL:FA[0].L_kesseltemperatur": (650, 10),
+    "CAPPL:LOCAL.L_hk[0].vorlauftemp_ist": (420, 8),
+    "CAPPL:LOCAL.L_ww[0].temp_ist": (480, 4),
+    "CAPPL:FA[0].L_modulation": (60, 5),
+    "CAPPL:LOCAL.L_pu[0].pelletsvorrat": (1800, 1),
+}
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html lang="fr"><head><meta charset="utf-8"><title>Pellematic</title>
+<link rel="stylesheet" href="/static/style.css"></head>
+<body>
+<table><tr><td>Deutsch</td></tr><tr><td>Francais</td></tr><tr><td>English</td></tr></table>
+<form method="post" action="/index.cgi">
+  <label for="username">Identifiant:</label>
+  <input type="text" id="username" name="username">
+  <label for="password">Mot de passe:</label>
+  <input type="password" id="password" name="password">
+  <input type="hidden" name="language" value="fr">
+  <input type="submit" name="submit" value="Accès">
+</form>
+</body></html>
+"""
+
+HOME_PAGE = """<!DOCTYPE html>
+<html lang="fr"><head><meta charset="utf-8"><title>Pellematic</title>
+<link rel="stylesheet" href="/static/style.css"></head>
+<body>
+<img src="/static/logo.png" alt="logo">
+<nav><a href="/">Home</a> %(circuit_links)s</nav>
+<div id="values"></div>
+<script>
+  // L'interface réelle interroge la chaudière en continu
+  setInterval(function () {
+    fetch("/?action=get&attr=1", {method: "POST", body: JSON.stringify(["%(mode_key)s"])});
+  }, %(poll_ms)d);
+</script>
+</body></html>
+"""
+
+CIRCUIT_PAGE = """<!DOCTYPE html>
+<html lang="fr"><head><meta charset="utf-8"><title>Chf%(circuit)d</title>
+<link rel="stylesheet" href="/static/style.css"></head>
+<body>
+<nav><a href="/">Home</a></nav>
+<div>Nom du circuit<span>%(circuit_name)s</span></div>
+<div id="mode" onclick="openPopup()">Mode<span id="mode-value">%(mode_label)s</span></div>
+<div id="popup" style="display:none"></div>
+<script>
+  var pending = null;
+  function openPopup() {
+    var p = document.getElementById("popup");
+    p.innerHTML = '<button onclick="choose(1)">Auto</button>'
+      + '<button onclick="choose(0)">Arrêt</button>';
+    p.style.display = "block";
+  }
+  function choose(v) {
+    pending = v;
+    document.getElementById("popup").innerHTML = '<button onclick="confirmMode()">OK</button>';
+  }
+  function confirmMode() {
+    var body = {};
+    body["%(mode_key)s"] = String(pending);
+    fetch("/?action=set", {method: "POST", body: JSON.stringify(body)})
+      .then(function (r) { return r.json(); })
+      .then(function (data) {
+        document.getElementById("mode-value").textContent = data.label;
+        var p = document.getElementById("popup");
+        p.innerHTML = "";
+        p.style.display = "none";
+      });
+  }
+</script>
+</body></html>
+"""
+
+# PNG 1x1 transparent (pour tester le blocage des ressources)
+PIXEL_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+
+class BoilerState:
+    def __init__(self, mode: str = "1", circuits=("Chauffage",)):
+        self.lock = threading.Lock()
+        self.circuits = list(circuits)
+        self.values = {mode_key(n): mode for n in range(1, len(self.circuits) + 1)}
+        self.sensors = {key: float(initial) for key, (initial, _) in SENSORS.items()}
+        self.sessions = set()
+        self.requests = 0
+
+    def read(self, key: str):
+        """
+        Valeur brute d'une clé ; les capteurs évoluent à chaque lecture.
+        """
+        if key in self.sensors:
+            step = SENSORS[key][1]
+            self.sensors[key] = max(0.0, self.sensors[key] + random.uniform(-step, step))
+            return str(int(self.sensors[key]))
+        return self.values.get(key)
+
+    def mode_label(self, key: str = MODE_KEY):
+        return "Auto" if self.values[key] == "1" else "Arrêt"
+
+
+def make_handler(state: BoilerState, opts):
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "MockPellematic/1.0"
+
+        def log_message(self, fmt, *args):
+            if opts.verbose:
+                super().log_message(fmt, *args)
+
+        # ---------------------------
+        # Outils
+        # ---------------------------
+
+        def _inject(self) -> bool:
+            """
+            Applique latence et pannes simulées. Retourne False si la
+            requête a été servie en erreur.
+            """
+            with state.lock:
+                state.requests += 1
+            if opts.delay_ms:
+                time.sleep(opts.delay_ms / 1000.0)
+            if opts.fail_rate and random.random() < opts.fail_rate:
+                self._send(500, "text/plain", b"panne simulee")
+                return False
+            return True
+
+        def _send(self, code, content_type, body: bytes, headers=None):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _redirect(self, location, headers=None):
+            self._send(302, "text/plain", b"", {"Location": location, **(headers or {})})
+
+        def _html(self, page: str):
+            self._send(200, "text/html; charset=utf-8", page.encode("utf-8"))
+
+        def _json(self, data):
+            self._send(200, "application/json", json.dumps(data).encode("utf-8"))
+
+        def _logged_in(self) -> bool:
+            cookie = self.headers.get("Cookie", "")
+            for part in cookie.split(";"):
+                name, _, value = part.strip().partition("=")
+                if name == "session" and value in state.sessions:
+                    return True
+            return False
+
+        def _body(self) -> bytes:
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        # ---------------------------
+        # Routes
+        # ---------------------------
+
+        def do_GET(self):
+            if not self._inject():
+                return
+            path = urlsplit(self.path).path
+            if path == "/login.cgi":
+                return self._html(LOGIN_PAGE)
+            if path == "/static/logo.png":
+                return self._send(200, "image/png", PIXEL_PNG)
+            if path == "/static/style.css":
+                return self._send(200, "text/css", b"body { font-family: sans-serif; }")
+            if not self._logged_in():
+                return self._redirect("/login.cgi")
+            if path == "/":
+                links = " ".join(
+                    f'<a href="/hk{n}">Chf{n} {name}</a>'
+                    for n, name in enumerate(state.circuits, start=1)
+                )
+                return self._html(HOME_PAGE % {
+                    "mode_key": MODE_KEY, "poll_ms": opts.poll_ms, "circuit_links": links,
+                })
+            if path.startswith("/hk") and path[3:].isdigit():
+                circuit = int(path[3:])
+                if 1 <= circuit <= len(state.circuits):
+                    key = mode_key(circuit)
+                    return self._html(CIRCUIT_PAGE % {
+                        "mode_key": key,
+                        "mode_label": state.mode_label(key),
+                        "circuit": circuit,
+                        "circuit_name": state.circuits[circuit - 1],
+                    })
+            self._send(404, "text/plain", b"not found")
+
+        def do_POST(self):
+            if not self._inject():
+                return
+            url = urlsplit(self.path)
+            body = self._body()
+
+            if url.path == "/index.cgi":
+                form = parse_qs(body.decode("utf-8"))
+                if opts.login_delay_ms:
+                    time.sleep(opts.login_delay_ms / 1000.0)
+                if (
+                    form.get("username", [""])[0] == opts.user
+                    and form.get("password", [""])[0] == opts.password
+                ):
+                    token = secrets.token_hex(8)
+                    with state.lock:
+                        state.sessions.add(token)
+                    return self._redirect("/", {"Set-Cookie": f"session={token}; Path=/"})
+                return self._redirect("/login.cgi")
+
+            if url.path == "/":
+                if not self._logged_in():
+                    return self._redirect("/login.cgi")
+                action = parse_qs(url.query).get("action", [""])[0]
+                try:
+                    data = json.loads(body or b"null")
+                except ValueError:
+                    return self._send(400, "text/plain", b"bad json")
+                if action == "get":
+                    with state.lock:
+                        return self._json([
+                            {"name": key, "value": state.read(key)}
+                            for key in (data or [])
+                            if key in state.values or key in state.sensors
+                        ])
+                if action == "set":
+                    with state.lock:
+                        # Panne silencieuse : la chaudière accepte mais n'applique pas
+                        keys = [key for key in (data or {}) if key in state.values]
+                        if not (opts.drop_set_rate and random.random() < opts.drop_set_rate):
+                            for key in keys:
+                                state.values[key] = str(data[key])
+                        label = state.mode_label(keys[0] if keys else MODE_KEY)
+                        return self._json({"ok": True, "label": label})
+            self._send(404, "text/plain", b"not found")
+
+    return Handler
+
+
+def start(port: int = None, argv=None):
+    """
+    Démarre le serveur dans un thread (port 0 = port libre choisi par l'OS).
+    Retourne (server, state). Utilisé par bench/benchmark.py.
+    """
+    opts = parse_args(argv or [])
+    state = BoilerState(opts.initial_mode, opts.circuits.split(","))
+    port = opts.port if port is None else port
+    server = ThreadingHTTPServer((opts.host, port), make_handler(state, opts))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Mock de l'interface web Pellematic")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--user", default="okofen")
+    parser.add_argument("--password", default="okofen")
+    parser.add_argument("--initial-mode", choices=("0", "1"), default="1",
+                        help="mode initial : 1 = Auto, 0 = Arrêt")
+    parser.add_argument("--circuits", default="Chauffage",
+                        help="noms des circuits Chf1..ChfN, séparés par des virgules")
+    parser.add_argument("--delay-ms", type=int, default=0,
+                        help="latence ajoutée à chaque réponse")
+    parser.add_argument("--login-delay-ms", type=int, default=0,
+                        help="latence supplémentaire du POST de login")
+    parser.add_argument("--poll-ms", type=int, default=400,
+                        help="période du polling de fond de la page d'accueil")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="probabilité qu'une requête réponde 500")
+    parser.add_argument("--drop-set-rate", type=float, default=0.0,
+                        help="probabilité qu'un changement de mode soit ignoré")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    opts = parse_args(sys.argv[1:])
+    state = BoilerState(opts.initial_mode, opts.circuits.split(","))
+    server = ThreadingHTTPServer((opts.host, opts.port), make_handler(state, opts))
+    print(f"Mock Pellematic sur http://{opts.host}:{opts.port} "
+          f"(utilisateur={opts.user}, mot de passe={opts.password})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,239 @@
+"""
+Captures de diagnostic des exécutions en échec (ou trop lentes) : trace
+Playwright (trace.zip), capture d'écran et DOM de la page au moment de
+l'échec.
+
+Un répertoire par exécution (run_id) sous ARTIFACTS_DIR. Le total est borné
+à ARTIFACTS_MAX_BYTES : au-delà, les exécutions les moins récemment
+utilisées (date de modification du répertoire, mise à jour à chaque
+consultation via /runs/<id>/artifacts) sont supprimées.
+"""
+import os
+import re
+import json
+import uuid
+import shutil
+import logging
+import zipfile
+
+ARTIFACTS_DIR = os.getenv("ARTIFACTS_DIR", "/tmp/okofen-artifacts")
+ARTIFACTS_MAX_BYTES = int(os.getenv("ARTIFACTS_MAX_BYTES", str(50 * 1024 * 1024)))
+
+_RUN_ID_RE = re.compile(r"^[0-9a-f]{8,32}$")
+_NAME_RE = re.compile(r"^[\w.-]+$")
+
+# Données de session masquées dans les traces Playwright
+SENSITIVE_HEADERS = {"cookie", "set-cookie", "authorization"}
+# Le formulaire de login.cgi poste les identifiants vers index.cgi
+# (cf. okofen_http.HttpDriver.login)
+LOGIN_PATHS = ("login.cgi", "index.cgi")
+REDACTED = "[masqué]"
+
+
+def new_run_id():
+    return uuid.uuid4().hex[:16]
+
+
+def valid_run_id(run_id: str):
+    return bool(run_id) and _RUN_ID_RE.match(run_id) is not None
+
+
+def _redact_resource(snapshot: dict, dropped: set):
+    request = snapshot.get("request") or {}
+    for part in (request, snapshot.get("response") or {}):
+        for header in part.get("headers") or []:
+            if str(header.get("name", "")).lower() in SENSITIVE_HEADERS:
+                header["value"] = REDACTED
+        for cookie in part.get("cookies") or []:
+            cookie["value"] = REDACTED
+    post = request.get("postData")
+    if post and any(p in request.get("url", "") for p in LOGIN_PATHS):
+        if not isinstance(post, dict):
+            request["postData"] = REDACTED
+            return
+        # Corps éventuellement stocké à part (resources/<sha1>)
+        if post.get("_sha1"):
+            dropped.add(post["_sha1"])
+        request["postData"] = {"mimeType": post.get("mimeType", ""), "text": REDACTED}
+
+
+def _redact_events(data: bytes, dropped: set):
+    """
+    Événements d'une trace (une ligne JSON par événement), données de
+    session masquées.
+    """
+    lines = []
+    for line in data.decode("utf-8").splitlines():
+        try:
+            event = json.loads(line)
+        except ValueError:
+            lines.append(line)
+            continue
+        if isinstance(event, dict) and event.get("type") == "resource-snapshot":
+            _redact_resource(event.get("snapshot") or {}, dropped)
+            line = json.dumps(event, ensure_ascii=False)
+        lines.append(line)
+    return "\n".join(lines).encode("utf-8")
+
+
+class ArtifactStore:
+    def __init__(self, root: str = ARTIFACTS_DIR, max_bytes: int = ARTIFACTS_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def _run_dir(self, run_id: str):
+        if not valid_run_id(run_id):
+            raise ValueError(f"run_id invalide : {run_id!r}")
+        return os.path.join(self.root, run_id)
+
+    def path(self, run_id: str, name: str):
+        """
+        Chemin d'un fichier à écrire (répertoire de l'exécution créé).
+        """
+        if not _NAME_RE.match(name):
+            raise ValueError(f"Nom d'artefact invalide : {name!r}")
+        run_dir = self._run_dir(run_id)
+        os.makedirs(run_dir, mode=0o700, exist_ok=True)
+        return os.path.join(run_dir, name)
+
+    def write(self, run_id: str, name: str, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        path = self.path(run_id, name)
+        # 0600 quel que soit l'umask, comme les répertoires (0700)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(path, 0o600)
+        return path
+
+    def redact_trace(self, path: str):
+        """
+        Réécrit (en 0600) le trace.zip écrit par Playwright sans les données
+        de session : en-têtes Cookie / Set-Cookie / Authorization, cookies,
+        et corps des requêtes de login (ressources associées supprimées).
+        """
+        try:
+            self._redact_zip(path)
+        except Exception:
+            # Jamais de trace non masquée sur disque
+            for name in (path, path + ".tmp"):
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass
+            raise
+
+    def _redact_zip(self, path: str):
+        members = []
+        dropped = set()
+        with zipfile.ZipFile(path) as src:
+            for item in src.infolist():
+                data = src.read(item.filename)
+                if item.filename.endswith((".trace", ".network")):
+                    data = _redact_events(data, dropped)
+                members.append((item, data))
+        tmp = path + ".tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as dst:
+            for item, data in members:
+                if os.path.basename(item.filename) in dropped:
+                    continue
+                dst.writestr(item, data)
+        os.replace(tmp, path)
+
+    # ---------------------------
+    # Lecture (app.py)
+    # ---------------------------
+
+    def list(self, run_id: str):
+        """
+        [{"name", "size", "mtime"}] des fichiers de l'exécution, None si
+        elle n'a (plus) aucun artefact. Compte comme une utilisation (LRU).
+        """
+        if not valid_run_id(run_id):
+            return None
+        run_dir = os.path.join(self.root, run_id)
+        try:
+            names = sorted(os.listdir(run_dir))
+            os.utime(run_dir)
+        except FileNotFoundError:
+            return None
+        files = []
+        for name in names:
+            try:
+                st = os.stat(os.path.join(run_dir, name))
+            except FileNotFoundError:
+                continue
+            files.append({"name": name, "size": st.st_size, "mtime": st.st_mtime})
+        return files
+
+    def file_path(self, run_id: str, name: str):
+        """
+        Chemin d'un artefact existant, None sinon.
+        """
+        if not valid_run_id(run_id) or not _NAME_RE.match(name):
+            return None
+        path = os.path.join(self.root, run_id, name)
+        if not os.path.isfile(path):
+            return None
+        os.utime(os.path.dirname(path))
+        return path
+
+    # ---------------------------
+    # Budget
+    # ---------------------------
+
+    def _runs(self):
+        """
+        [(mtime, taille, run_id)] de toutes les exécutions capturées.
+        """
+        runs = []
+        try:
+            entries = os.listdir(self.root)
+        except FileNotFoundError:
+            return runs
+        for run_id in entries:
+            run_dir = os.path.join(self.root, run_id)
+            if not valid_run_id(run_id) or not os.path.isdir(run_dir):
+                continue
+            size = 0
+            for name in os.listdir(run_dir):
+                try:
+                    size += os.path.getsize(os.path.join(run_dir, name))
+                except OSError:
+                    pass
+            runs.append((os.path.getmtime(run_dir), size, run_id))
+        return runs
+
+    def usage(self):
+        runs = self._runs()
+        return {
+            "dir": self.root,
+            "runs": len(runs),
+            "bytes": sum(size for _, size, _ in runs),
+            "max_bytes": self.max_bytes,
+        }
+
+    def enforce_budget(self, keep: str = None):
+        """
+        Supprime les exécutions les moins récemment utilisées tant que le
+        total dépasse max_bytes (sauf `keep`, l'exécution qui vient d'être
+        capturée). Retourne le nombre d'exécutions supprimées.
+        """
+        runs = sorted(self._runs())
+        total = sum(size for _, size, _ in runs)
+        evicted = 0
+        for _, size, run_id in runs:
+            if total <= self.max_bytes:
+                break
+            if run_id == keep:
+                continue
+            shutil.rmtree(os.path.join(self.root, run_id), ignore_errors=True)
+            total -= size
+            evicted += 1
+        if evicted:
+            logging.getLogger("okofen.artifacts").info(
+                "%s exécution(s) supprimée(s) du répertoire d'artefacts", evicted
+            )
+        return evicted
@@ -0,0 +1,762 @@
+#!/usr/bin/env python3
+"""
+Mode de service asyncio (ASGI) : mêmes routes et mêmes réponses que app.py
+pour /on, /off, /status, /last, /results, /jobs, /traces,
+/runs/<run_id>/artifacts, /healthz et /metrics, mais servies par une seule boucle asyncio (Starlette + uvicorn)
+au lieu de workers gunicorn synchrones.
+
+    uvicorn okofen_asgi:create_app --factory --host 0.0.0.0 --port 5000
+
+Chromium est piloté par playwright.async_api sur cette même boucle et reste
+ouvert entre deux commandes (AsyncDriver, contextes réutilisés via
+okofen_async.ContextPool) : pas de subprocess ni de driver séparé. Les
+clients en attente (long-poll /jobs/<id>?wait=, flux SSE, /status pendant
+une lecture) ne coûtent qu'une coroutine.
+
+L'état partagé est le même que app.py (verrou fichier, SQLite) : les deux
+modes peuvent tourner côte à côte sur la même chaudière. Le réconciliateur
+garde son thread unique ; il soumet chaque exécution à la boucle.
+
+/batch, /params, /telemetry, /csv/* et /schedule restent servis par app.py.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import contextlib
+from functools import wraps
+
+from starlette.applications import Starlette
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from dotenv import load_dotenv
+from playwright.async_api import async_playwright
+
+import Okofen_Playwright as okofen
+from app import (
+    StatusCache, payload_from_summary, timeout_payload, unreachable_payload, memory_payload,
+    setup_logging, SCRIPT_TIMEOUT_DEFAULT,
+)
+from okofen_async import ContextPool, run_target
+from okofen_store import ProcessLock, ResultStore, DesiredState
+from okofen_reconciler import Reconciler
+from okofen_metrics import Metrics
+from okofen_targets import Boiler, DEFAULT_BOILER, load_boilers, parse_target, default_target
+from okofen_health import CircuitBreaker, ReachabilityProbe, AdaptiveTimeouts, unreachable
+from okofen_trace import RunTrace, TraceRing
+from okofen_artifacts import new_run_id
+from okofen_resources import ResourceMonitor, MemoryBudget
+from okofen_mqtt import MqttPublisher
+from okofen_driver import DRIVER_MAX_COMMANDS
+
+
+class AsyncDriver:
+    """
+    Chromium gardé ouvert sur la boucle asyncio, pour la cible de /on et
+    /off. Même politique que okofen_driver.Driver : relance si le navigateur
+    est tombé, recyclage après DRIVER_MAX_COMMANDS commandes.
+    """
+
+    def __init__(self, boiler, circuit: str = "1"):
+        self.boiler = boiler
+        self.circuit = circuit
+        self.playwright = None
+        self.browser = None
+        self.pool = None
+        self.started_at = time.time()
+        self.launched_at = None
+        self.commands_total = 0
+        self.commands_since_launch = 0
+        self.relaunches = 0
+        self.launch_ms = None
+        self._launch_lock = asyncio.Lock()
+
+    async def start(self):
+        self.playwright = await async_playwright().start()
+
+    async def _launch(self):
+        t0 = time.perf_counter()
+        self.browser = await self.playwright.chromium.launch(**okofen.launch_options())
+        self.launch_ms = round((time.perf_counter() - t0) * 1000, 1)
+        self.pool = ContextPool(self.browser, {self.boiler.id: self.boiler}, max_contexts=1)
+        self.launched_at = time.time()
+        self.commands_since_launch = 0
+
+    async def _close_browser(self):
+        if self.pool is not None:
+            await self.pool.close()
+        if self.browser is not None:
+            try:
+                await self.browser.close()
+            except Exception as e:
+                logging.debug("Erreur à la fermeture de Chromium : %s", e)
+        self.pool = None
+        self.browser = None
+
+    def healthy(self):
+        return self.browser is not None and self.browser.is_connected()
+
+    async def ensure_browser(self) -> bool:
+        """
+        Lance (ou relance) Chromium si besoin. True si un lancement a eu lieu.
+        """
+        async with self._launch_lock:
+            if self.browser is None:
+                await self._launch()
+                return True
+            if not self.healthy():
+                logging.warning("Chromium déconnecté, relance")
+                await self._close_browser()
+                await self._launch()
+                self.relaunches += 1
+                return True
+            return False
+
+    async def run(self, action: str, run_id: str = None):
+        launched = await self.ensure_browser()
+        resources = {}
+        try:
+            # Processus du service entier (boucle asyncio + Chromium)
+            with ResourceMonitor(resources):
+                summary = await run_target(self.pool, self.boiler, self.circuit, action, run_id)
+            summary.update(resources)
+            if launched:
+                # Même phase "launch" que le script (Okofen_Playwright.run)
+                summary.setdefault("phases", {})["launch"] = self.launch_ms
+            return summary
+        finally:
+            self.commands_total += 1
+            self.commands_since_launch += 1
+            if DRIVER_MAX_COMMANDS > 0 and self.commands_since_launch >= DRIVER_MAX_COMMANDS:
+                logging.info("Recyclage de Chromium (nombre maximal de commandes)")
+                await self._close_browser()
+                self.relaunches += 1
+
+    async def close(self):
+        await self._close_browser()
+        if self.playwright is not None:
+            await self.playwright.stop()
+            self.playwright = None
+
+    def stats(self):
+        now = time.time()
+        return {
+            "ok": self.healthy(),
+            "target": f"{self.boiler.id}/Chf{self.circuit}",
+            "uptime_s": int(now - self.started_at),
+            "browser_age_s": int(now - self.launched_at) if self.launched_at else None,
+            "commands_total": self.commands_total,
+            "commands_since_launch": self.commands_since_launch,
+            "relaunches": self.relaunches,
+            "launch_ms": self.launch_ms,
+        }
+
+
+def _query_float(request, name: str, default=None):
+    try:
+        return float(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def _query_int(request, name: str, default=None):
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def create_app():
+    # Charger .env
+    load_dotenv(dotenv_path=os.environ.get("OKOFEN_ENV_FILE", ".env"))
+
+    # Même configuration que app.py (sous-ensemble utilisé ici)
+    config = {
+        "OKOFEN_TOKEN": os.environ.get("OKOFEN_TOKEN", "change-me"),
+        "SCRIPT_PATH": os.environ.get("SCRIPT_PATH", os.path.abspath("Okofen_Playwright.py")),
+        "SCRIPT_TIMEOUT": int(os.environ.get("SCRIPT_TIMEOUT", SCRIPT_TIMEOUT_DEFAULT)),
+        "SCRIPT_STALL_TIMEOUT": float(os.environ.get("SCRIPT_STALL_TIMEOUT", "0")),
+        "LOG_PATH": os.environ.get("LOG_PATH", "/opt/Okofen_Playwright/logs/okofen-web.log"),
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "INFO"),
+        "DRIVER_LOG_LEVEL": os.environ.get("DRIVER_LOG_LEVEL", "DEBUG"),
+        "TRACE_RING_SIZE": int(os.environ.get("TRACE_RING_SIZE", "20")),
+        "STATUS_TTL": float(os.environ.get("STATUS_TTL", "60")),
+        "LOCK_PATH": os.environ.get("LOCK_PATH", "/tmp/okofen-command.lock"),
+        "RESULTS_DB": os.environ.get("RESULTS_DB", "/opt/Okofen_Playwright/data/okofen.sqlite3"),
+        "VERIFIED_TTL": float(os.environ.get("VERIFIED_TTL", "300")),
+        "JOB_MAX_WAIT": float(os.environ.get("JOB_MAX_WAIT", "120")),
+        "JOB_POLL_INTERVAL": float(os.environ.get("JOB_POLL_INTERVAL", "0.2")),
+        "PROBE_INTERVAL": float(os.environ.get("PROBE_INTERVAL", "0")),
+        "PROBE_TIMEOUT": float(os.environ.get("PROBE_TIMEOUT", "3")),
+        "BREAKER_THRESHOLD": int(os.environ.get("BREAKER_THRESHOLD", "3")),
+        "BREAKER_RESET": float(os.environ.get("BREAKER_RESET", "60")),
+        "ADAPTIVE_TIMEOUTS": os.environ.get("ADAPTIVE_TIMEOUTS", "0") == "1",
+        "ADAPTIVE_FACTOR": float(os.environ.get("ADAPTIVE_FACTOR", "3")),
+        "ADAPTIVE_MIN_MS": int(os.environ.get("ADAPTIVE_MIN_MS", "3000")),
+        "MEMORY_BUDGET_MB": float(os.environ.get("MEMORY_BUDGET_MB", "0")),
+        "RUN_MEMORY_ESTIMATE_MB": float(os.environ.get("RUN_MEMORY_ESTIMATE_MB", "300")),
+        "MEMORY_WAIT": float(os.environ.get("MEMORY_WAIT", "10")),
+        "MQTT_HOST": os.environ.get("MQTT_HOST", ""),
+        "MQTT_PORT": int(os.environ.get("MQTT_PORT", "1883")),
+        "MQTT_USERNAME": os.environ.get("MQTT_USERNAME") or None,
+        "MQTT_PASSWORD": os.environ.get("MQTT_PASSWORD") or None,
+        "MQTT_TOPIC_PREFIX": os.environ.get("MQTT_TOPIC_PREFIX", "okofen"),
+        "MQTT_DISCOVERY_PREFIX": os.environ.get("MQTT_DISCOVERY_PREFIX", "homeassistant"),
+        "MQTT_NODE_ID": os.environ.get("MQTT_NODE_ID", "okofen"),
+        "MQTT_QOS": int(os.environ.get("MQTT_QOS", "1")),
+        "MQTT_QUEUE_SIZE": int(os.environ.get("MQTT_QUEUE_SIZE", "100")),
+        "MQTT_RECONNECT_MIN": float(os.environ.get("MQTT_RECONNECT_MIN", "1")),
+        "MQTT_RECONNECT_MAX": float(os.environ.get("MQTT_RECONNECT_MAX", "60")),
+        "MQTT_POLL_INTERVAL": float(os.environ.get("MQTT_POLL_INTERVAL", "1")),
+        "MQTT_LOCK_PATH": os.environ.get("MQTT_LOCK_PATH", "/tmp/okofen-mqtt.lock"),
+    }
+
+    setup_logging(config["LOG_PATH"], config["LOG_LEVEL"])
+    # Journaux de la séquence Playwright : traces d'exécution (événements "log")
+    okofen.configure_logging(config["DRIVER_LOG_LEVEL"])
+    logging.info("Okofen ASGI service starting…")
+
+    _lock = ProcessLock(config["LOCK_PATH"])
+    results = ResultStore(config["RESULTS_DB"])
+    metrics = Metrics(config["RESULTS_DB"])
+    traces = TraceRing(config["RESULTS_DB"], config["TRACE_RING_SIZE"])
+    # Même processus que la séquence : mêmes ARTIFACTS_DIR / ARTIFACTS_MAX_BYTES
+    artifacts = okofen.artifacts
+    status_cache = StatusCache(config["STATUS_TTL"])
+    desired = DesiredState(config["RESULTS_DB"])
+
+    # Cible de /on et /off : circuit 1 de la chaudière OKOFEN_URL
+    boilers = load_boilers()
+    main_target = default_target(boilers)
+    if main_target is not None:
+        boiler, circuit = parse_target(main_target, boilers)
+    else:
+        boiler, circuit = Boiler(DEFAULT_BOILER, os.getenv("OKOFEN_URL")), "1"
+    driver = AsyncDriver(boiler, circuit)
+
+    breaker = CircuitBreaker(config["BREAKER_THRESHOLD"], config["BREAKER_RESET"])
+    probe = None
+    if config["PROBE_INTERVAL"] > 0 and boiler.url:
+        probe = ReachabilityProbe(
+            boiler.url, breaker, config["PROBE_INTERVAL"], config["PROBE_TIMEOUT"]
+        )
+    memory = MemoryBudget(results, config["MEMORY_BUDGET_MB"], config["RUN_MEMORY_ESTIMATE_MB"])
+    # Même verrou d'élection que app.py : une seule connexion MQTT en tout
+    mqtt = MqttPublisher(
+        results,
+        config["MQTT_HOST"],
+        config["MQTT_PORT"],
+        config["MQTT_USERNAME"],
+        config["MQTT_PASSWORD"],
+        prefix=config["MQTT_TOPIC_PREFIX"],
+        discovery_prefix=config["MQTT_DISCOVERY_PREFIX"],
+        node_id=config["MQTT_NODE_ID"],
+        qos=config["MQTT_QOS"],
+        queue_size=config["MQTT_QUEUE_SIZE"],
+        reconnect_min=config["MQTT_RECONNECT_MIN"],
+        reconnect_max=config["MQTT_RECONNECT_MAX"],
+        poll_interval=config["MQTT_POLL_INTERVAL"],
+        lock_path=config["MQTT_LOCK_PATH"],
+        metrics=metrics,
+    )
+    phase_timeouts = None
+    if config["ADAPTIVE_TIMEOUTS"]:
+        phase_timeouts = AdaptiveTimeouts(
+            results, factor=config["ADAPTIVE_FACTOR"], min_ms=config["ADAPTIVE_MIN_MS"]
+        )
+
+    state = {"loop": None, "status_refresh": None}
+
+    # ---------------------------
+    # Auth Bearer
+    # ---------------------------
+
+    def require_token(f):
+        @wraps(f)
+        async def wrapper(request):
+            auth = request.headers.get("Authorization", "")
+            if not auth.startswith("Bearer "):
+                return JSONResponse({"ok": False, "error": "missing_bearer"}, 401)
+            token = auth.split(" ", 1)[1].strip()
+            if token != config["OKOFEN_TOKEN"]:
+                return JSONResponse({"ok": False, "error": "invalid_token"}, 401)
+            return await f(request)
+
+        return wrapper
+
+    # ---------------------------
+    # Exécution
+    # ---------------------------
+
+    def _record(action: str, http_code: int, payload: dict, update_status: bool = True):
+        results.append(action, http_code, payload)
+        mqtt.notify()
+        try:
+            metrics.record_result(action, http_code, payload)
+        except Exception:
+            logging.exception("Impossible de mettre à jour les métriques")
+        if update_status and payload.get("ok") and not payload.get("skipped"):
+            status_cache.update(payload.get("status"))
+
+    def _verified_status():
+        ttl = config["VERIFIED_TTL"]
+        if ttl <= 0:
+            return None
+        age = status_cache.age()
+        if age is not None and age <= ttl:
+            return status_cache.status
+        return results.last_verified(ttl)
+
+    async def _acquire_lock(timeout: float):
+        # Sans bloquer la boucle : le verrou peut être détenu par le
+        # réconciliateur ou par un worker app.py
+        deadline = time.monotonic() + timeout
+        while not _lock.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(_lock.poll_interval)
+        return True
+
+    async def _memory_wait(timeout: float):
+        # MemoryBudget.wait sans bloquer la boucle
+        allowed, used, estimate = memory.check()
+        if allowed:
+            return allowed, used, estimate
+        memory.waited += 1
+        deadline = time.monotonic() + timeout
+        while not allowed and time.monotonic() < deadline:
+            await asyncio.sleep(memory.poll_interval)
+            allowed, used, estimate = memory.check()
+        if not allowed:
+            memory.refused += 1
+        return allowed, used, estimate
+
+    async def _execute(action: str, progress=None):
+        """
+        Pilote la chaudière via Chromium, lock détenu. Même disjoncteur et
+        même budget mémoire que app.py : échec (503) tant qu'il est ouvert
+        ou que l'exécution dépasserait le budget.
+        """
+        if not breaker.allow():
+            logging.warning("Chaudière injoignable, commande %s refusée", action)
+            return unreachable_payload(action, breaker.retry_in())
+        allowed, used, estimate = await _memory_wait(config["MEMORY_WAIT"])
+        if not allowed:
+            logging.warning(
+                "Budget mémoire dépassé (%s + %s > %s Mo), commande %s refusée",
+                used, estimate, memory.budget_mb, action,
+            )
+            # Essai du disjoncteur demi-ouvert non tenté : place libérée
+            breaker.release_trial()
+            return memory_payload(action, used, estimate, memory.budget_mb)
+        okofen.set_phase_timeouts(phase_timeouts.get() if phase_timeouts is not None else None)
+        trace = RunTrace(action, new_run_id())
+        try:
+            http_code, payload = await _drive(action, progress, trace)
+        except Exception:
+            # Erreur locale (driver, script) : rien à conclure sur la chaudière
+            breaker.release_trial()
+            raise
+        finally:
+            okofen.set_phase_timeouts(None)
+        payload["run_id"] = trace.run_id
+        if (payload.get("summary") or {}).get("artifacts"):
+            payload["artifacts_url"] = f"/runs/{trace.run_id}/artifacts"
+        try:
+            payload["trace_id"] = traces.append(trace.to_dict(http_code, payload))
+        except Exception:
+            logging.exception("Impossible d'enregistrer la trace d'exécution")
+        if unreachable(payload):
+            breaker.record_failure(
+                payload.get("error_message")
+                or (payload.get("summary") or {}).get("error")
+                or payload.get("error_code")
+            )
+        else:
+            breaker.record_success()
+        return http_code, payload
+
+    async def _drive(action: str, progress=None, trace=None):
+        """
+        Mêmes délais que app.py : SCRIPT_TIMEOUT au total,
+        SCRIPT_STALL_TIMEOUT sans événement.
+        """
+        loop = asyncio.get_running_loop()
+        start = time.time()
+        last = {"phase": None, "at": loop.time()}
+
+        def on_event(event):
+            last["at"] = loop.time()
+            if trace is not None:
+                trace.add(event)
+            kind = event.get("event")
+            if kind == "phase_start":
+                last["phase"] = event.get("phase")
+            elif kind not in ("state", "error"):
+                return
+            if progress is not None:
+                info = {"phase": last["phase"], "event": kind}
+                if kind == "state":
+                    info["status"] = event.get("status")
+                progress(info)
+
+        okofen.set_event_sink(on_event)
+        task = asyncio.ensure_future(
+            driver.run(action, trace.run_id if trace is not None else None)
+        )
+        deadline = loop.time() + config["SCRIPT_TIMEOUT"]
+        failure = None
+        try:
+            while failure is None:
+                limit = deadline
+                if config["SCRIPT_STALL_TIMEOUT"] > 0:
+                    limit = min(limit, last["at"] + config["SCRIPT_STALL_TIMEOUT"])
+                done, _ = await asyncio.wait({task}, timeout=max(0.0, limit - loop.time()))
+                if done:
+                    break
+                if loop.time() >= deadline:
+                    failure = "timeout"
+                elif (config["SCRIPT_STALL_TIMEOUT"] > 0
+                      and loop.time() >= last["at"] + config["SCRIPT_STALL_TIMEOUT"]):
+                    failure = "stalled"
+            if failure is not None:
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError, Exception):
+                    await task
+        finally:
+            okofen.set_event_sink(None)
+
+        duration = int((time.time() - start) * 1000)
+        if failure is not None:
+            logging.error(
+                "Chromium %s after %sms for action=%s (phase=%s)",
+                failure,
+                duration,
+                action,
+                last["phase"],
+            )
+            return timeout_payload(
+                action, duration, last["phase"] if failure == "stalled" else None
+            )
+        try:
+            summary = task.result()
+        except Exception as e:
+            # Lancement de Chromium impossible (run_target gère ses propres erreurs)
+            logging.error("Chromium indisponible : %s", e)
+            summary = okofen.build_summary(
+                action, False, "unknown", "unknown", None, duration, str(e), {}
+            )
+        return payload_from_summary(action, summary, duration)
+
+    def _execute_threadsafe(action: str, progress):
+        # Appelé par le thread du réconciliateur, lock détenu
+        future = asyncio.run_coroutine_threadsafe(_execute(action, progress), state["loop"])
+        return future.result()
+
+    reconciler = Reconciler(
+        desired,
+        _lock,
+        execute=_execute_threadsafe,
+        record=_record,
+        verified_status=_verified_status,
+    )
+
+    async def _read_status():
+        # On attend une éventuelle commande en cours plutôt que de la refuser
+        if not await _acquire_lock(config["SCRIPT_TIMEOUT"]):
+            metrics.inc("okofen_busy_total")
+            raise RuntimeError("Une commande est déjà en cours d'exécution.")
+        try:
+            http_code, payload = await _execute("status")
+        finally:
+            _lock.release()
+        if not payload.get("ok"):
+            raise RuntimeError(
+                payload.get("error_message")
+                or (payload.get("summary") or {}).get("error")
+                or "Lecture du mode impossible."
+            )
+        status_cache.update(payload.get("status"))
+        return payload.get("status", "unknown")
+
+    async def _cached_status(max_age: float = None):
+        """
+        Équivalent asynchrone de StatusCache.get : une seule lecture en vol,
+        partagée par tous les appelants. Retourne (status, age_s, refreshed).
+        """
+        max_age = status_cache.ttl if max_age is None else max_age
+        age = status_cache.age()
+        if age is not None and age <= max_age:
+            return status_cache.status, age, False
+        if state["status_refresh"] is None:
+            refresh = asyncio.ensure_future(_read_status())
+            refresh.add_done_callback(lambda _f: state.update(status_refresh=None))
+            state["status_refresh"] = refresh
+        value = await asyncio.shield(state["status_refresh"])
+        return value, 0.0, True
+
+    # ---------------------------
+    # Cycle de vie
+    # ---------------------------
+
+    @contextlib.asynccontextmanager
+    async def lifespan(_app):
+        state["loop"] = asyncio.get_running_loop()
+        await driver.start()
+        reconciler.start()
+        if probe is not None:
+            probe.start()
+        mqtt.start()
+        try:
+            yield
+        finally:
+            await driver.close()
+
+    # ---------------------------
+    # Routes HTTP
+    # ---------------------------
+
+    async def health(request):
+        script_ok = (
+            os.path.isfile(config["SCRIPT_PATH"])
+            and os.access(config["SCRIPT_PATH"], os.R_OK)
+        )
+        body = {
+            "ok": True,
+            "script_path": config["SCRIPT_PATH"],
+            "script_readable": script_ok,
+            "timeout_s": config["SCRIPT_TIMEOUT"],
+            "driver_mode": "asgi",
+            "fast_path": False,
+            "reconciler": reconciler.stats(),
+            "telemetry": None,
+            "csv": None,
+            "scheduler": None,
+            "driver": driver.stats(),
+            "probe": probe.stats() if probe is not None else None,
+            "breaker": breaker.stats(),
+            "phase_timeouts_ms": phase_timeouts.get() if phase_timeouts is not None else {},
+            "artifacts": artifacts.usage(),
+            "memory": memory.stats(),
+            "mqtt": mqtt.stats() if mqtt.enabled else None,
+        }
+        return JSONResponse(body)
+
+    async def prometheus_metrics(request):
+        return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    @require_token
+    async def turn_on(request):
+        queue = reconciler.submit("on")
+        body = {
+            "ok": True,
+            "action": "on",
+            "status": "pending",
+            "changed": None,
+            "duration_ms": 0,
+            "job_id": queue["job_id"],
+            "queue_depth": queue["queue_depth"],
+            "coalesced": queue["coalesced"],
+            "speech": "Commande d'allumage envoyée à la chaudière.",
+        }
+        return JSONResponse(body, 202)
+
+    @require_token
+    async def turn_off(request):
+        queue = reconciler.submit("off")
+        body = {
+            "ok": True,
+            "action": "off",
+            "status": "pending",
+            "changed": None,
+            "duration_ms": 0,
+            "job_id": queue["job_id"],
+            "queue_depth": queue["queue_depth"],
+            "coalesced": queue["coalesced"],
+            "speech": "Commande d'arrêt envoyée à la chaudière.",
+        }
+        return JSONResponse(body, 202)
+
+    async def _wait_job(job_id: str, timeout: float, known_state=None, known_progress=None):
+        """
+        Attend que le job change d'état (ou de progression) ou se termine,
+        au plus `timeout` secondes, sans bloquer la boucle.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = desired.job(job_id)
+            if (
+                job is None
+                or job["state"] == "done"
+                or (known_state is not None and job["state"] != known_state)
+                or (known_progress is not None and job["progress"] != known_progress)
+                or time.monotonic() >= deadline
+            ):
+                return job
+            await asyncio.sleep(config["JOB_POLL_INTERVAL"])
+
+    @require_token
+    async def get_job(request):
+        job_id = request.path_params["job_id"]
+        wait = min(max(_query_float(request, "wait", 0), 0), config["JOB_MAX_WAIT"])
+        job = desired.job(job_id)
+        if job is not None and job["state"] != "done" and wait > 0:
+            job = await _wait_job(job_id, wait)
+        if job is None:
+            return JSONResponse({"ok": False, "error": "unknown_job"}, 404)
+        return JSONResponse(job, 200)
+
+    @require_token
+    async def job_events(request):
+        job_id = request.path_params["job_id"]
+        if desired.job(job_id) is None:
+            return JSONResponse({"ok": False, "error": "unknown_job"}, 404)
+
+        async def stream():
+            state_, progress = None, None
+            deadline = time.monotonic() + config["JOB_MAX_WAIT"]
+            job = desired.job(job_id)
+            while job is not None:
+                if job["state"] != state_ or job["progress"] != progress:
+                    state_, progress = job["state"], job["progress"]
+                    event = "result" if state_ == "done" else "progress"
+                    yield f"event: {event}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+                    if state_ == "done":
+                        return
+                else:
+                    yield ": keep-alive\n\n"
+                if time.monotonic() >= deadline:
+                    return
+                job = await _wait_job(job_id, 15, known_state=state_, known_progress=progress)
+
+        return StreamingResponse(
+            stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @require_token
+    async def status(request):
+        max_age = _query_float(request, "max_age")
+        try:
+            value, age, refreshed = await _cached_status(max_age)
+        except Exception as e:
+            logging.warning("Lecture du mode impossible : %s", e)
+            age = status_cache.age()
+            if age is None:
+                return JSONResponse(
+                    {
+                        "ok": False,
+                        "status": "unknown",
+                        "error_code": "status_unavailable",
+                        "error_message": str(e),
+                        "speech": "Je n'arrive pas à lire l'état de la chaudière pour l'instant.",
+                    },
+                    503,
+                )
+            return JSONResponse(
+                {
+                    "ok": True,
+                    "status": status_cache.status,
+                    "age_s": round(age, 1),
+                    "cached": True,
+                    "stale": True,
+                    "error_message": str(e),
+                },
+                200,
+            )
+
+        body = {
+            "ok": True,
+            "status": value,
+            "age_s": round(age, 1),
+            "cached": not refreshed,
+            "stale": False,
+        }
+        return JSONResponse(body, 200)
+
+    @require_token
+    async def get_traces(request):
+        trace_id = _query_int(request, "id")
+        if trace_id is not None:
+            trace = traces.get(trace_id)
+            if trace is None:
+                return JSONResponse({"ok": False, "error": "unknown_trace"}, 404)
+            return JSONResponse({"ok": True, "traces": [trace]}, 200)
+        limit = _query_int(request, "limit", traces.size)
+        return JSONResponse(
+            {"ok": True, "size": traces.size, "traces": traces.last(max(1, limit))}, 200
+        )
+
+    @require_token
+    async def list_artifacts(request):
+        run_id = request.path_params["run_id"]
+        files = artifacts.list(run_id)
+        if files is None:
+            return JSONResponse({"ok": False, "error": "unknown_run"}, 404)
+        for f in files:
+            f["url"] = f"/runs/{run_id}/artifacts/{f['name']}"
+        return JSONResponse({"ok": True, "run_id": run_id, "artifacts": files}, 200)
+
+    @require_token
+    async def get_artifact(request):
+        name = request.path_params["name"]
+        path = artifacts.file_path(request.path_params["run_id"], name)
+        if path is None:
+            return JSONResponse({"ok": False, "error": "unknown_artifact"}, 404)
+        if name.endswith(".zip"):
+            return FileResponse(path, filename=name)
+        return FileResponse(path)
+
+    @require_token
+    async def last(request):
+        rows = results.last(1)
+        if not rows:
+            return JSONResponse(
+                {
+                    "ok": False,
+                    "error": "no_result_yet",
+                    "speech": "Aucune commande chaudière n'a encore été exécutée.",
+                },
+                404,
+            )
+        return JSONResponse(rows[0]["payload"], 200)
+
+    @require_token
+    async def last_results(request):
+        limit = max(1, min(_query_int(request, "limit", 10), 500))
+        return JSONResponse(
+            {
+                "ok": True,
+                "results": [
+                    {"id": r["id"], "ts": r["ts"], "http_code": r["http_code"], **r["payload"]}
+                    for r in results.last(limit, request.query_params.get("action"))
+                ],
+            },
+            200,
+        )
+
+    return Starlette(
+        routes=[
+            Route("/healthz", health, methods=["GET"]),
+            Route("/metrics", prometheus_metrics, methods=["GET"]),
+            Route("/on", turn_on, methods=["POST"]),
+            Route("/off", turn_off, methods=["POST"]),
+            Route("/jobs/{job_id}", get_job, methods=["GET"]),
+            Route("/jobs/{job_id}/events", job_events, methods=["GET"]),
+            Route("/status", status, methods=["GET"]),
+            Route("/traces", get_traces, methods=["GET"]),
+            Route("/runs/{run_id}/artifacts", list_artifacts, methods=["GET"]),
+            Route("/runs/{run_id}/artifacts/{name}", get_artifact, methods=["GET"]),
+            Route("/last", last, methods=["GET"]),
+            Route("/results", last_results, methods=["GET"]),
+        ],
+        lifespan=lifespan,
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(create_app(), host="0.0.0.0", port=5000)
@@ -0,0 +1,299 @@
+"""
+Séquence Playwright asynchrone (playwright.async_api) : équivalent de
+Okofen_Playwright.run_in_context pour une cible chaudière / circuit
+(okofen_targets.py), exécutable en parallèle sur une seule boucle asyncio.
+
+- ContextPool : BrowserContexts isolés et réutilisés, par chaudière, dans
+  un Chromium partagé, avec une limite de concurrence par chaudière
+  (max_concurrency) et globale (BATCH_MAX_CONTEXTS).
+- run_target : séquence complète pour une cible, retourne un résumé au
+  format OKOFEN_SUMMARY.
+
+Utilisé par okofen_batch.py (plusieurs cibles, un Chromium par batch) et
+okofen_asgi.py (service asyncio, Chromium gardé ouvert).
+"""
+import os
+import re
+import time
+import asyncio
+import logging
+
+from playwright.async_api import expect
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+import Okofen_Playwright as okofen
+from okofen_artifacts import new_run_id
+
+BATCH_MAX_CONTEXTS = int(os.getenv("BATCH_MAX_CONTEXTS", "4"))
+
+log = logging.getLogger("okofen.async")
+
+
+async def _block_assets(route):
+    if route.request.resource_type in okofen.BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+def _circuit_link(page, circuit: str, name: str):
+    # "Chf1 Chauffage" ; regex pour ne pas confondre Chf1 et Chf10
+    return page.get_by_role("link", name=re.compile(rf"^Chf{circuit}\s+{re.escape(name)}$"))
+
+
+class ContextPool:
+    """
+    BrowserContexts réutilisables, par chaudière, dans un Chromium partagé.
+    """
+
+    def __init__(self, browser, boilers: dict, max_contexts: int = BATCH_MAX_CONTEXTS):
+        self.browser = browser
+        self._idle = {boiler_id: [] for boiler_id in boilers}
+        self._per_boiler = {
+            boiler_id: asyncio.Semaphore(boiler.max_concurrency)
+            for boiler_id, boiler in boilers.items()
+        }
+        self._total = asyncio.Semaphore(max(1, max_contexts))
+
+    async def acquire(self, boiler):
+        await self._per_boiler[boiler.id].acquire()
+        await self._total.acquire()
+        idle = self._idle[boiler.id]
+        if idle:
+            return idle.pop()
+        try:
+            path = okofen.storage_state_path(boiler.id)
+            context = await okofen.new_context(
+                self.browser, storage_state=okofen.load_storage_state(path)
+            )
+            if okofen.LEAN_MODE and okofen.BLOCKED_RESOURCE_TYPES:
+                await context.route("**/*", _block_assets)
+        except Exception:
+            self._total.release()
+            self._per_boiler[boiler.id].release()
+            raise
+        return context
+
+    def release(self, boiler, context):
+        self._idle[boiler.id].append(context)
+        self._total.release()
+        self._per_boiler[boiler.id].release()
+
+    async def close(self):
+        for contexts in self._idle.values():
+            for context in contexts:
+                try:
+                    await context.close()
+                except Exception as e:
+                    log.debug("Erreur à la fermeture d'un contexte : %s", e)
+            contexts.clear()
+
+
+# ---------------------------
+# Séquence d'une cible (équivalent async de run_in_context)
+# ---------------------------
+
+async def _goto_home(page, boiler, circuit: str):
+    await page.goto(f"{boiler.url}/", wait_until="domcontentloaded")
+    if okofen.LEAN_MODE:
+        chf_link = _circuit_link(page, circuit, boiler.circuits[circuit])
+        login_box = page.get_by_role("textbox", name="Identifiant:")
+        await expect(chf_link.or_(login_box).first).to_be_visible(
+            timeout=okofen.phase_timeout("session")
+        )
+    else:
+        await page.wait_for_load_state("networkidle")
+
+
+async def _login(page, boiler):
+    if not boiler.user or not boiler.password:
+        raise RuntimeError(f"Identifiants non définis pour la chaudière {boiler.id!r}")
+    await page.goto(f"{boiler.url}/login.cgi", wait_until="domcontentloaded")
+    await expect(page.get_by_role("row", name="Francais")).to_be_visible(
+        timeout=okofen.phase_timeout("session")
+    )
+    await page.get_by_role("textbox", name="Identifiant:").fill(boiler.user)
+    await page.get_by_role("textbox", name="Mot de passe:").fill(boiler.password)
+    if okofen.LEAN_MODE:
+        async with page.expect_navigation(wait_until="commit"):
+            await page.get_by_role("button", name="Accès").click()
+    else:
+        await page.get_by_role("button", name="Accès").click()
+        await page.wait_for_load_state("networkidle")
+
+
+async def _open_session(page, context, boiler, circuit: str):
+    if await context.cookies():
+        await _goto_home(page, boiler, circuit)
+        on_login = (
+            "login.cgi" in page.url
+            or await page.get_by_role("textbox", name="Identifiant:").count() > 0
+        )
+        if not on_login:
+            return "hit"
+    await _login(page, boiler)
+    okofen.write_storage_state(
+        await context.storage_state(), okofen.storage_state_path(boiler.id)
+    )
+    await _goto_home(page, boiler, circuit)
+    return "miss"
+
+
+async def _page_state(page):
+    state = okofen.PageState(await page.evaluate(okofen.PAGE_STATE_JS))
+    log.debug("État de la page : %s", state.describe())
+    return state
+
+
+async def _read_mode(page):
+    return (await _page_state(page)).mode
+
+
+async def _set_mode(page, target_mode: str):
+    """
+    Même contrat que Okofen_Playwright.set_mode :
+    (changed, status_before, status_after), décision sur un seul page_state.
+    """
+    state = await _page_state(page)
+    status_before = state.mode
+    if status_before == target_mode:
+        return False, status_before, status_before
+    if status_before == "unknown":
+        return False, status_before, "unknown"
+    if target_mode == "off":
+        mode_text, label = page.get_by_text("ModeAuto"), "Arrêt"
+        button = page.get_by_role("button", name="Arrêt", exact=True)
+    else:
+        mode_text, label = page.get_by_text("ModeArrêt"), "Auto"
+        button = page.get_by_role("button", name="Auto")
+    if label not in state.buttons:
+        await mode_text.click(timeout=okofen.phase_timeout("set_mode"))
+    await button.click()
+    return True, status_before, target_mode
+
+
+async def _verify_mode(page, target_mode: str):
+    """
+    Même contrat que Okofen_Playwright.verify_mode :
+    (verified, mode affiché, durée de l'attente en ms).
+    """
+    t0 = time.perf_counter()
+    try:
+        await page.wait_for_function(
+            okofen.MODE_IS_JS,
+            arg={"target": target_mode, "popup": list(okofen.POPUP_BUTTONS)},
+            polling="raf",
+            timeout=okofen.phase_timeout("verify", okofen.VERIFY_TIMEOUT_MS),
+        )
+        verified, status = True, target_mode
+    except PlaywrightTimeoutError:
+        verified, status = False, None
+    verify_ms = round((time.perf_counter() - t0) * 1000, 1)
+    if not verified:
+        try:
+            status = await _read_mode(page)
+        except Exception as e:
+            log.debug("Relecture du mode impossible : %s", e)
+            status = "unknown"
+        log.warning(
+            "Mode %s non confirmé après %s ms (affiché : %s)", target_mode, verify_ms, status
+        )
+    return verified, status, verify_ms
+
+async def _capture_page(page, details: dict):
+    """
+    Capture d'écran et DOM de la page en échec (cf.
+    Okofen_Playwright.capture_page ; pas de trace Playwright en asyncio).
+    """
+    if not okofen.capture_enabled():
+        return
+    run_id = details.setdefault("run_id", new_run_id())
+    grabbers = (
+        ("screenshot.png", lambda: page.screenshot(full_page=True, timeout=5000)),
+        ("dom.html", page.content),
+    )
+    for name, grab in grabbers:
+        try:
+            okofen.artifacts.write(run_id, name, await grab())
+            okofen.add_artifact(details, name)
+        except Exception as e:
+            log.debug("Capture %s impossible : %s", name, e)
+
+
+async def run_target(pool, boiler, circuit: str, target_mode: str, run_id: str = None):
+    """
+    Exécute la séquence pour une cible et retourne son résumé
+    (format build_summary, avec "target"). Les captures d'un échec sont
+    rangées sous `run_id` (généré si absent).
+    """
+    target = f"{boiler.id}/Chf{circuit}"
+    name = boiler.circuits[circuit]
+    details = {"target": target, "run_id": run_id or new_run_id()}
+    timer = okofen.PhaseTimer(details, target=target)
+    start = time.time()
+    status_before = status_after = "unknown"
+    changed = None
+    error_msg = ""
+    ok = False
+
+    context = None
+    try:
+        with timer.phase("queue"):
+            context = await pool.acquire(boiler)
+        page = await context.new_page()
+        page.set_default_timeout(okofen.DEFAULT_WAIT_MS)
+        page.set_default_navigation_timeout(
+            okofen.phase_timeout("session", okofen.DEFAULT_NAVIGATION_MS)
+        )
+        try:
+            with timer.phase("session"):
+                details["session_cache"] = await _open_session(page, context, boiler, circuit)
+            with timer.phase("circuit"):
+                await _circuit_link(page, circuit, name).click(
+                    timeout=okofen.phase_timeout("circuit")
+                )
+                await expect(page.get_by_text(f"Nom du circuit{name}")).to_be_visible(
+                    timeout=okofen.phase_timeout("circuit")
+                )
+
+            if target_mode == "status":
+                with timer.phase("read_mode"):
+                    status_before = status_after = await _read_mode(page)
+                changed = False
+            else:
+                with timer.phase("set_mode"):
+                    changed, status_before, status_after = await _set_mode(page, target_mode)
+                if changed:
+                    with timer.phase("confirm"):
+                        await page.get_by_role("button", name="OK").click(
+                            timeout=okofen.phase_timeout("confirm")
+                        )
+                    with timer.phase("verify"):
+                        verified, status_after, verify_ms = await _verify_mode(page, target_mode)
+                    details["verified"] = verified
+                    details["verify_ms"] = verify_ms
+                    if not verified:
+                        await _capture_page(page, details)
+                else:
+                    details["verified"] = status_after == target_mode
+                    details["verify_ms"] = 0.0
+            okofen.emit_event("state", status=status_after, target=target)
+            # build_summary passe ok à False si le mode n'est pas confirmé
+            ok = True
+        except Exception:
+            await _capture_page(page, details)
+            raise
+        finally:
+            await page.close()
+    except Exception as e:
+        error_msg = str(e)
+        log.error("%s : %s", target, e)
+        okofen.emit_event("error", message=error_msg, target=target)
+    finally:
+        if context is not None:
+            pool.release(boiler, context)
+
+    duration_ms = int((time.time() - start) * 1000)
+    return okofen.build_summary(
+        target_mode, ok, status_before, status_after, changed, duration_ms, error_msg, details
+    )
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Pilotage de plusieurs cibles (chaudières / circuits, cf. okofen_targets.py)
+en une seule exécution :
+
+    python okofen_batch.py on maison/Chf1 maison/Chf2 atelier/Chf1
+
+Un seul Chromium est lancé (API asynchrone de Playwright) ; chaque cible
+s'exécute dans un BrowserContext isolé pris dans un pool par chaudière
+(okofen_async.ContextPool). Le nombre de contextes simultanés est limité
+par chaudière (max_concurrency) et au total (BATCH_MAX_CONTEXTS). Les
+contextes d'une même chaudière sont réutilisés d'une cible à l'autre : un
+seul login par chaudière.
+
+Même sortie que Okofen_Playwright.py : événements OKOFEN_EVENT (avec le
+champ "target") puis une ligne OKOFEN_SUMMARY contenant un résumé par cible
+dans "results".
+"""
+import sys
+import json
+import time
+import asyncio
+import logging
+
+from playwright.async_api import async_playwright
+
+import Okofen_Playwright as okofen
+from okofen_async import ContextPool, run_target
+from okofen_targets import load_boilers, parse_target
+from okofen_resources import ResourceMonitor
+
+log = logging.getLogger("okofen.batch")
+
+
+async def run_batch(target_mode: str, targets, boilers: dict = None):
+    """
+    Applique target_mode ("on" / "off" / "status") à toutes les cibles, en
+    parallèle dans la limite du pool. Retourne le résumé global.
+    """
+    boilers = boilers if boilers is not None else load_boilers()
+    resolved = [parse_target(t, boilers) for t in targets]
+    details = {}
+    timer = okofen.PhaseTimer(details)
+
+    async with async_playwright() as playwright:
+        with timer.phase("launch"):
+            browser = await playwright.chromium.launch(**okofen.launch_options())
+        pool = ContextPool(browser, boilers)
+        try:
+            results = await asyncio.gather(
+                *(run_target(pool, boiler, circuit, target_mode) for boiler, circuit in resolved)
+            )
+        finally:
+            with timer.phase("close"):
+                await pool.close()
+                await browser.close()
+
+    return {
+        "ok": all(r["ok"] for r in results),
+        "action": target_mode,
+        "results": list(results),
+        **details,
+    }
+
+
+if __name__ == "__main__":
+    start = time.time()
+    okofen.set_event_sink(okofen.print_event)
+    okofen.configure_logging()
+    logging.getLogger("okofen").propagate = False
+
+    mode = okofen.parse_mode(sys.argv[1]) if len(sys.argv) > 2 else None
+    if mode is None:
+        print("Usage : python okofen_batch.py [on|off|status] <chaudière>/Chf<N> ...")
+        sys.exit(1)
+
+    resources = {}
+    try:
+        with ResourceMonitor(resources):
+            summary = asyncio.run(run_batch(mode, sys.argv[2:]))
+    except Exception as e:
+        log.error("Exception: %s", e)
+        okofen.emit_event("error", message=str(e))
+        summary = {"ok": False, "action": mode, "results": [], "error": str(e)}
+    summary.update(resources)
+    summary["duration_ms"] = int((time.time() - start) * 1000)
+
+    print("OKOFEN_SUMMARY:" + json.dumps(summary, ensure_ascii=False))
+    sys.exit(0 if summary["ok"] else 1)
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Ingestion incrémentale des journaux quotidiens touch_*.csv de la chaudière
+(format Pellematic : séparateur ";", décimales à virgule, latin-1, colonnes
+"Datum" et "Zeit" en tête puis une colonne par mesure).
+
+Chaque fichier est lu à partir du dernier offset enregistré : seules les
+lignes complètes ajoutées depuis le passage précédent sont parsées, et
+l'offset est écrit dans la même transaction que les valeurs (pas de
+doublon ni de perte en cas d'arrêt). Les valeurs sont stockées en format
+long dans SQLite, indexé par (colonne, ts), ce qui permet de servir des
+séries et des agrégats horaires / journaliers sans relire les CSV.
+
+    python okofen_csv.py /chemin/vers/logs      # ingestion ponctuelle
+"""
+import os
+import sys
+import glob
+import time
+import logging
+import threading
+
+from okofen_store import ProcessLock, SqliteStore
+
+CSV_PATTERN = "touch_*.csv"
+CSV_ENCODING = "latin-1"
+CSV_SEPARATOR = ";"
+TIME_FORMATS = ("%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M", "%Y-%m-%d %H:%M:%S")
+
+# Tranches d'agrégation -> format strftime (heure locale)
+BUCKETS = {
+    "hour": "%Y-%m-%dT%H:00",
+    "day": "%Y-%m-%d",
+}
+
+
+def _parse_ts(date_str: str, time_str: str):
+    text = f"{date_str.strip()} {time_str.strip()}"
+    for fmt in TIME_FORMATS:
+        try:
+            return int(time.mktime(time.strptime(text, fmt)))
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_value(raw: str):
+    raw = raw.strip()
+    if not raw:
+        return None
+    try:
+        return float(raw.replace(",", "."))
+    except ValueError:
+        return None
+
+
+def _parse_header(line: str):
+    """
+    Noms des colonnes de mesure (après Datum / Zeit), dédoublonnés.
+    """
+    names = []
+    for raw in line.rstrip("\r\n").split(CSV_SEPARATOR)[2:]:
+        name = raw.strip()
+        if not name:
+            names.append(None)
+            continue
+        candidate, n = name, 2
+        while candidate in names:
+            candidate = f"{name}#{n}"
+            n += 1
+        names.append(candidate)
+    return names
+
+
+class CsvStore(SqliteStore):
+    """
+    Valeurs des CSV (une ligne par colonne et horodatage) et offsets de
+    lecture par fichier.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS csv_files (
+            path TEXT PRIMARY KEY,
+            offset INTEGER NOT NULL,
+            header TEXT,
+            rows INTEGER NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS csv_columns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS csv_values (
+            column_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (column_id, ts)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._column_ids = {}
+
+    def file_state(self, path: str):
+        """
+        (offset, header) déjà traités pour ce fichier, (0, None) sinon.
+        """
+        row = self._conn().execute(
+            "SELECT offset, header FROM csv_files WHERE path = ?", (path,)
+        ).fetchone()
+        return (row[0], row[1]) if row else (0, None)
+
+    def _column_id(self, conn, name: str):
+        column_id = self._column_ids.get(name)
+        if column_id is None:
+            conn.execute("INSERT OR IGNORE INTO csv_columns (name) VALUES (?)", (name,))
+            column_id = conn.execute(
+                "SELECT id FROM csv_columns WHERE name = ?", (name,)
+            ).fetchone()[0]
+            self._column_ids[name] = column_id
+        return column_id
+
+    def commit_chunk(self, path: str, offset: int, header: str, rows):
+        """
+        Enregistre les valeurs d'un morceau de fichier et le nouvel offset
+        (une transaction). rows : [(ts, {colonne: valeur})].
+        """
+        with self._conn() as conn:
+            values = []
+            for ts, columns in rows:
+                for name, value in columns.items():
+                    values.append((self._column_id(conn, name), ts, value))
+            conn.executemany(
+                "INSERT OR REPLACE INTO csv_values (column_id, ts, value) VALUES (?, ?, ?)",
+                values,
+            )
+            conn.execute(
+                "INSERT INTO csv_files (path, offset, header, rows, updated) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET offset = excluded.offset, "
+                "header = excluded.header, rows = rows + excluded.rows, "
+                "updated = excluded.updated",
+                (path, offset, header, len(rows), time.time()),
+            )
+
+    def reset_file(self, path: str):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM csv_files WHERE path = ?", (path,))
+
+    # ---------------------------
+    # Requêtes
+    # ---------------------------
+
+    def columns(self):
+        rows = self._conn().execute(
+            "SELECT c.name, COUNT(v.ts), MIN(v.ts), MAX(v.ts) FROM csv_columns c "
+            "LEFT JOIN csv_values v ON v.column_id = c.id GROUP BY c.id ORDER BY c.id"
+        )
+        return [
+            {"name": name, "count": count, "first_ts": first, "last_ts": last}
+            for name, count, first, last in rows
+        ]
+
+    def files(self):
+        rows = self._conn().execute(
+            "SELECT path, offset, rows, updated FROM csv_files ORDER BY path"
+        )
+        return [
+            {"path": path, "offset": offset, "rows": count, "updated": updated}
+            for path, offset, count, updated in rows
+        ]
+
+    def series(self, column: str, start: float, end: float, limit: int = 10000):
+        """
+        [[ts, valeur], ...] de la colonne sur [start, end], None si la
+        colonne est inconnue.
+        """
+        row = self._conn().execute(
+            "SELECT id FROM csv_columns WHERE name = ?", (column,)
+        ).fetchone()
+        if row is None:
+            return None
+        return [
+            [ts, value]
+            for ts, value in self._conn().execute(
+                "SELECT ts, value FROM csv_values WHERE column_id = ? AND ts >= ? AND ts <= ? "
+                "ORDER BY ts LIMIT ?",
+                (row[0], start, end, limit),
+            )
+        ]
+
+    def aggregate(self, column: str, start: float, end: float, bucket: str = "hour"):
+        """
+        min / max / moyenne par heure ou par jour (heure locale) de la
+        colonne sur [start, end], None si la colonne est inconnue.
+        """
+        row = self._conn().execute(
+            "SELECT id FROM csv_columns WHERE name = ?", (column,)
+        ).fetchone()
+        if row is None:
+            return None
+        rows = self._conn().execute(
+            "SELECT strftime(?, ts, 'unixepoch', 'localtime') AS b, MIN(ts), "
+            "MIN(value), MAX(value), AVG(value), COUNT(*) "
+            "FROM csv_values WHERE column_id = ? AND ts >= ? AND ts <= ? "
+            "GROUP BY b ORDER BY b",
+            (BUCKETS[bucket], row[0], start, end),
+        )
+        return [
+            {
+                "bucket": label,
+                "first_ts": first,
+                "min": lo,
+                "max": hi,
+                "mean": round(mean, 3),
+                "count": count,
+            }
+            for label, first, lo, hi, mean, count in rows
+        ]
+
+
+class CsvIngestor:
+    def __init__(self, store: CsvStore, directory: str, pattern: str = CSV_PATTERN,
+                 chunk_bytes: int = 1 << 20):
+        self.store = store
+        self.directory = directory
+        self.pattern = pattern
+        self.chunk_bytes = chunk_bytes
+        self.last_run = None
+        self.last_rows = 0
+
+    def ingest(self):
+        """
+        Parse les lignes ajoutées depuis le dernier passage, pour tous les
+        fichiers. Retourne le nombre de lignes ingérées.
+        """
+        total = 0
+        for path in sorted(glob.glob(os.path.join(self.directory, self.pattern))):
+            try:
+                total += self.ingest_file(path)
+            except OSError as e:
+                logging.warning("CSV : lecture impossible de %s (%s)", path, e)
+        self.last_run = time.time()
+        self.last_rows = total
+        return total
+
+    def ingest_file(self, path: str):
+        offset, header = self.store.file_state(path)
+        size = os.path.getsize(path)
+        if size < offset:
+            # Fichier tronqué ou remplacé : on repart du début
+            logging.info("CSV : %s a rétréci, relecture complète", path)
+            self.store.reset_file(path)
+            offset, header = 0, None
+        if size == offset:
+            return 0
+
+        total = 0
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(self.chunk_bytes)
+                if not chunk:
+                    break
+                end = chunk.rfind(b"\n")
+                if end < 0:
+                    if len(chunk) < self.chunk_bytes:
+                        # Dernière ligne en cours d'écriture : au prochain passage
+                        break
+                    raise OSError(f"ligne de plus de {self.chunk_bytes} octets")
+                consumed = chunk[: end + 1]
+                f.seek(offset + len(consumed))
+                lines = consumed.decode(CSV_ENCODING).splitlines()
+                if header is None and lines:
+                    header = lines.pop(0)
+                rows = self._parse_lines(_parse_header(header), lines)
+                offset += len(consumed)
+                self.store.commit_chunk(path, offset, header, rows)
+                total += len(rows)
+        if total:
+            logging.info("CSV : %s lignes ingérées depuis %s", total, os.path.basename(path))
+        return total
+
+    @staticmethod
+    def _parse_lines(names, lines):
+        rows = []
+        for line in lines:
+            fields = line.split(CSV_SEPARATOR)
+            if len(fields) < 3:
+                continue
+            ts = _parse_ts(fields[0], fields[1])
+            if ts is None:
+                continue
+            values = {}
+            for name, raw in zip(names, fields[2:]):
+                if name is None:
+                    continue
+                value = _parse_value(raw)
+                if value is not None:
+                    values[name] = value
+            rows.append((ts, values))
+        return rows
+
+
+class CsvWatcher:
+    """
+    Ingestion périodique en arrière-plan ; un seul worker gunicorn l'exécute
+    (élection par verrou fichier, comme la télémétrie).
+    """
+
+    def __init__(self, ingestor: CsvIngestor, interval: float, lock_path: str):
+        self.ingestor = ingestor
+        self.interval = interval
+        self.lock = ProcessLock(lock_path)
+        self.leader = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="csv-ingest", daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        return {
+            "directory": self.ingestor.directory,
+            "interval_s": self.interval,
+            "leader": self.leader,
+            "last_run": self.ingestor.last_run,
+            "last_rows": self.ingestor.last_rows,
+        }
+
+    def _loop(self):
+        while not self.lock.acquire(blocking=False):
+            time.sleep(self.interval)
+        self.leader = True
+        while True:
+            try:
+                self.ingestor.ingest()
+            except Exception:
+                logging.exception("CSV : erreur d'ingestion")
+            time.sleep(self.interval)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage : python okofen_csv.py <répertoire des touch_*.csv> [base sqlite]")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    db_path = sys.argv[2] if len(sys.argv) > 2 else os.getenv(
+        "RESULTS_DB", "/opt/Okofen_Playwright/data/okofen.sqlite3"
+    )
+    count = CsvIngestor(CsvStore(db_path), sys.argv[1]).ingest()
+    print(f"{count} lignes ingérées")
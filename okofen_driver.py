@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Driver Playwright persistant ("warm") pour la chaudière Okofen.
+
+Un seul processus garde un Chromium et un BrowserContext ouverts, et reçoit
+les commandes de app.py via une socket Unix locale (une requête JSON par
+ligne, une réponse JSON par ligne) :
+
+    {"cmd": "run", "action": "on"}   -> résumé identique à OKOFEN_SUMMARY
+    {"cmd": "run", "action": "status"} -> lecture seule du mode
+    {"cmd": "run", "action": "on", "timeouts": {"session": 8000}}
+                                     -> délais d'attente par phase (ms)
+    {"cmd": "run", "action": "on", "run_id": "..."}
+                                     -> répertoire des captures d'échec
+    {"cmd": "params", "params": [{"field": "eco_temp", "value": 18}]}
+                                     -> écriture de paramètres (POST /params),
+                                        mêmes champs "timeouts" / "run_id"
+    {"cmd": "ping"}                  -> état de santé du driver
+
+Pendant une commande "run", le driver envoie d'abord des lignes
+d'événements ({"event": "phase_start", ...}) puis la ligne de résumé. Si
+app.py ferme la connexion avant (délai dépassé, verrou libéré), la commande
+est interrompue au changement de phase suivant, comme le script tué.
+
+Politique de cycle de vie :
+  - health check périodique (navigateur toujours connecté ?)
+  - relance automatique si Chromium a crashé
+  - recyclage après DRIVER_MAX_COMMANDS commandes ou DRIVER_MAX_IDLE secondes
+    d'inactivité
+"""
+import os
+import sys
+import json
+import time
+import socket
+import select
+import logging
+import socketserver
+
+from playwright.sync_api import sync_playwright
+
+import Okofen_Playwright as okofen
+from okofen_artifacts import new_run_id, valid_run_id
+from okofen_resources import ResourceMonitor
+
+DRIVER_SOCKET = os.getenv("DRIVER_SOCKET", "/tmp/okofen-driver.sock")
+DRIVER_MAX_COMMANDS = int(os.getenv("DRIVER_MAX_COMMANDS", "50"))
+DRIVER_MAX_IDLE = int(os.getenv("DRIVER_MAX_IDLE", "900"))
+DRIVER_HEALTH_INTERVAL = int(os.getenv("DRIVER_HEALTH_INTERVAL", "60"))
+
+log = logging.getLogger("okofen.driver")
+
+
+class Driver:
+    def __init__(self, playwright):
+        self.playwright = playwright
+        self.browser = None
+        self.context = None
+        self.started_at = time.time()
+        self.launched_at = None
+        self.last_used = time.time()
+        self.last_health = time.time()
+        self.commands_since_launch = 0
+        self.commands_total = 0
+        self.relaunches = 0
+        self.crashed = False
+
+    # ---------------------------
+    # Cycle de vie navigateur
+    # ---------------------------
+
+    def _on_disconnected(self, _browser):
+        log.debug("Navigateur déconnecté")
+        self.crashed = True
+
+    def launch(self):
+        log.info("Lancement de Chromium")
+        self.browser = self.playwright.chromium.launch(**okofen.launch_options())
+        self.browser.on("disconnected", self._on_disconnected)
+        self.context = okofen.new_context(
+            self.browser, storage_state=okofen.load_storage_state()
+        )
+        okofen.enable_lean_routing(self.context)
+        okofen.start_tracing(self.context)
+        self.launched_at = time.time()
+        self.commands_since_launch = 0
+        self.crashed = False
+
+    def close(self):
+        for obj in (self.context, self.browser):
+            if obj is None:
+                continue
+            try:
+                obj.close()
+            except Exception as e:
+                log.debug("Erreur à la fermeture : %s", e)
+        self.context = None
+        self.browser = None
+
+    def recycle(self, reason: str):
+        log.info("Recyclage du navigateur (%s)", reason)
+        self.close()
+        self.launch()
+        self.relaunches += 1
+
+    def healthy(self):
+        return (
+            self.browser is not None
+            and not self.crashed
+            and self.browser.is_connected()
+        )
+
+    def ensure_browser(self):
+        if self.browser is None:
+            self.launch()
+        elif not self.healthy():
+            self.recycle("crash détecté")
+
+    def tick(self):
+        """
+        Appelé régulièrement par la boucle de service (hors commande).
+        """
+        now = time.time()
+        if now - self.last_health >= DRIVER_HEALTH_INTERVAL:
+            self.last_health = now
+            if self.browser is not None and not self.healthy():
+                self.recycle("health check en échec")
+        if (
+            DRIVER_MAX_IDLE > 0
+            and self.commands_since_launch > 0
+            and now - self.last_used >= DRIVER_MAX_IDLE
+        ):
+            self.recycle("inactivité")
+
+    # ---------------------------
+    # Commandes
+    # ---------------------------
+
+    def ping(self):
+        now = time.time()
+        return {
+            "ok": self.healthy(),
+            "pid": os.getpid(),
+            "uptime_s": int(now - self.started_at),
+            "browser_age_s": int(now - self.launched_at) if self.launched_at else None,
+            "idle_s": int(now - self.last_used),
+            "commands_total": self.commands_total,
+            "commands_since_launch": self.commands_since_launch,
+            "relaunches": self.relaunches,
+        }
+
+    def _run_captured(self, mode: str, details: dict, changes=None):
+        """
+        Séquence dans le contexte courant, avec une seule relance si Chromium
+        est tombé pendant la commande.
+        """
+        okofen.check_credentials()
+        # Pic de RSS / CPU du driver et de son Chromium pendant la commande
+        with ResourceMonitor(details):
+            self.ensure_browser()
+            try:
+                return okofen.run_captured(self.context, mode, details, changes)
+            except Exception:
+                if self.healthy():
+                    raise
+                # Chromium est tombé pendant la commande : une seule relance
+                self.recycle("crash pendant la commande")
+                return okofen.run_captured(self.context, mode, details, changes)
+
+    def _command_done(self):
+        self.commands_total += 1
+        self.commands_since_launch += 1
+        self.last_used = time.time()
+        if DRIVER_MAX_COMMANDS > 0 and self.commands_since_launch >= DRIVER_MAX_COMMANDS:
+            self.recycle("nombre maximal de commandes")
+
+    def run(self, mode: str, run_id: str = None):
+        start = time.time()
+        status_before = "unknown"
+        status_after = "unknown"
+        changed = None
+        error_msg = ""
+        ok = False
+        details = {"run_id": run_id or new_run_id()}
+
+        try:
+            status_before, status_after, changed = self._run_captured(mode, details)
+            ok = True
+        except Exception as e:
+            error_msg = str(e)
+            log.error("Exception: %s", e)
+            okofen.emit_event("error", message=error_msg)
+
+        duration_ms = int((time.time() - start) * 1000)
+        summary = okofen.build_summary(
+            mode, ok, status_before, status_after, changed, duration_ms, error_msg, details
+        )
+        self._command_done()
+        return summary
+
+    def run_params(self, changes, run_id: str = None):
+        start = time.time()
+        results = []
+        error_msg = ""
+        ok = False
+        details = {"run_id": run_id or new_run_id()}
+
+        try:
+            results = self._run_captured("params", details, changes)
+            ok = True
+        except Exception as e:
+            error_msg = str(e)
+            log.error("Exception: %s", e)
+            okofen.emit_event("error", message=error_msg)
+
+        duration_ms = int((time.time() - start) * 1000)
+        summary = okofen.build_params_summary(
+            ok, changes, results, duration_ms, error_msg, details
+        )
+        self._command_done()
+        return summary
+
+    def handle(self, req: dict):
+        cmd = req.get("cmd")
+        if cmd == "ping":
+            return self.ping()
+        if cmd not in ("run", "params"):
+            return {"ok": False, "error": "unknown_command"}
+        if cmd == "run":
+            mode = okofen.parse_mode(str(req.get("action", "")))
+            if mode is None:
+                return {"ok": False, "error": "invalid_action"}
+        elif not isinstance(req.get("params"), list):
+            return {"ok": False, "error": "invalid_params"}
+        run_id = req.get("run_id")
+        if run_id is not None and not valid_run_id(run_id):
+            return {"ok": False, "error": "invalid_run_id"}
+        # Délais adaptatifs calculés par app.py, pour cette commande seulement
+        okofen.set_phase_timeouts(req.get("timeouts"))
+        try:
+            if cmd == "params":
+                return self.run_params(req["params"], run_id)
+            return self.run(mode, run_id)
+        finally:
+            okofen.set_phase_timeouts(None)
+
+
+class ClientGone(Exception):
+    """
+    Client déconnecté pendant une commande (délai dépassé côté app.py).
+    """
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _send(self, obj: dict):
+        self.wfile.write((json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def _client_gone(self) -> bool:
+        # Le client n'envoie rien après sa requête : socket lisible = fin de
+        # connexion
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and self.connection.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+
+    def _send_event(self, event: dict):
+        if self.aborted:
+            return
+        gone = self._client_gone()
+        if not gone:
+            try:
+                self._send(event)
+            except OSError:
+                gone = True
+        # app.py a abandonné la commande et libéré son verrou : on arrête au
+        # prochain événement de phase (pas dans le handler de journalisation,
+        # qui avalerait l'exception) plutôt que de piloter la chaudière en
+        # parallèle d'une autre commande
+        if gone and event.get("event") != "log":
+            self.aborted = True
+            raise ClientGone("Client déconnecté (délai dépassé) : commande interrompue")
+
+    def handle(self):
+        self.aborted = False
+        line = self.rfile.readline()
+        okofen.set_event_sink(self._send_event)
+        try:
+            req = json.loads(line)
+            resp = self.server.driver.handle(req)
+        except Exception as e:
+            resp = {"ok": False, "error": str(e)}
+        finally:
+            okofen.set_event_sink(None)
+        if self.aborted:
+            log.warning("Commande interrompue : client déconnecté")
+            return
+        self._send(resp)
+
+
+class _Server(socketserver.UnixStreamServer):
+    # Playwright (API sync) n'est pas thread-safe : une commande à la fois.
+    timeout = 1.0
+
+
+def serve(socket_path: str = DRIVER_SOCKET):
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    with sync_playwright() as playwright:
+        driver = Driver(playwright)
+        driver.launch()
+        with _Server(socket_path, _Handler) as server:
+            server.driver = driver
+            os.chmod(socket_path, 0o600)
+            log.info("En écoute sur %s", socket_path)
+            try:
+                while True:
+                    server.handle_request()
+                    driver.tick()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                driver.close()
+                if os.path.exists(socket_path):
+                    os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    # Journaux sur stderr (journald) ; pendant une commande, aussi transmis
+    # au client en événements "log"
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    okofen.configure_logging()
+    serve(sys.argv[1] if len(sys.argv) > 1 else DRIVER_SOCKET)
@@ -0,0 +1,267 @@
+"""
+Santé de la liaison avec la chaudière.
+
+- ReachabilityProbe : sonde légère en arrière-plan de OKOFEN_URL (connexion
+  TCP, puis requête HTTP HEAD), sans Chromium.
+- CircuitBreaker : après BREAKER_THRESHOLD échecs consécutifs (sonde ou
+  commande sans réponse), les commandes échouent immédiatement (503) au lieu
+  de lancer Chromium et de garder le verrou jusqu'au SCRIPT_TIMEOUT. Une
+  sonde réussie referme le disjoncteur ; sans sonde, une commande d'essai
+  est laissée passer toutes les BREAKER_RESET secondes.
+- adaptive_timeouts : délais d'attente par phase déduits des durées
+  observées (percentile des derniers résultats), transmis au driver à la
+  place des 30 s / 60 s fixes.
+
+Sonde et disjoncteur sont propres à chaque worker (pas d'état partagé) : une
+connexion TCP par intervalle et par worker suffit.
+"""
+import re
+import time
+import socket
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+
+# Phases dont les attentes sont bornées par un délai adaptatif
+# (cf. Okofen_Playwright.phase_timeout)
+ADAPTIVE_PHASES = ("session", "circuit", "set_mode", "confirm")
+
+# Délais fixes historiques (ms), qui restent les plafonds
+DEFAULT_TIMEOUTS_MS = {"session": 60000}
+DEFAULT_TIMEOUT_MS = 30000
+
+# Délai Playwright dépassé ("page.goto: Timeout 15000ms exceeded.")
+TIMEOUT_RE = re.compile(r"Timeout \d+ms exceeded")
+
+# Phases dont un délai dépassé signe une chaudière injoignable (navigation
+# vers l'interface et connexion)
+UNREACHABLE_PHASES = ("session",)
+
+
+def unreachable(payload: dict):
+    """
+    True si l'échec d'une commande indique une chaudière injoignable
+    (délai dépassé, blocage, erreur réseau de Chromium, ou délai Playwright
+    dépassé pendant la navigation / la connexion).
+    """
+    if payload.get("ok"):
+        return False
+    if payload.get("error_code") in ("timeout", "stalled"):
+        return True
+    summary = payload.get("summary") or {}
+    error = summary.get("error") or ""
+    if "net::ERR_" in error:
+        return True
+    # Hôte qui ne répond pas (paquets perdus) : page.goto finit en
+    # "Timeout 15000ms exceeded" plutôt qu'en net::ERR_*. Un délai dépassé
+    # plus loin (circuit, mode...) reste une erreur d'interface.
+    if TIMEOUT_RE.search(error) or "TimeoutError" in error:
+        return summary.get("failed_phase") in UNREACHABLE_PHASES or "goto" in error
+    return False
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold: int = 3, reset_timeout: float = 60):
+        self.threshold = max(1, threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        True si une commande peut être tentée. Disjoncteur ouvert depuis plus
+        de reset_timeout : une seule commande d'essai (demi-ouvert).
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logging.info("Disjoncteur refermé : chaudière joignable")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self.last_error = None
+
+    def record_failure(self, error: str):
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.threshold
+            ):
+                logging.warning(
+                    "Disjoncteur ouvert après %s échec(s) : %s", self.failures, error
+                )
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+    def release_trial(self):
+        """
+        Commande d'essai abandonnée avant d'avoir joint la chaudière (budget
+        mémoire) : retour à l'état ouvert, sans compter d'échec. opened_at
+        est conservé, la commande suivante peut donc retenter l'essai.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def retry_in(self):
+        """
+        Secondes avant la prochaine commande d'essai (None si fermé).
+        """
+        if self.state != self.OPEN:
+            return None
+        return max(0.0, round(self.opened_at + self.reset_timeout - time.time(), 1))
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "threshold": self.threshold,
+            "opened_at": self.opened_at,
+            "retry_in_s": self.retry_in(),
+            "last_error": self.last_error,
+            "rejected": self.rejected,
+        }
+
+
+class ReachabilityProbe:
+    def __init__(self, url: str, breaker: CircuitBreaker, interval: float,
+                 timeout: float = 3.0):
+        """
+        url      : OKOFEN_URL (http://hôte[:port])
+        breaker  : disjoncteur alimenté par chaque sonde
+        interval : période entre deux sondes (s)
+        timeout  : délai de connexion / réponse de chaque sonde (s)
+        """
+        self.url = (url or "").rstrip("/")
+        self.breaker = breaker
+        self.interval = interval
+        self.timeout = timeout
+        self.last = None
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="probe", daemon=True)
+            self._thread.start()
+
+    def check(self):
+        """
+        Une sonde : connexion TCP puis HEAD HTTP (toute réponse HTTP compte,
+        même 401 / 404 : l'interface répond). Retourne le résultat.
+        """
+        parts = urlsplit(self.url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        result = {"ok": False, "checked_at": time.time(), "tcp_ms": None, "http_ms": None}
+        t0 = time.perf_counter()
+        try:
+            with socket.create_connection((parts.hostname, port), timeout=self.timeout):
+                pass
+            result["tcp_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            t0 = time.perf_counter()
+            resp = requests.head(f"{self.url}/", timeout=self.timeout, allow_redirects=False)
+            result["http_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            result["http_status"] = resp.status_code
+            result["ok"] = True
+        except (OSError, requests.RequestException) as e:
+            result["error"] = str(e) or e.__class__.__name__
+
+        if result["ok"]:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure(f"sonde : {result['error']}")
+        self.last = result
+        return result
+
+    def stats(self):
+        return {"url": self.url, "interval_s": self.interval, "last": self.last}
+
+    def _loop(self):
+        while True:
+            try:
+                self.check()
+            except Exception:
+                logging.exception("Sonde chaudière : erreur inattendue")
+            time.sleep(self.interval)
+
+
+def _percentile(values, pct: float):
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def adaptive_timeouts(results, window: int = 50, pct: float = 95, factor: float = 3.0,
+                      min_ms: int = 3000, min_samples: int = 10):
+    """
+    Délai par phase = percentile `pct` des durées observées sur les `window`
+    derniers résultats réussis, multiplié par `factor`, borné entre `min_ms`
+    et le délai fixe historique. La phase "session" ne compte que les
+    exécutions avec login (session_cache "miss"). Les phases sans assez
+    d'échantillons sont absentes (le driver garde alors le délai fixe).
+
+    results : okofen_store.ResultStore
+    """
+    samples = {phase: [] for phase in ADAPTIVE_PHASES}
+    for row in results.last(window):
+        payload = row["payload"]
+        if not payload.get("ok"):
+            continue
+        summary = payload.get("summary") or {}
+        for phase, ms in (summary.get("phases") or {}).items():
+            # Session réutilisée : quelques centaines de ms, sans rapport
+            # avec la durée d'un vrai login
+            if phase == "session" and summary.get("session_cache") != "miss":
+                continue
+            if phase in samples:
+                samples[phase].append(ms)
+
+    timeouts = {}
+    for phase, values in samples.items():
+        if len(values) < min_samples:
+            continue
+        ceiling = DEFAULT_TIMEOUTS_MS.get(phase, DEFAULT_TIMEOUT_MS)
+        timeouts[phase] = int(min(ceiling, max(min_ms, _percentile(values, pct) * factor)))
+    return timeouts
+
+
+class AdaptiveTimeouts:
+    """
+    adaptive_timeouts recalculé au plus toutes les `refresh` secondes.
+    """
+
+    def __init__(self, results, refresh: float = 60, **params):
+        self.results = results
+        self.refresh = refresh
+        self.params = params
+        self._value = {}
+        self._computed_at = None
+
+    def get(self):
+        now = time.time()
+        if self._computed_at is None or now - self._computed_at >= self.refresh:
+            try:
+                self._value = adaptive_timeouts(self.results, **self.params)
+            except Exception:
+                logging.exception("Calcul des délais adaptatifs impossible")
+            self._computed_at = now
+        return self._value
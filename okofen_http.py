@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Chemin rapide HTTP (sans Chromium) pour changer le mode du circuit Chf1.
+
+L'interface web Pellematic n'est qu'une surcouche à des requêtes CGI :
+  - POST /index.cgi   identifiant / mot de passe / langue -> login
+    (échec : redirection vers login.cgi)
+  - POST /?action=get&attr=1   body: ["<clé>", ...]   -> lecture de valeurs
+  - POST /?action=set          body: {"<clé>": "<valeur>"} -> écriture
+
+Ce module rejoue ces requêtes avec une session HTTP keep-alive et retourne
+le même contrat que Okofen_Playwright.set_mode() :
+    (changed, status_before, status_after)
+
+Toute réponse inattendue lève FastPathError : app.py retombe alors sur le
+chemin Playwright.
+"""
+import os
+import sys
+import json
+import time
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import Okofen_Playwright as okofen
+
+# Clé du mode de fonctionnement du circuit de chauffage 1 (Chf1)
+MODE_KEY = os.getenv("OKOFEN_MODE_KEY", "CAPPL:LOCAL.hk[0].betriebsart[1]")
+# Valeurs de la clé : 0 = Arrêt, 1 = Auto (2/3 = Confort/Réduit, non gérés ici)
+MODE_VALUES = {"off": "0", "on": "1"}
+HTTP_TIMEOUT = float(os.getenv("OKOFEN_HTTP_TIMEOUT", "5"))
+
+log = logging.getLogger("okofen.http")
+
+
+class FastPathError(Exception):
+    """
+    Le chemin HTTP ne sait pas traiter la situation (réponse non parsable,
+    login refusé, mode non géré...) : il faut passer par Playwright.
+    """
+
+
+class HttpDriver:
+    def __init__(self, base_url: str = None, user: str = None, password: str = None,
+                 timeout: float = HTTP_TIMEOUT):
+        self.base_url = (base_url or okofen.OKOFEN_URL or "").rstrip("/")
+        self.user = user or okofen.OKOFEN_USER
+        self.password = password or okofen.OKOFEN_PASSWORD
+        self.timeout = timeout
+        self.logged_in = False
+
+        # Session partagée : connexions keep-alive réutilisées d'une commande à l'autre
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Language"] = "fr-FR,fr;q=0.9,en;q=0.8"
+
+    # ---------------------------
+    # Requêtes bas niveau
+    # ---------------------------
+
+    def login(self):
+        if not self.base_url or not self.user or not self.password:
+            raise FastPathError("OKOFEN_URL / OKOFEN_USER / OKOFEN_PASSWORD non définis")
+        log.debug("Login via POST index.cgi")
+        try:
+            resp = self.session.post(
+                f"{self.base_url}/index.cgi",
+                data={
+                    "username": self.user,
+                    "password": self.password,
+                    "language": "fr",
+                    "submit": "Login",
+                },
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            raise FastPathError(f"Login HTTP impossible : {e}") from e
+        if resp.status_code >= 400 or "login.cgi" in resp.url or not self.session.cookies:
+            raise FastPathError(f"Login refusé (HTTP {resp.status_code})")
+        self.logged_in = True
+
+    def _post_json(self, action: str, body, retry: bool = True):
+        if not self.logged_in:
+            self.login()
+        params = {"action": action}
+        if action == "get":
+            params["attr"] = "1"
+        try:
+            resp = self.session.post(
+                f"{self.base_url}/",
+                params=params,
+                data=json.dumps(body),
+                headers={"Content-Type": "application/json"},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            raise FastPathError(f"Requête {action} impossible : {e}") from e
+
+        # Session expirée : la chaudière renvoie la page de login
+        if resp.status_code in (401, 403) or "login.cgi" in resp.url:
+            self.logged_in = False
+            if retry:
+                return self._post_json(action, body, retry=False)
+            raise FastPathError("Session refusée après re-login")
+        if resp.status_code >= 400:
+            raise FastPathError(f"HTTP {resp.status_code} sur action={action}")
+        try:
+            return resp.json()
+        except ValueError as e:
+            raise FastPathError(f"Réponse non JSON sur action={action}") from e
+
+    # ---------------------------
+    # Mode du circuit
+    # ---------------------------
+
+    def read_values(self, keys):
+        """
+        Lit plusieurs clés en une requête. Retourne {clé: valeur brute}
+        (les clés absentes de la réponse sont omises).
+        """
+        data = self._post_json("get", list(keys))
+        values = {}
+        if isinstance(data, list):
+            for item in data:
+                if isinstance(item, dict) and "name" in item:
+                    values[item["name"]] = item.get("value")
+        elif isinstance(data, dict):
+            values.update(data)
+        return {key: values[key] for key in keys if values.get(key) is not None}
+
+    def read_mode(self):
+        """
+        Retourne "on" | "off" d'après la valeur brute de MODE_KEY.
+        """
+        value = self.read_values([MODE_KEY]).get(MODE_KEY)
+        if value is None:
+            raise FastPathError(f"Clé {MODE_KEY} absente de la réponse")
+
+        for status, raw in MODE_VALUES.items():
+            if str(value).strip() == raw:
+                return status
+        raise FastPathError(f"Valeur de mode non gérée : {value!r}")
+
+    def set_mode(self, target: str):
+        """
+        Même contrat que Okofen_Playwright.set_mode().
+        """
+        if target not in MODE_VALUES:
+            raise ValueError(f"Mode inconnu : {target}")
+
+        status_before = self.read_mode()
+        log.debug("Mode actuel=%s, target=%s", status_before, target)
+        if status_before == target:
+            return False, status_before, status_before
+
+        self._post_json("set", {MODE_KEY: MODE_VALUES[target]})
+        # Relecture : on ne retourne que ce que la chaudière confirme
+        status_after = self.read_mode()
+        if status_after != target:
+            raise FastPathError(
+                f"Mode non appliqué (attendu={target}, lu={status_after})"
+            )
+        return True, status_before, status_after
+
+    def run(self, target_mode: str):
+        """
+        Exécute la commande ("on" / "off" / "status") et retourne le même dict
+        que OKOFEN_SUMMARY.
+        Lève FastPathError si le chemin HTTP doit être abandonné.
+        """
+        start = time.time()
+        details = {"driver": "http"}
+        timer = okofen.PhaseTimer(details)
+        if target_mode == "status":
+            with timer.phase("read_mode"):
+                status = self.read_mode()
+            changed, status_before, status_after = False, status, status
+        else:
+            with timer.phase("set_mode"):
+                changed, status_before, status_after = self.set_mode(target_mode)
+        duration_ms = int((time.time() - start) * 1000)
+        return okofen.build_summary(
+            target_mode, True, status_before, status_after, changed, duration_ms,
+            details=details,
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    okofen.configure_logging()
+    mode = okofen.parse_mode(sys.argv[1]) if len(sys.argv) > 1 else "off"
+    if mode is None:
+        print("Usage : python okofen_http.py [on|off|status]")
+        sys.exit(1)
+    try:
+        summary = HttpDriver().run(mode)
+    except FastPathError as e:
+        log.error("Fast path impossible : %s", e)
+        sys.exit(2)
+    print("OKOFEN_SUMMARY:" + json.dumps(summary, ensure_ascii=False))
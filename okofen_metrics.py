@@ -0,0 +1,164 @@
+"""
+Métriques Prometheus (format texte) agrégées entre workers gunicorn.
+
+Compteurs et histogrammes sont stockés dans le même fichier SQLite que les
+résultats (une ligne par série), donc /metrics donne la même réponse quel
+que soit le worker interrogé.
+"""
+import re
+
+from okofen_store import SqliteStore
+
+# Bornes des histogrammes de latence (secondes)
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+# Bornes de l'histogramme de pic mémoire (octets)
+RSS_BUCKETS = tuple(mb * 1024 * 1024 for mb in (64, 128, 256, 384, 512, 768, 1024, 1536, 2048))
+
+METRICS = {
+    "okofen_runs_total": ("counter", "Commandes exécutées, par action et résultat."),
+    "okofen_changes_total": ("counter", "Commandes ayant changé le mode de la chaudière."),
+    "okofen_skipped_total": ("counter", "Commandes ignorées car l'état vérifié correspondait déjà."),
+    "okofen_timeouts_total": ("counter", "Exécutions interrompues (SCRIPT_TIMEOUT ou blocage), par cause."),
+    "okofen_busy_total": ("counter", "Lectures refusées car une commande était en cours."),
+    "okofen_unreachable_total": ("counter", "Commandes refusées car la chaudière est injoignable (disjoncteur)."),
+    "okofen_fallbacks_total": ("counter", "Bascules vers un driver de secours, par origine."),
+    "okofen_memory_refused_total": ("counter", "Commandes refusées car le budget mémoire serait dépassé."),
+    "okofen_run_cpu_seconds_total": ("counter", "Temps CPU des exécutions (driver et Chromium), par action."),
+    "okofen_mqtt_published_total": ("counter", "Messages publiés sur le broker MQTT."),
+    "okofen_mqtt_dropped_total": ("counter", "Messages MQTT perdus (file pleine pendant une coupure du broker)."),
+    "okofen_telemetry_samples_total": ("counter", "Échantillons de télémétrie enregistrés."),
+    "okofen_telemetry_errors_total": ("counter", "Échantillons de télémétrie en échec."),
+    "okofen_run_duration_seconds": ("histogram", "Durée totale d'exécution, par action."),
+    "okofen_phase_duration_seconds": ("histogram", "Durée de chaque phase d'exécution."),
+    "okofen_run_peak_rss_bytes": ("histogram", "Pic de RSS d'une exécution (driver et Chromium), par action."),
+}
+
+
+_LE_RE = re.compile(r'(?:^|,)le="([^"]*)"')
+# Ordre des séries d'un histogramme : buckets, puis somme, puis nombre
+_SUFFIX_ORDER = {"_bucket": 0, "_sum": 1, "_count": 2}
+
+
+def _escape(value):
+    # Échappements imposés par le format texte : \, " et retour à la ligne
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+
+
+def _format_le(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _series_key(base: str, name: str, labels: str):
+    """
+    Clé de tri d'une série : labels hors `le`, puis buckets par borne
+    numérique croissante (+Inf en dernier), somme et nombre.
+    """
+    match = _LE_RE.search(labels)
+    if match is None:
+        return labels, _SUFFIX_ORDER.get(name[len(base):], 0), 0.0
+    rest = (labels[: match.start()] + labels[match.end():]).strip(",")
+    return rest, _SUFFIX_ORDER["_bucket"], float(match.group(1))
+
+
+class Metrics(SqliteStore):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS metrics (
+            name TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (name, labels)
+        );
+    """
+
+    def _add(self, conn, name: str, labels: str, amount: float):
+        conn.execute(
+            "INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+            (name, labels, amount),
+        )
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        with self._conn() as conn:
+            self._add(conn, name, _labels(**labels), amount)
+
+    def observe(self, name: str, seconds: float, **labels):
+        with self._conn() as conn:
+            self._observe(conn, name, seconds, labels)
+
+    def _observe(self, conn, name: str, seconds: float, labels: dict,
+                 buckets: tuple = LATENCY_BUCKETS):
+        for bound in buckets + (float("inf"),):
+            if seconds <= bound:
+                self._add(conn, f"{name}_bucket", _labels(le=_format_le(bound), **labels), 1)
+        self._add(conn, f"{name}_sum", _labels(**labels), seconds)
+        self._add(conn, f"{name}_count", _labels(**labels), 1)
+
+    def record_result(self, action: str, http_code: int, payload: dict):
+        """
+        Met à jour toutes les métriques à partir d'un payload de commande
+        (une seule transaction).
+        """
+        summary = payload.get("summary") or {}
+        with self._conn() as conn:
+            if payload.get("skipped"):
+                self._add(conn, "okofen_skipped_total", _labels(action=action), 1)
+                return
+            result = "ok" if payload.get("ok") else "error"
+            self._add(conn, "okofen_runs_total", _labels(action=action, result=result), 1)
+            if payload.get("changed"):
+                self._add(conn, "okofen_changes_total", _labels(action=action), 1)
+            if payload.get("error_code") in ("timeout", "stalled"):
+                self._add(conn, "okofen_timeouts_total", _labels(reason=payload["error_code"]), 1)
+            if payload.get("error_code") == "unreachable":
+                self._add(conn, "okofen_unreachable_total", _labels(action=action), 1)
+            if payload.get("error_code") == "memory_budget":
+                self._add(conn, "okofen_memory_refused_total", _labels(action=action), 1)
+            if payload.get("fallback_reason"):
+                self._add(conn, "okofen_fallbacks_total", _labels(source="http"), 1)
+            if payload.get("driver_fallback_reason"):
+                self._add(conn, "okofen_fallbacks_total", _labels(source="daemon"), 1)
+
+            duration_ms = payload.get("duration_ms")
+            if duration_ms:
+                self._observe(conn, "okofen_run_duration_seconds", duration_ms / 1000.0,
+                              {"action": action})
+            for phase, ms in (summary.get("phases") or {}).items():
+                self._observe(conn, "okofen_phase_duration_seconds", ms / 1000.0,
+                              {"phase": phase})
+            resources = summary.get("resources") or {}
+            if resources.get("peak_rss_mb"):
+                self._observe(conn, "okofen_run_peak_rss_bytes",
+                              resources["peak_rss_mb"] * 1024 * 1024, {"action": action},
+                              buckets=RSS_BUCKETS)
+            if resources.get("cpu_s"):
+                self._add(conn, "okofen_run_cpu_seconds_total", _labels(action=action),
+                          resources["cpu_s"])
+
+    def render(self):
+        """
+        Exposition au format texte Prometheus.
+        """
+        rows = self._conn().execute("SELECT name, labels, value FROM metrics").fetchall()
+        by_metric = {}
+        for name, labels, value in rows:
+            base = name
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and name[: -len(suffix)] in METRICS:
+                    base = name[: -len(suffix)]
+            by_metric.setdefault(base, []).append((name, labels, value))
+
+        lines = []
+        for base, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {base} {help_text}")
+            lines.append(f"# TYPE {base} {kind}")
+            series_rows = sorted(
+                by_metric.get(base, []), key=lambda row: _series_key(base, row[0], row[1])
+            )
+            for name, labels, value in series_rows:
+                series = f"{name}{{{labels}}}" if labels else name
+                lines.append(f"{series} {int(value) if value.is_integer() else value}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,327 @@
+"""
+Publication MQTT des résultats de commande et du mode vérifié, pour que
+Home Assistant n'ait plus à interroger /last après le 202 de /on et /off.
+
+Topics (MQTT_TOPIC_PREFIX, "okofen" par défaut), tous retenus :
+- <prefix>/state        : dernier mode vérifié, "on" / "off"
+- <prefix>/result       : dernier résultat de commande (JSON réduit)
+- <prefix>/availability : "online" / "offline" (message de dernière volonté)
+et les configurations de découverte Home Assistant
+(<MQTT_DISCOVERY_PREFIX>/binary_sensor|sensor/<MQTT_NODE_ID>/.../config).
+
+Un seul worker gunicorn publie (élection par verrou fichier, comme la
+télémétrie), sur une connexion persistante : reconnexion automatique avec
+délai exponentiel (MQTT_RECONNECT_MIN à MQTT_RECONNECT_MAX s). Il suit le
+journal SQLite des résultats, donc les commandes exécutées par les autres
+workers (ou par okofen_asgi.py) sont publiées aussi ; dans son propre
+processus, notify() le réveille sans attendre MQTT_POLL_INTERVAL.
+
+Le chemin de commande ne fait qu'enregistrer le résultat (déjà le cas) et
+lever un Event : ni connexion ni écriture réseau. Broker injoignable : les
+messages attendent dans une file bornée (MQTT_QUEUE_SIZE, les plus anciens
+sont perdus) ; le mode et le dernier résultat sont republiés à chaque
+reconnexion.
+
+Dépendance optionnelle : paho-mqtt. Sans elle (ou sans MQTT_HOST), rien
+n'est publié.
+"""
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import collections
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:  # paho-mqtt absent : publication désactivée
+    mqtt = None
+
+from okofen_store import ProcessLock
+
+# Champs du payload repris dans <prefix>/result (le résumé complet reste
+# dans /results)
+RESULT_FIELDS = (
+    "ok", "action", "status", "changed", "skipped", "duration_ms", "error_code",
+    "error_message", "speech", "seq", "run_id", "trace_id", "artifacts_url", "targets",
+)
+
+log = logging.getLogger("okofen.mqtt")
+
+
+def _verified_state(action: str, payload: dict):
+    """
+    Mode vérifié porté par un résultat ("on" / "off"), None sinon.
+    """
+    if action not in ("on", "off", "status") or not payload.get("ok"):
+        return None
+    status = payload.get("status")
+    return status if status in ("on", "off") else None
+
+
+def result_message(row: dict):
+    """
+    Ligne de ResultStore.since() -> payload JSON de <prefix>/result.
+    """
+    payload = row["payload"]
+    message = {k: payload[k] for k in RESULT_FIELDS if payload.get(k) is not None}
+    message.update(id=row["id"], ts=row["ts"], kind=row["action"], http_code=row["http_code"])
+    return message
+
+
+class MqttPublisher:
+    def __init__(self, results, host: str, port: int = 1883, username: str = None,
+                 password: str = None, prefix: str = "okofen",
+                 discovery_prefix: str = "homeassistant", node_id: str = "okofen",
+                 qos: int = 1, queue_size: int = 100, reconnect_min: float = 1,
+                 reconnect_max: float = 60, poll_interval: float = 1.0,
+                 lock_path: str = "/tmp/okofen-mqtt.lock", metrics=None):
+        """
+        results          : okofen_store.ResultStore (journal suivi)
+        discovery_prefix : préfixe de découverte Home Assistant (vide = sans)
+        queue_size       : messages en attente max pendant une coupure
+        poll_interval    : relecture du journal (résultats des autres workers)
+        metrics          : okofen_metrics.Metrics (optionnel)
+        """
+        self.results = results
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.prefix = prefix.rstrip("/")
+        self.discovery_prefix = (discovery_prefix or "").rstrip("/")
+        self.node_id = node_id
+        self.qos = qos
+        self.queue_size = max(1, queue_size)
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self.poll_interval = poll_interval
+        self.lock = ProcessLock(lock_path)
+        self.metrics = metrics
+        self.leader = False
+        self.connected = False
+        self.connects = 0
+        self.published = 0
+        self.dropped = 0
+        self.last_error = None
+        self._queue = collections.deque()
+        self._state = None
+        self._state_sent = None
+        self._last_result = None
+        self._last_id = None
+        self._resync = False
+        self._wake = threading.Event()
+        self._client = None
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return bool(self.host) and mqtt is not None
+
+    def start(self):
+        if not self.host:
+            return
+        if mqtt is None:
+            logging.warning("MQTT_HOST défini mais paho-mqtt n'est pas installé : MQTT désactivé")
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="mqtt", daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        """
+        Nouveau résultat enregistré : réveille le publieur. Ne bloque jamais.
+        """
+        self._wake.set()
+
+    def stats(self):
+        return {
+            "broker": f"{self.host}:{self.port}",
+            "leader": self.leader,
+            "connected": self.connected,
+            "connects": self.connects,
+            "published": self.published,
+            "dropped": self.dropped,
+            "queued": len(self._queue),
+            "state": self._state_sent,
+            "last_error": self.last_error,
+        }
+
+    # ---------------------------
+    # Topics et découverte Home Assistant
+    # ---------------------------
+
+    def topic(self, name: str):
+        return f"{self.prefix}/{name}"
+
+    def discovery(self):
+        """
+        [(topic, payload)] des configurations de découverte Home Assistant.
+        """
+        if not self.discovery_prefix:
+            return []
+        device = {
+            "identifiers": [self.node_id],
+            "name": "Okofen",
+            "manufacturer": "ÖkoFEN",
+            "model": "Pellematic",
+        }
+        common = {
+            "availability_topic": self.topic("availability"),
+            "device": device,
+        }
+        heating = {
+            **common,
+            "name": "Chauffage",
+            "unique_id": f"{self.node_id}_heating",
+            "state_topic": self.topic("state"),
+            "payload_on": "on",
+            "payload_off": "off",
+            "device_class": "heat",
+        }
+        last_result = {
+            **common,
+            "name": "Dernière commande",
+            "unique_id": f"{self.node_id}_last_result",
+            "state_topic": self.topic("result"),
+            "value_template": "{{ 'ok' if value_json.ok else (value_json.error_code or 'error') }}",
+            "json_attributes_topic": self.topic("result"),
+            "icon": "mdi:fire",
+        }
+        base = self.discovery_prefix
+        return [
+            (f"{base}/binary_sensor/{self.node_id}/heating/config", heating),
+            (f"{base}/sensor/{self.node_id}/last_result/config", last_result),
+        ]
+
+    # ---------------------------
+    # File d'attente
+    # ---------------------------
+
+    def _enqueue(self, topic: str, payload):
+        if len(self._queue) >= self.queue_size:
+            self._queue.popleft()
+            self.dropped += 1
+            if self.metrics is not None:
+                self.metrics.inc("okofen_mqtt_dropped_total")
+        self._queue.append((topic, payload))
+
+    def _collect(self):
+        """
+        Résultats enregistrés depuis le dernier passage -> file d'attente.
+        """
+        if self._last_id is None:
+            # Prise de fonction : on ne rejoue pas l'historique, on repart
+            # du dernier mode vérifié et du dernier résultat
+            rows = self.results.last(1)
+            self._last_id = rows[0]["id"] if rows else 0
+            self._state = self.results.last_verified(float("inf"))
+            if rows:
+                row = self.results.since(self._last_id - 1, 1)[0]
+                self._last_result = json.dumps(result_message(row), ensure_ascii=False)
+            return
+        for row in self.results.since(self._last_id, self.queue_size):
+            self._last_id = row["id"]
+            message = json.dumps(result_message(row), ensure_ascii=False)
+            self._last_result = message
+            self._enqueue(self.topic("result"), message)
+            state = _verified_state(row["action"], row["payload"])
+            if state is not None:
+                self._state = state
+
+    def _publish(self, topic: str, payload) -> bool:
+        if isinstance(payload, dict):
+            payload = json.dumps(payload, ensure_ascii=False)
+        info = self._client.publish(topic, payload, qos=self.qos, retain=True)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            # Déconnecté entre-temps (ou file de paho pleine) : message gardé
+            return False
+        self.published += 1
+        if self.metrics is not None:
+            self.metrics.inc("okofen_mqtt_published_total")
+        return True
+
+    def _flush(self):
+        if not self.connected:
+            return
+        if self._resync:
+            # (Re)connexion : le broker a pu perdre ses messages retenus
+            messages = [(self.topic("availability"), "online")] + self.discovery()
+            if self._last_result is not None and not self._queue:
+                messages.append((self.topic("result"), self._last_result))
+            if not all(self._publish(topic, payload) for topic, payload in messages):
+                return
+            self._resync = False
+            self._state_sent = None
+        while self._queue:
+            topic, payload = self._queue[0]
+            if not self._publish(topic, payload):
+                return
+            self._queue.popleft()
+        # Le mode n'est publié que s'il change (ou après reconnexion)
+        if self._state is not None and self._state != self._state_sent:
+            if self._publish(self.topic("state"), self._state):
+                self._state_sent = self._state
+
+    # ---------------------------
+    # Connexion (thread réseau de paho-mqtt)
+    # ---------------------------
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            self.last_error = f"connexion refusée : {reason_code}"
+            log.warning("MQTT : %s", self.last_error)
+            return
+        self.connects += 1
+        self.connected = True
+        self._resync = True
+        log.info("MQTT : connecté à %s:%s", self.host, self.port)
+        self._wake.set()
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        if self.connected:
+            log.warning("MQTT : déconnecté (%s), reconnexion en arrière-plan", reason_code)
+        self.connected = False
+        if reason_code.is_failure:
+            self.last_error = f"déconnecté : {reason_code}"
+
+    def _on_connect_fail(self, client, userdata):
+        self.last_error = f"{self.host}:{self.port} injoignable"
+        log.debug("MQTT : %s", self.last_error)
+
+    def _connect(self):
+        client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=f"{self.node_id}-{socket.gethostname()}-{os.getpid()}",
+        )
+        if self.username:
+            client.username_pw_set(self.username, self.password)
+        client.will_set(self.topic("availability"), "offline", qos=self.qos, retain=True)
+        client.reconnect_delay_set(self.reconnect_min, self.reconnect_max)
+        client.max_queued_messages_set(self.queue_size)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_connect_fail = self._on_connect_fail
+        # Connexion et reconnexions faites par le thread réseau de paho
+        client.connect_async(self.host, self.port, keepalive=60)
+        client.loop_start()
+        return client
+
+    def _loop(self):
+        # Une seule connexion tous workers confondus ; les autres retentent
+        # régulièrement au cas où le leader disparaîtrait
+        while not self.lock.acquire(blocking=False):
+            time.sleep(30)
+        self.leader = True
+        log.info("MQTT : ce worker publie (pid=%s) vers %s:%s", os.getpid(), self.host, self.port)
+        self._client = self._connect()
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self._collect()
+                self._flush()
+            except Exception as e:
+                self.last_error = str(e)
+                log.exception("MQTT : publication impossible")
@@ -0,0 +1,196 @@
+"""
+Paramètres réglables de la chaudière (POST /params) : registre des champs,
+validation des valeurs demandées et lecture des valeurs affichées.
+
+Chaque champ est une ligne "<libellé><valeur>" d'une page de l'interface
+(même principe que "ModeAuto" sur la page du circuit) : un clic sur la
+ligne ouvre une popup (saisie numérique ou boutons de choix) validée par
+"OK". Les libellés par défaut sont ceux de l'interface Pellematic en
+français ; OKOFEN_PARAMS (JSON) permet de les corriger ou d'ajouter des
+champs sans toucher au code :
+
+    {"pages": {"hot_water": {"link": "ECS1 Eau chaude"}},
+     "fields": {"comfort_temp": {"label": "Temp. confort"}, "eco_temp": null}}
+
+Le mode du circuit (Auto / Arrêt) n'en fait pas partie : il passe par /on et
+/off (état désiré, réconciliateur, cache de statut).
+"""
+import os
+import re
+import json
+import math
+
+DEFAULT_PAGES = {
+    "circuit": {"link": "Chf1 Chauffage", "ready": "Nom du circuit"},
+    "hot_water": {"link": "ECS1 Eau chaude", "ready": None},
+}
+
+DEFAULT_FIELDS = {
+    "room_setpoint": {
+        "page": "circuit", "label": "Consigne ambiante", "kind": "number",
+        "min": 10, "max": 30, "step": 0.5, "unit": "°C",
+    },
+    "comfort_temp": {
+        "page": "circuit", "label": "Température confort", "kind": "number",
+        "min": 10, "max": 30, "step": 0.5, "unit": "°C",
+    },
+    "eco_temp": {
+        "page": "circuit", "label": "Température réduite", "kind": "number",
+        "min": 5, "max": 25, "step": 0.5, "unit": "°C",
+    },
+    "hot_water_mode": {
+        "page": "hot_water", "label": "Mode", "kind": "choice",
+        "choices": {"auto": "Auto", "on": "Marche", "off": "Arrêt"},
+    },
+}
+
+_NUMBER_RE = re.compile(r"-?\d+(?:[.,]\d+)?")
+
+
+class Param:
+    def __init__(self, name: str, page: str, label: str, kind: str = "number",
+                 min: float = None, max: float = None, step: float = None,
+                 unit: str = "", choices: dict = None):
+        if kind not in ("number", "choice"):
+            raise ValueError(f"Champ {name!r} : type inconnu {kind!r}")
+        if kind == "choice" and not choices:
+            raise ValueError(f"Champ {name!r} : \"choices\" manquant")
+        self.name = name
+        self.page = page
+        self.label = label
+        self.kind = kind
+        self.min = min
+        self.max = max
+        self.step = step
+        self.unit = unit
+        # Valeur de l'API -> libellé du bouton dans la popup
+        self.choices = dict(choices or {})
+
+    def normalize(self, value):
+        """
+        Valeur demandée -> valeur canonique (float arrondi au pas, ou clé
+        de `choices`). Lève ValueError si elle est invalide.
+        """
+        if self.kind == "number":
+            if isinstance(value, bool):
+                raise ValueError("nombre attendu")
+            try:
+                number = float(str(value).replace(",", "."))
+            except ValueError:
+                raise ValueError("nombre attendu") from None
+            if not math.isfinite(number):
+                # "inf", "nan", 1e400 : pas une consigne
+                raise ValueError("nombre attendu")
+            if self.step:
+                number = round(round(number / self.step) * self.step, 3)
+            if (self.min is not None and number < self.min) or (
+                self.max is not None and number > self.max
+            ):
+                raise ValueError(f"hors plage [{self.min}, {self.max}]")
+            return number
+
+        key = str(value).strip().lower()
+        for choice, label in self.choices.items():
+            if key in (choice.lower(), label.lower()):
+                return choice
+        raise ValueError(f"valeur attendue parmi {sorted(self.choices)}")
+
+    def input_text(self, value):
+        """
+        Texte saisi dans la popup (nombre) ou libellé du bouton (choix).
+        """
+        if self.kind == "number":
+            return f"{value:g}"
+        return self.choices[value]
+
+    def parse(self, text):
+        """
+        Texte affiché après le libellé -> valeur canonique (None si illisible).
+        """
+        if text is None:
+            return None
+        if self.kind == "number":
+            m = _NUMBER_RE.search(text)
+            return float(m.group(0).replace(",", ".")) if m else None
+        text = text.strip().lower()
+        for choice, label in self.choices.items():
+            if text == label.lower() or text.startswith(label.lower() + " "):
+                return choice
+        return None
+
+    def describe(self):
+        info = {"page": self.page, "label": self.label, "kind": self.kind}
+        if self.kind == "number":
+            info.update(min=self.min, max=self.max, step=self.step, unit=self.unit)
+        else:
+            info["choices"] = sorted(self.choices)
+        return info
+
+
+def load_params():
+    """
+    (pages, champs) : registre par défaut complété / corrigé par
+    OKOFEN_PARAMS. Lève ValueError si la configuration est invalide.
+    """
+    pages = {k: dict(v) for k, v in DEFAULT_PAGES.items()}
+    fields = {k: dict(v) for k, v in DEFAULT_FIELDS.items()}
+
+    raw = os.getenv("OKOFEN_PARAMS", "").strip()
+    if raw:
+        try:
+            config = json.loads(raw)
+        except ValueError as e:
+            raise ValueError(f"OKOFEN_PARAMS n'est pas du JSON valide : {e}") from e
+        if not isinstance(config, dict):
+            raise ValueError("OKOFEN_PARAMS doit être un objet JSON")
+        for target, overrides in ((pages, config.get("pages")), (fields, config.get("fields"))):
+            for name, cfg in (overrides or {}).items():
+                if cfg is None:
+                    target.pop(name, None)
+                else:
+                    target[name] = {**target.get(name, {}), **cfg}
+
+    params = {}
+    for name, cfg in fields.items():
+        if cfg.get("page") not in pages or not pages[cfg["page"]].get("link"):
+            raise ValueError(f"Champ {name!r} : page {cfg.get('page')!r} inconnue")
+        if not cfg.get("label"):
+            raise ValueError(f"Champ {name!r} : \"label\" manquant")
+        try:
+            params[name] = Param(name, **cfg)
+        except TypeError as e:
+            raise ValueError(f"Champ {name!r} : {e}") from e
+    return pages, params
+
+
+def validate(raw, params: dict):
+    """
+    Changements demandés ({"champ": valeur} ou [{"field", "value"}]) ->
+    (changements [{"field", "value"}] normalisés, erreurs [{"field", "error"}]).
+    Le dernier changement d'un même champ l'emporte.
+    """
+    if isinstance(raw, dict):
+        items = [{"field": k, "value": v} for k, v in raw.items()]
+    elif isinstance(raw, list):
+        items = raw
+    else:
+        return [], [{"field": None, "error": "params attendu : objet ou liste"}]
+
+    changes = {}
+    errors = []
+    for item in items:
+        if not isinstance(item, dict) or "field" not in item or "value" not in item:
+            errors.append({"field": None, "error": "élément attendu : {\"field\", \"value\"}"})
+            continue
+        name = item["field"]
+        param = params.get(name)
+        if param is None:
+            errors.append({"field": name, "error": "champ inconnu"})
+            continue
+        try:
+            changes[name] = param.normalize(item["value"])
+        except ValueError as e:
+            errors.append({"field": name, "error": str(e)})
+    if not changes and not errors:
+        errors.append({"field": None, "error": "aucun paramètre"})
+    return [{"field": k, "value": v} for k, v in changes.items()], errors
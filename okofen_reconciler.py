@@ -0,0 +1,149 @@
+"""
+Réconciliateur d'état désiré.
+
+Au lieu de refuser (429 "busy") une commande qui arrive pendant une autre,
+app.py enregistre le dernier état demandé (DesiredState) et réveille ce
+thread. Une rafale "off, on, off" pendant une exécution donne au plus une
+exécution supplémentaire, pour la demande la plus récente, et aucune si le
+dernier état vérifié correspond déjà.
+"""
+import logging
+import threading
+
+
+class Reconciler:
+    def __init__(self, desired, lock, execute, record, verified_status,
+                 poll_interval: float = 5.0):
+        """
+        desired          : okofen_store.DesiredState (partagé entre workers)
+        lock             : verrou d'exécution (okofen_store.ProcessLock)
+        execute(action, progress) : pilote la chaudière -> (http_code, payload),
+                           lock détenu ; progress(dict) met à jour le job
+        record(action, http_code, payload) : enregistre le résultat
+        verified_status(): dernier mode vérifié ("on" / "off") ou None
+        """
+        self.desired = desired
+        self.lock = lock
+        self.execute = execute
+        self.record = record
+        self.verified_status = verified_status
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="reconciler", daemon=True)
+            self._thread.start()
+
+    def submit(self, action: str):
+        """
+        Enregistre l'état désiré et retourne les statistiques de la file,
+        avec l'identifiant du job créé ("job_id").
+        """
+        seq, job_id = self.desired.submit(action)
+        self._wake.set()
+        stats = self.desired.stats()
+        stats["request_seq"] = seq
+        stats["job_id"] = job_id
+        return stats
+
+    def stats(self):
+        return self.desired.stats()
+
+    # ---------------------------
+    # Boucle
+    # ---------------------------
+
+    def _loop(self):
+        while True:
+            # Réveil sur soumission locale, ou périodique pour reprendre une
+            # demande laissée par un autre worker
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                while self._reconcile_once():
+                    pass
+            except Exception:
+                logging.exception("Erreur dans le réconciliateur")
+
+    def _reconcile_once(self) -> bool:
+        """
+        Traite la demande en attente la plus récente. Retourne True si une
+        demande a été traitée (il peut en rester une autre).
+        """
+        if self.desired.pending() is None:
+            return False
+
+        self.lock.acquire()
+        try:
+            # Relecture sous verrou : un autre worker a pu la traiter entre-temps
+            pending = self.desired.pending()
+            if pending is None:
+                return False
+            seq, action = pending
+
+            verified = self.verified_status()
+            if verified == action:
+                logging.info(
+                    "Réconciliation ignorée : état vérifié déjà %s (seq=%s)", action, seq
+                )
+                http_code, payload = 200, self._skipped_payload(action)
+            else:
+                logging.info("Réconciliation vers %s (seq=%s)", action, seq)
+                self.desired.mark_running(seq, {"phase": "run", "action": action})
+                try:
+                    http_code, payload = self.execute(
+                        action,
+                        lambda info: self.desired.mark_running(seq, {"action": action, **info}),
+                    )
+                except Exception as e:
+                    # La demande est quand même traitée (jobs terminés, seq
+                    # marqué) : sinon elle serait relancée à chaque passage
+                    logging.exception("Réconciliation vers %s en échec (seq=%s)", action, seq)
+                    http_code, payload = 500, self._error_payload(action, e)
+            payload["seq"] = seq
+            # Enregistré avant de libérer le verrou : la prochaine réconciliation
+            # voit déjà ce résultat comme dernier état vérifié
+            self.record(action, http_code, payload)
+            self.desired.mark_handled(seq, http_code, payload)
+        finally:
+            self.lock.release()
+
+        logging.info(
+            "Réconciliation terminée action=%s http_code=%s ok=%s status=%s",
+            action,
+            http_code,
+            payload.get("ok"),
+            payload.get("status"),
+        )
+        return True
+
+    @staticmethod
+    def _error_payload(action: str, error: Exception):
+        return {
+            "ok": False,
+            "action": action,
+            "status": "unknown",
+            "changed": None,
+            "duration_ms": 0,
+            "error_code": "execution_error",
+            "error_message": str(error) or error.__class__.__name__,
+            "speech": "Une erreur est survenue pendant le pilotage de la chaudière.",
+        }
+
+    @staticmethod
+    def _skipped_payload(action: str):
+        if action == "on":
+            speech = "La chaudière était déjà allumée."
+        else:
+            speech = "La chaudière était déjà à l'arrêt."
+        return {
+            "ok": True,
+            "action": action,
+            "status": action,
+            "changed": False,
+            "skipped": True,
+            "duration_ms": 0,
+            "speech": speech,
+        }
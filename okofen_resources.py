@@ -0,0 +1,296 @@
+"""
+Consommation mémoire / CPU des exécutions Playwright.
+
+- ResourceMonitor : échantillonne (via /proc, sans dépendance) le processus
+  courant et tous ses descendants (driver Node de Playwright, processus
+  Chromium) pendant une exécution. Le pic de RSS et le temps CPU consommé
+  sont ajoutés au résumé (details["resources"]).
+- MemoryBudget : avant une exécution, compare la mémoire utilisée par le
+  conteneur (cgroup, sinon /proc/meminfo) plus le coût estimé d'une
+  exécution (percentile des dernières hausses de RSS mesurées) à
+  MEMORY_BUDGET_MB. Au-delà, l'exécution attend (MEMORY_WAIT) puis est
+  refusée.
+
+Hors Linux (pas de /proc), les mesures sont absentes et le budget n'est
+jamais bloquant.
+"""
+import os
+import time
+import logging
+import threading
+
+RESOURCE_SAMPLE_MS = int(os.getenv("RESOURCE_SAMPLE_MS", "200"))
+
+try:
+    _CLK_TCK = os.sysconf("SC_CLK_TCK")
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _CLK_TCK = _PAGE_SIZE = None
+
+_MB = 1024 * 1024
+
+
+def _read_stat(pid: int):
+    """
+    (ppid, ticks CPU utilisateur + système, RSS en octets) d'un processus,
+    None s'il a disparu.
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            data = f.read().decode("ascii", "replace")
+    except OSError:
+        return None
+    # Le nom (2e champ) peut contenir espaces et parenthèses
+    fields = data[data.rfind(")") + 2:].split()
+    return int(fields[1]), int(fields[11]) + int(fields[12]), int(fields[21]) * _PAGE_SIZE
+
+
+def process_tree(root: int):
+    """
+    {pid: (ticks CPU, RSS)} de `root` et de tous ses descendants.
+    """
+    stats = {}
+    children = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return stats
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        stat = _read_stat(int(entry))
+        if stat is None:
+            continue
+        ppid, ticks, rss = stat
+        stats[int(entry)] = (ticks, rss)
+        children.setdefault(ppid, []).append(int(entry))
+
+    tree = {}
+    todo = [root]
+    while todo:
+        pid = todo.pop()
+        if pid in stats and pid not in tree:
+            tree[pid] = stats[pid]
+            todo.extend(children.get(pid, ()))
+    return tree
+
+
+class ResourceMonitor:
+    """
+    Pic de RSS (somme du processus et de ses descendants, pages partagées
+    comptées par processus) et temps CPU d'un bloc :
+
+        with ResourceMonitor(details):
+            ...
+
+    écrit details["resources"] = {"peak_rss_mb", "start_rss_mb",
+    "rss_delta_mb", "cpu_s", "max_processes", "samples"}.
+    """
+
+    def __init__(self, details: dict = None, root: int = None,
+                 interval_ms: int = RESOURCE_SAMPLE_MS):
+        self.details = details if details is not None else {}
+        self.root = root or os.getpid()
+        self.interval = max(10, interval_ms) / 1000.0
+        self.enabled = _CLK_TCK is not None and os.path.isdir("/proc")
+        self._stop = threading.Event()
+        self._thread = None
+        self._baseline = {}
+        self._last = {}
+        self.start_rss = 0
+        self.peak_rss = 0
+        self.max_processes = 0
+        self.samples = 0
+
+    def _sample(self):
+        tree = process_tree(self.root)
+        for pid, (ticks, _rss) in tree.items():
+            # Processus apparus pendant le bloc : tout leur CPU compte
+            self._baseline.setdefault(pid, 0)
+            self._last[pid] = ticks
+        rss = sum(r for _t, r in tree.values())
+        self.peak_rss = max(self.peak_rss, rss)
+        self.max_processes = max(self.max_processes, len(tree))
+        self.samples += 1
+        return tree
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e:
+                logging.getLogger("okofen.resources").debug("Échantillon impossible : %s", e)
+
+    def __enter__(self):
+        if self.enabled:
+            tree = process_tree(self.root)
+            self._baseline = {pid: ticks for pid, (ticks, _rss) in tree.items()}
+            self._last = dict(self._baseline)
+            self.start_rss = self.peak_rss = sum(r for _t, r in tree.values())
+            self.max_processes = len(tree)
+            self._thread = threading.Thread(target=self._loop, name="resources", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+            self.details["resources"] = self.result()
+        return False
+
+    def result(self):
+        ticks = sum(self._last[pid] - self._baseline.get(pid, 0) for pid in self._last)
+        return {
+            "peak_rss_mb": round(self.peak_rss / _MB, 1),
+            "start_rss_mb": round(self.start_rss / _MB, 1),
+            "rss_delta_mb": round(max(0, self.peak_rss - self.start_rss) / _MB, 1),
+            "cpu_s": round(ticks / _CLK_TCK, 2),
+            "max_processes": self.max_processes,
+            "samples": self.samples,
+        }
+
+
+# ---------------------------
+# Budget mémoire (app.py, okofen_asgi.py)
+# ---------------------------
+
+def _read_int(path: str):
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def _cgroup_inactive_file(path: str, key: str):
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, value = line.partition(" ")
+                if name == key:
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def memory_used_mb():
+    """
+    Mémoire utilisée par le conteneur (Mo), cache de fichiers inactif
+    exclu : cgroup v2, puis v1, puis /proc/meminfo. None si inconnue.
+    """
+    usage = _read_int("/sys/fs/cgroup/memory.current")
+    if usage is not None:
+        usage -= _cgroup_inactive_file("/sys/fs/cgroup/memory.stat", "inactive_file")
+        return round(usage / _MB, 1)
+    usage = _read_int("/sys/fs/cgroup/memory/memory.usage_in_bytes")
+    if usage is not None:
+        usage -= _cgroup_inactive_file(
+            "/sys/fs/cgroup/memory/memory.stat", "total_inactive_file"
+        )
+        return round(usage / _MB, 1)
+    info = {}
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                info[name] = int(value.split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    if "MemTotal" not in info or "MemAvailable" not in info:
+        return None
+    return round((info["MemTotal"] - info["MemAvailable"]) / 1024.0, 1)
+
+
+def _percentile(values, pct: float):
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+class MemoryBudget:
+    def __init__(self, results, budget_mb: float, default_estimate_mb: float = 300,
+                 window: int = 20, min_samples: int = 5, refresh: float = 60):
+        """
+        results             : okofen_store.ResultStore (mesures des exécutions)
+        budget_mb           : mémoire totale à ne pas dépasser (0 = désactivé)
+        default_estimate_mb : coût d'une exécution tant qu'il n'y a pas assez
+                              de mesures
+        """
+        self.results = results
+        self.budget_mb = budget_mb
+        self.default_estimate_mb = default_estimate_mb
+        self.window = window
+        self.min_samples = min_samples
+        self.refresh = refresh
+        self.poll_interval = 0.5
+        self.refused = 0
+        self.waited = 0
+        self._estimate = default_estimate_mb
+        self._computed_at = None
+
+    def estimate_mb(self):
+        """
+        Coût d'une exécution : p95 des hausses de RSS (rss_delta_mb) des
+        `window` derniers résultats mesurés, recalculé toutes les `refresh` s.
+        """
+        now = time.time()
+        if self._computed_at is not None and now - self._computed_at < self.refresh:
+            return self._estimate
+        self._computed_at = now
+        try:
+            samples = [
+                ((row["payload"].get("summary") or {}).get("resources") or {}).get("rss_delta_mb")
+                for row in self.results.last(self.window)
+            ]
+        except Exception:
+            logging.exception("Estimation du coût mémoire impossible")
+            return self._estimate
+        samples = [s for s in samples if s]
+        if len(samples) >= self.min_samples:
+            self._estimate = round(_percentile(samples, 95), 1)
+        else:
+            self._estimate = self.default_estimate_mb
+        return self._estimate
+
+    def check(self):
+        """
+        (autorisé, mémoire utilisée en Mo, coût estimé en Mo).
+        """
+        if self.budget_mb <= 0:
+            return True, None, None
+        used = memory_used_mb()
+        estimate = self.estimate_mb()
+        if used is None:
+            return True, None, estimate
+        return used + estimate <= self.budget_mb, used, estimate
+
+    def wait(self, timeout: float):
+        """
+        Attend (au plus `timeout` s) que le budget permette une exécution.
+        Retourne check() au dernier essai.
+        """
+        deadline = time.monotonic() + timeout
+        allowed, used, estimate = self.check()
+        if not allowed:
+            self.waited += 1
+        while not allowed and time.monotonic() < deadline:
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+            allowed, used, estimate = self.check()
+        if not allowed:
+            self.refused += 1
+        return allowed, used, estimate
+
+    def stats(self):
+        return {
+            "budget_mb": self.budget_mb,
+            "used_mb": memory_used_mb(),
+            "estimate_mb": self.estimate_mb() if self.budget_mb > 0 else None,
+            "waited": self.waited,
+            "refused": self.refused,
+        }
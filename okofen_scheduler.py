@@ -0,0 +1,385 @@
+"""
+Programmation des passages on/off dans le service lui-même (plus besoin que
+Home Assistant soit disponible à l'heure d'une transition).
+
+- Plans hebdomadaires : jours + heure locale + action ("lun-ven 06:30 on").
+- Dérogations ponctuelles : une action à une date précise, exécutée une fois.
+
+Tout est stocké dans SQLite (ScheduleStore). Un seul worker gunicorn fait
+tourner le Scheduler (élection par verrou fichier) : un tas (heapq) des
+prochaines échéances, reconstruit quand la programmation change.
+
+Chaque échéance passe par le même chemin que /on et /off
+(Reconciler.submit) : une transition déjà satisfaite par le dernier état
+vérifié ne lance pas de session chaudière, et des transitions rapprochées
+sont coalescées en une seule exécution.
+"""
+import time
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from okofen_store import ProcessLock, SqliteStore
+
+DAY_NAMES = {
+    "mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6,
+    "lun": 0, "mar": 1, "mer": 2, "jeu": 3, "ven": 4, "sam": 5, "dim": 6,
+}
+
+
+def parse_days(spec):
+    """
+    "lun-ven", "sat,sun", "*", [0, 6]... -> liste triée de jours (0 = lundi).
+    Lève ValueError si la spécification est invalide.
+    """
+    if isinstance(spec, (list, tuple)):
+        parts = [str(p) for p in spec]
+    else:
+        parts = str(spec).lower().replace(" ", "").split(",")
+    days = set()
+    for part in parts:
+        part = part.lower()
+        if part in ("*", "all", "tous"):
+            days.update(range(7))
+        elif "-" in part:
+            first, _, last = part.partition("-")
+            a, b = _day(first), _day(last)
+            days.update(range(a, b + 1) if a <= b else list(range(a, 7)) + list(range(0, b + 1)))
+        elif part:
+            days.add(_day(part))
+    if not days:
+        raise ValueError("Aucun jour indiqué")
+    return sorted(days)
+
+
+def _day(name: str):
+    if name.isdigit() and 0 <= int(name) <= 6:
+        return int(name)
+    if name[:3] in DAY_NAMES:
+        return DAY_NAMES[name[:3]]
+    raise ValueError(f"Jour inconnu : {name!r}")
+
+
+def parse_time_of_day(value: str):
+    """
+    "06:30" -> (6, 30). Lève ValueError si invalide.
+    """
+    hour, _, minute = str(value).partition(":")
+    hour, minute = int(hour), int(minute or 0)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Heure invalide : {value!r}")
+    return hour, minute
+
+
+def parse_when(value):
+    """
+    Epoch (nombre) ou date ISO locale ("2026-10-20T06:30") -> epoch.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(str(value)).timestamp()
+
+
+def next_weekly(days, hour: int, minute: int, after: float):
+    """
+    Prochaine occurrence (epoch, heure locale) strictement après `after`.
+    """
+    base = datetime.fromtimestamp(after)
+    for offset in range(8):
+        day = (base + timedelta(days=offset)).replace(
+            hour=hour, minute=minute, second=0, microsecond=0
+        )
+        if day.weekday() in days and day.timestamp() > after:
+            return day.timestamp()
+    return None
+
+
+class ScheduleStore(SqliteStore):
+    """
+    Plans hebdomadaires, dérogations et version de la programmation
+    (incrémentée à chaque modification, surveillée par le Scheduler).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS schedule_weekly (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            days TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            minute INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            created REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS schedule_overrides (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            at REAL NOT NULL,
+            action TEXT NOT NULL,
+            done INTEGER NOT NULL DEFAULT 0,
+            created REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS schedule_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            last_fired REAL
+        );
+        INSERT OR IGNORE INTO schedule_state (id, version, last_fired) VALUES (1, 0, NULL);
+    """
+
+    def _bump(self, conn):
+        conn.execute("UPDATE schedule_state SET version = version + 1 WHERE id = 1")
+
+    def version(self):
+        return self._conn().execute(
+            "SELECT version FROM schedule_state WHERE id = 1"
+        ).fetchone()[0]
+
+    def add_weekly(self, days, hour: int, minute: int, action: str) -> int:
+        with self._conn() as conn:
+            cur = conn.execute(
+                "INSERT INTO schedule_weekly (days, hour, minute, action, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (",".join(str(d) for d in days), hour, minute, action, time.time()),
+            )
+            self._bump(conn)
+            return cur.lastrowid
+
+    def add_override(self, at: float, action: str) -> int:
+        with self._conn() as conn:
+            cur = conn.execute(
+                "INSERT INTO schedule_overrides (at, action, created) VALUES (?, ?, ?)",
+                (at, action, time.time()),
+            )
+            self._bump(conn)
+            return cur.lastrowid
+
+    def delete(self, kind: str, entry_id: int) -> bool:
+        table = {"weekly": "schedule_weekly", "overrides": "schedule_overrides"}[kind]
+        with self._conn() as conn:
+            cur = conn.execute(f"DELETE FROM {table} WHERE id = ?", (entry_id,))
+            if cur.rowcount:
+                self._bump(conn)
+            return cur.rowcount > 0
+
+    def weekly(self):
+        rows = self._conn().execute(
+            "SELECT id, days, hour, minute, action FROM schedule_weekly ORDER BY hour, minute, id"
+        )
+        return [
+            {
+                "id": entry_id,
+                "days": [int(d) for d in days.split(",")],
+                "time": f"{hour:02d}:{minute:02d}",
+                "hour": hour,
+                "minute": minute,
+                "action": action,
+            }
+            for entry_id, days, hour, minute, action in rows
+        ]
+
+    def overrides(self, include_done: bool = False):
+        sql = "SELECT id, at, action, done FROM schedule_overrides"
+        if not include_done:
+            sql += " WHERE done = 0"
+        rows = self._conn().execute(sql + " ORDER BY at")
+        return [
+            {"id": entry_id, "at": at, "action": action, "done": bool(done)}
+            for entry_id, at, action, done in rows
+        ]
+
+    def mark_fired(self, fired_at: float, override_id: int = None):
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE schedule_state SET last_fired = MAX(COALESCE(last_fired, 0), ?) "
+                "WHERE id = 1",
+                (fired_at,),
+            )
+            if override_id is not None:
+                conn.execute(
+                    "UPDATE schedule_overrides SET done = 1 WHERE id = ?", (override_id,)
+                )
+
+    def expire_overrides(self, before: float) -> int:
+        """
+        Marque traitées les dérogations en attente antérieures à `before`
+        (rattrapées ou trop anciennes). Retourne leur nombre.
+        """
+        with self._conn() as conn:
+            cur = conn.execute(
+                "UPDATE schedule_overrides SET done = 1 WHERE done = 0 AND at < ?", (before,)
+            )
+            return cur.rowcount
+
+    def last_fired(self):
+        return self._conn().execute(
+            "SELECT last_fired FROM schedule_state WHERE id = 1"
+        ).fetchone()[0]
+
+    def upcoming(self, after: float, limit: int = 10):
+        """
+        Prochaines échéances (plans + dérogations) après `after`.
+        """
+        events = []
+        for entry in self.weekly():
+            at = after
+            for _ in range(limit):
+                at = next_weekly(entry["days"], entry["hour"], entry["minute"], at)
+                if at is None:
+                    break
+                events.append({"at": at, "action": entry["action"], "source": "weekly",
+                               "id": entry["id"]})
+        for entry in self.overrides():
+            if entry["at"] > after:
+                events.append({"at": entry["at"], "action": entry["action"],
+                               "source": "override", "id": entry["id"]})
+        events.sort(key=lambda e: e["at"])
+        return events[:limit]
+
+
+class Scheduler:
+    def __init__(self, store: ScheduleStore, submit, lock_path: str,
+                 catchup: float = 3600, check_interval: float = 10):
+        """
+        submit(action) : soumet une transition (Reconciler.submit)
+        catchup        : au démarrage du leader, applique la dernière échéance
+                         manquée si elle date de moins de `catchup` s
+        check_interval : période max entre deux vérifications de la version
+                         de la programmation (modifiée depuis un autre worker)
+        """
+        self.store = store
+        self.submit = submit
+        self.lock = ProcessLock(lock_path)
+        self.catchup = catchup
+        self.check_interval = check_interval
+        self.leader = False
+        self.fired = 0
+        self._heap = []
+        self._version = None
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """
+        Programmation modifiée dans ce worker : réévaluer tout de suite.
+        """
+        self._wake.set()
+
+    def stats(self):
+        return {
+            "leader": self.leader,
+            "fired": self.fired,
+            "next": self._heap[0][0] if self.leader and self._heap else None,
+        }
+
+    # ---------------------------
+    # Tas des échéances
+    # ---------------------------
+
+    def _rebuild(self, now: float):
+        self._version = self.store.version()
+        self._heap = []
+        for entry in self.store.weekly():
+            at = next_weekly(entry["days"], entry["hour"], entry["minute"], now)
+            if at is not None:
+                self._heap.append((at, "weekly", entry["id"], entry["action"], entry))
+        # Dérogations antérieures au dernier passage (rattrapage compris) :
+        # déjà résolues par _catch_up, jamais rejouées
+        horizon = min(now, self.store.last_fired() or now)
+        expired = self.store.expire_overrides(horizon)
+        if expired:
+            logging.info("Programmation : %s dérogation(s) périmée(s) ignorée(s)", expired)
+        for entry in self.store.overrides():
+            # Reste : échues depuis le dernier passage (latence du tick) ou à venir
+            self._heap.append((max(entry["at"], now), "override", entry["id"],
+                               entry["action"], entry))
+        heapq.heapify(self._heap)
+
+    def _catch_up(self, now: float):
+        """
+        Échéance la plus récente manquée pendant un arrêt du service.
+        """
+        last = self.store.last_fired()
+        if last is None:
+            self.store.mark_fired(now)
+            return
+        since = max(last, now - self.catchup)
+        missed = None
+        for entry in self.store.weekly():
+            at = next_weekly(entry["days"], entry["hour"], entry["minute"], since)
+            while at is not None and at <= now:
+                if missed is None or at > missed[0]:
+                    missed = (at, entry["action"], None)
+                at = next_weekly(entry["days"], entry["hour"], entry["minute"], at)
+        for entry in self.store.overrides():
+            if since < entry["at"] <= now and (missed is None or entry["at"] > missed[0]):
+                missed = (entry["at"], entry["action"], entry["id"])
+        if missed is not None:
+            at, action, override_id = missed
+            logging.info("Programmation : rattrapage de %s prévu à %s", action,
+                         datetime.fromtimestamp(at).isoformat(timespec="minutes"))
+            self._fire(action, now, override_id)
+        else:
+            self.store.mark_fired(now)
+
+    def _fire(self, action: str, now: float, override_id: int = None):
+        try:
+            queue = self.submit(action)
+            logging.info("Programmation : %s soumis (job=%s)", action, queue.get("job_id"))
+            self.fired += 1
+        except Exception:
+            logging.exception("Programmation : soumission de %s impossible", action)
+        self.store.mark_fired(now, override_id)
+
+    # ---------------------------
+    # Boucle
+    # ---------------------------
+
+    def _loop(self):
+        while not self.lock.acquire(blocking=False):
+            time.sleep(self.check_interval)
+        self.leader = True
+        logging.info("Programmation : ce worker exécute les échéances")
+        try:
+            self._catch_up(time.time())
+        except Exception:
+            logging.exception("Programmation : erreur de rattrapage")
+
+        while True:
+            try:
+                self._tick()
+            except Exception:
+                logging.exception("Programmation : erreur")
+                time.sleep(self.check_interval)
+
+    def _tick(self):
+        now = time.time()
+        if self._version != self.store.version():
+            self._rebuild(now)
+
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            at, kind, entry_id, action, entry = heapq.heappop(self._heap)
+            due.append((at, kind, entry_id, action))
+            if kind == "weekly":
+                nxt = next_weekly(entry["days"], entry["hour"], entry["minute"], now)
+                if nxt is not None:
+                    heapq.heappush(self._heap, (nxt, kind, entry_id, action, entry))
+
+        if due:
+            # Échéances simultanées : seule la dernière compte, les autres
+            # sont marquées traitées
+            for _, kind, entry_id, _ in due[:-1]:
+                if kind == "override":
+                    self.store.mark_fired(now, entry_id)
+            _, kind, entry_id, action = due[-1]
+            self._fire(action, now, entry_id if kind == "override" else None)
+
+        wait = self.check_interval
+        if self._heap:
+            wait = min(wait, max(0.0, self._heap[0][0] - time.time()))
+        self._wake.wait(wait)
+        self._wake.clear()
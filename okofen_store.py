@@ -0,0 +1,334 @@
+"""
+État partagé entre les workers gunicorn.
+
+- ProcessLock : verrou d'exécution inter-processus (flock sur un fichier),
+  doublé d'un verrou de thread pour les threads d'un même worker.
+- ResultStore : journal SQLite (append-only) des résultats de commandes,
+  lu par tous les workers pour /last et /results.
+- DesiredState : dernier état demandé (on/off) et numéro de séquence traité,
+  base de la coalescence des commandes (okofen_reconciler.py), et les jobs
+  (un par requête /on ou /off) suivis par /jobs/<id>.
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import sqlite3
+import threading
+
+
+class ProcessLock:
+    """
+    Verrou exclusif partagé par tous les processus qui ouvrent le même fichier.
+    Même interface que threading.Lock (acquire(blocking, timeout) / release).
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.05):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    def _open(self):
+        if self._fd is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        return self._fd
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        deadline = None
+        if blocking and timeout is not None and timeout >= 0:
+            deadline = time.monotonic() + timeout
+
+        if not blocking:
+            got = self._thread_lock.acquire(blocking=False)
+        elif deadline is None:
+            got = self._thread_lock.acquire()
+        else:
+            got = self._thread_lock.acquire(timeout=timeout)
+        if not got:
+            return False
+
+        fd = self._open()
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                pass
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                self._thread_lock.release()
+                return False
+            time.sleep(self.poll_interval)
+
+    def release(self):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SqliteStore:
+    """
+    Base commune : fichier SQLite partagé, une connexion par thread.
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _conn(self):
+        # Une connexion par thread (sqlite3 n'aime pas le partage entre threads)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+class ResultStore(SqliteStore):
+    """
+    Journal append-only des résultats, partagé entre processus (SQLite WAL).
+    Les N derniers résultats se lisent via la clé primaire (ORDER BY id DESC).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            action TEXT NOT NULL,
+            http_code INTEGER NOT NULL,
+            ok INTEGER NOT NULL,
+            status TEXT,
+            payload TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_results_action ON results (action, id);
+    """
+
+    def append(self, action: str, http_code: int, payload: dict) -> int:
+        with self._conn() as conn:
+            cur = conn.execute(
+                "INSERT INTO results (ts, action, http_code, ok, status, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    time.time(),
+                    action,
+                    http_code,
+                    1 if payload.get("ok") else 0,
+                    payload.get("status"),
+                    json.dumps(payload, ensure_ascii=False),
+                ),
+            )
+            return cur.lastrowid
+
+    def last(self, n: int = 1, action: str = None):
+        """
+        Retourne les n derniers résultats (plus récent en premier), sous forme
+        de dicts {"id", "ts", "http_code", "payload"}.
+        """
+        if action is None:
+            rows = self._conn().execute(
+                "SELECT id, ts, http_code, payload FROM results ORDER BY id DESC LIMIT ?",
+                (n,),
+            )
+        else:
+            rows = self._conn().execute(
+                "SELECT id, ts, http_code, payload FROM results "
+                "WHERE action = ? ORDER BY id DESC LIMIT ?",
+                (action, n),
+            )
+        return [
+            {"id": row[0], "ts": row[1], "http_code": row[2], "payload": json.loads(row[3])}
+            for row in rows
+        ]
+
+    def since(self, after_id: int, limit: int = 100):
+        """
+        Résultats d'id > after_id (plus ancien en premier), au plus `limit`,
+        avec l'action enregistrée ("batch" et "params" compris).
+        """
+        rows = self._conn().execute(
+            "SELECT id, ts, action, http_code, payload FROM results "
+            "WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id, limit),
+        )
+        return [
+            {
+                "id": row[0],
+                "ts": row[1],
+                "action": row[2],
+                "http_code": row[3],
+                "payload": json.loads(row[4]),
+            }
+            for row in rows
+        ]
+
+    def last_verified(self, max_age: float):
+        """
+        Dernier mode confirmé par une commande réussie ("on" / "off") datant
+        de moins de max_age secondes, sinon None.
+        """
+        row = self._conn().execute(
+            "SELECT status FROM results "
+            "WHERE ok = 1 AND status IN ('on', 'off') AND ts >= ? "
+            "AND json_extract(payload, '$.skipped') IS NULL "
+            "ORDER BY id DESC LIMIT 1",
+            (time.time() - max_age,),
+        ).fetchone()
+        return row[0] if row else None
+
+
+class DesiredState(SqliteStore):
+    """
+    Dernier état demandé, partagé entre workers.
+
+    Chaque demande incrémente `seq` ; `handled_seq` est le dernier numéro
+    traité. Toutes les demandes entre handled_seq et seq sont servies par une
+    seule exécution (celle de l'action la plus récente).
+
+    Chaque demande crée aussi un job (même transaction) : ses états sont
+    queued -> running -> done, et il reçoit le résultat de l'exécution qui
+    l'a servi.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS desired_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL,
+            action TEXT,
+            ts REAL,
+            handled_seq INTEGER NOT NULL,
+            coalesced INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO desired_state (id, seq, action, ts, handled_seq, coalesced)
+        VALUES (1, 0, NULL, NULL, 0, 0);
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            state TEXT NOT NULL,
+            created REAL NOT NULL,
+            started REAL,
+            finished REAL,
+            progress TEXT,
+            http_code INTEGER,
+            payload TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_seq ON jobs (state, seq);
+        CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created);
+    """
+
+    JOB_RETENTION = 24 * 3600
+
+    def submit(self, action: str):
+        """
+        Enregistre la demande et son job. Retourne (seq, job_id).
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE desired_state SET seq = seq + 1, action = ?, ts = ? WHERE id = 1",
+                (action, now),
+            )
+            seq = conn.execute("SELECT seq FROM desired_state WHERE id = 1").fetchone()[0]
+            conn.execute(
+                "INSERT INTO jobs (id, seq, action, state, created) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, seq, action, now),
+            )
+            conn.execute(
+                "DELETE FROM jobs WHERE state = 'done' AND created < ?",
+                (now - self.JOB_RETENTION,),
+            )
+        return seq, job_id
+
+    def pending(self):
+        """
+        (seq, action) de la demande la plus récente non traitée, sinon None.
+        """
+        seq, action, handled = self._conn().execute(
+            "SELECT seq, action, handled_seq FROM desired_state WHERE id = 1"
+        ).fetchone()
+        if seq <= handled:
+            return None
+        return seq, action
+
+    def mark_running(self, seq: int, progress: dict = None):
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'running', started = COALESCE(started, ?), progress = ? "
+                "WHERE state != 'done' AND seq <= ?",
+                (time.time(), json.dumps(progress or {}, ensure_ascii=False), seq),
+            )
+
+    def mark_handled(self, seq: int, http_code: int, payload: dict):
+        """
+        Marque les demandes <= seq comme traitées et termine leurs jobs avec
+        le résultat de l'exécution.
+        """
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE desired_state SET "
+                "coalesced = coalesced + MAX(0, ? - handled_seq - 1), "
+                "handled_seq = MAX(handled_seq, ?) WHERE id = 1",
+                (seq, seq),
+            )
+            conn.execute(
+                "UPDATE jobs SET state = 'done', finished = ?, http_code = ?, payload = ? "
+                "WHERE state != 'done' AND seq <= ?",
+                (time.time(), http_code, json.dumps(payload, ensure_ascii=False), seq),
+            )
+
+    def job(self, job_id: str):
+        row = self._conn().execute(
+            "SELECT id, seq, action, state, created, started, finished, progress, "
+            "http_code, payload FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job = {
+            "job_id": row[0],
+            "seq": row[1],
+            "action": row[2],
+            "state": row[3],
+            "created": row[4],
+            "started": row[5],
+            "finished": row[6],
+            "progress": json.loads(row[7]) if row[7] else None,
+            "http_code": row[8],
+            "result": json.loads(row[9]) if row[9] else None,
+        }
+        if job["result"] is not None:
+            # Servi par l'exécution d'une demande plus récente
+            job["coalesced"] = job["result"].get("seq") != job["seq"]
+        return job
+
+    def stats(self):
+        seq, action, handled, coalesced = self._conn().execute(
+            "SELECT seq, action, handled_seq, coalesced FROM desired_state WHERE id = 1"
+        ).fetchone()
+        return {
+            "desired": action,
+            "seq": seq,
+            "handled_seq": handled,
+            "queue_depth": seq - handled,
+            "coalesced": coalesced,
+        }
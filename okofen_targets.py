@@ -0,0 +1,123 @@
+"""
+Cibles pilotables : chaudières (une interface Pellematic chacune) et leurs
+circuits de chauffage (Chf1 à ChfN).
+
+Sans configuration, une seule chaudière "default" (OKOFEN_URL / OKOFEN_USER /
+OKOFEN_PASSWORD) avec le circuit 1 "Chauffage". Plusieurs chaudières se
+déclarent en JSON dans OKOFEN_BOILERS :
+
+    {"maison": {"url": "http://192.168.1.50", "circuits": {"1": "Chauffage",
+                "2": "Plancher"}, "max_concurrency": 1},
+     "atelier": {"url": "http://192.168.1.51", "user": "...", "password": "..."}}
+
+"circuits" associe le numéro du circuit à son nom affiché dans l'interface
+(lien "Chf2 Plancher", texte "Nom du circuitPlancher"). user / password
+valent par défaut OKOFEN_USER / OKOFEN_PASSWORD.
+
+Une cible s'écrit "<chaudière>/Chf<N>" ("maison/Chf2"), ou "Chf<N>" seul
+s'il n'y a qu'une chaudière.
+"""
+import os
+import re
+import json
+
+DEFAULT_BOILER = "default"
+DEFAULT_CIRCUITS = {"1": "Chauffage"}
+
+_TARGET_RE = re.compile(r"^(?:(?P<boiler>[\w.-]+)/)?chf(?P<circuit>\d+)$", re.IGNORECASE)
+
+
+class Boiler:
+    def __init__(self, boiler_id: str, url: str, user: str = None, password: str = None,
+                 circuits: dict = None, max_concurrency: int = 1):
+        self.id = boiler_id
+        self.url = (url or "").rstrip("/")
+        self.user = user or os.getenv("OKOFEN_USER")
+        self.password = password or os.getenv("OKOFEN_PASSWORD")
+        self.circuits = {str(k): v for k, v in (circuits or DEFAULT_CIRCUITS).items()}
+        # Sessions simultanées acceptées par l'interface de cette chaudière
+        self.max_concurrency = max(1, int(max_concurrency))
+
+    def targets(self):
+        return [f"{self.id}/Chf{n}" for n in sorted(self.circuits, key=int)]
+
+    def describe(self):
+        return {
+            "url": self.url,
+            "circuits": self.circuits,
+            "max_concurrency": self.max_concurrency,
+        }
+
+
+def load_boilers():
+    """
+    Chaudières configurées, par identifiant (ordre de déclaration).
+    Lève ValueError si OKOFEN_BOILERS est invalide.
+    """
+    raw = os.getenv("OKOFEN_BOILERS", "").strip()
+    if not raw:
+        return {
+            DEFAULT_BOILER: Boiler(DEFAULT_BOILER, os.getenv("OKOFEN_URL")),
+        }
+    try:
+        config = json.loads(raw)
+    except ValueError as e:
+        raise ValueError(f"OKOFEN_BOILERS n'est pas du JSON valide : {e}") from e
+    if not isinstance(config, dict) or not config:
+        raise ValueError("OKOFEN_BOILERS doit être un objet JSON non vide")
+
+    boilers = {}
+    for boiler_id, cfg in config.items():
+        if not isinstance(cfg, dict) or not cfg.get("url"):
+            raise ValueError(f"Chaudière {boiler_id!r} : \"url\" manquante")
+        boilers[boiler_id] = Boiler(
+            boiler_id,
+            cfg["url"],
+            user=cfg.get("user"),
+            password=cfg.get("password"),
+            circuits=cfg.get("circuits"),
+            max_concurrency=cfg.get("max_concurrency", 1),
+        )
+    return boilers
+
+
+def parse_target(target: str, boilers: dict):
+    """
+    "maison/Chf2" -> (Boiler, "2"). Lève ValueError si la cible est
+    inconnue ou mal formée.
+    """
+    m = _TARGET_RE.match(str(target).strip())
+    if m is None:
+        raise ValueError(f"Cible invalide : {target!r} (attendu <chaudière>/Chf<N>)")
+    boiler_id = m.group("boiler")
+    if boiler_id is None:
+        if len(boilers) != 1:
+            raise ValueError(f"Cible {target!r} ambiguë : préciser la chaudière")
+        boiler_id = next(iter(boilers))
+    boiler = boilers.get(boiler_id)
+    if boiler is None:
+        raise ValueError(f"Chaudière inconnue : {boiler_id!r}")
+    circuit = str(int(m.group("circuit")))
+    if circuit not in boiler.circuits:
+        raise ValueError(f"Circuit Chf{circuit} non déclaré pour {boiler_id!r}")
+    return boiler, circuit
+
+
+def default_target(boilers: dict):
+    """
+    Cible pilotée par Okofen_Playwright.py seul (/on, /off) : circuit 1 de
+    la chaudière OKOFEN_URL, si elle fait partie des chaudières déclarées.
+    """
+    url = (os.getenv("OKOFEN_URL") or "").rstrip("/")
+    for boiler in boilers.values():
+        if boiler.url == url and "1" in boiler.circuits:
+            return f"{boiler.id}/Chf1"
+    return None
+
+
+def normalize_target(target: str, boilers: dict):
+    """
+    Forme canonique d'une cible ("Chf2" -> "default/Chf2").
+    """
+    boiler, circuit = parse_target(target, boilers)
+    return f"{boiler.id}/Chf{circuit}"
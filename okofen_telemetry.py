@@ -0,0 +1,430 @@
+"""
+Télémétrie de la chaudière : échantillonnage périodique des températures,
+de la modulation, du niveau de pellets et du mode, via l'API JSON du chemin
+rapide (okofen_http.HttpDriver, sans Chromium).
+
+- RingBuffer : derniers échantillons bruts dans un fichier mmap de taille
+  fixe (TELEMETRY_RING_SIZE échantillons), écrit par un seul worker et lu
+  par tous. La mémoire ne grossit pas avec l'uptime.
+- TelemetryStore : agrégats (moyenne / min / max) par 5 min et par heure
+  dans SQLite, purgés au-delà de leur durée de rétention.
+- TelemetryPoller : thread d'échantillonnage. Un seul worker gunicorn
+  l'exécute (élection par verrou fichier, reprise si le leader meurt).
+
+Les clés lues se configurent dans TELEMETRY_KEYS (JSON) :
+    {"outdoor_temp": ["CAPPL:LOCAL.L_aussentemperatur_ist", 0.1], ...}
+soit nom -> [clé Pellematic, facteur d'échelle]. Les clés par défaut sont
+celles des Pellematic courantes ; à vérifier sur votre installation.
+"""
+import os
+import json
+import math
+import mmap
+import time
+import zlib
+import bisect
+import struct
+import logging
+import threading
+from array import array
+
+from okofen_store import ProcessLock, SqliteStore
+
+DEFAULT_KEYS = {
+    "outdoor_temp": ["CAPPL:LOCAL.L_aussentemperatur_ist", 0.1],
+    "boiler_temp": ["CAPPL:FA[0].L_kesseltemperatur", 0.1],
+    "flow_temp": ["CAPPL:LOCAL.L_hk[0].vorlauftemp_ist", 0.1],
+    "dhw_temp": ["CAPPL:LOCAL.L_ww[0].temp_ist", 0.1],
+    "modulation": ["CAPPL:FA[0].L_modulation", 1],
+    "pellet_level": ["CAPPL:LOCAL.L_pu[0].pelletsvorrat", 1],
+    "mode": ["CAPPL:LOCAL.hk[0].betriebsart[1]", 1],
+}
+
+# Pas des agrégats (s) -> rétention (s)
+ROLLUP_STEPS = {
+    300: 30 * 86400,
+    3600: 730 * 86400,
+}
+
+# Nombre max de points retournés par série
+MAX_POINTS = 5000
+
+
+def load_keys():
+    """
+    Champs échantillonnés : {nom: (clé, échelle)}. Lève ValueError si
+    TELEMETRY_KEYS est invalide.
+    """
+    raw = os.getenv("TELEMETRY_KEYS", "").strip()
+    if not raw:
+        config = DEFAULT_KEYS
+    else:
+        try:
+            config = json.loads(raw)
+        except ValueError as e:
+            raise ValueError(f"TELEMETRY_KEYS n'est pas du JSON valide : {e}") from e
+    keys = {}
+    for name, spec in config.items():
+        if isinstance(spec, str):
+            spec = [spec, 1]
+        keys[name] = (spec[0], float(spec[1]))
+    return keys
+
+
+class RingBuffer:
+    """
+    Tampon circulaire en colonnes (ts puis un champ par colonne, float64)
+    dans un fichier mmap. Valeur manquante = NaN.
+
+    En-tête : magic, crc des noms de champs, capacité, nb de champs,
+    position d'écriture, nombre d'échantillons.
+    """
+
+    MAGIC = 0x4F4B5231
+    HEADER = struct.Struct("<IIIIQQ")
+
+    def __init__(self, path: str, fields, capacity: int):
+        self.path = path
+        self.fields = list(fields)
+        self.capacity = max(1, int(capacity))
+        self.columns = 1 + len(self.fields)
+        self.size = self.HEADER.size + self.capacity * self.columns * 8
+        self._crc = zlib.crc32(",".join(self.fields).encode("utf-8"))
+        self._mm = None
+        self._data = None
+
+    # ---------------------------
+    # Écriture (worker leader)
+    # ---------------------------
+
+    def open_writer(self):
+        """
+        Ouvre le fichier en écriture, en le (ré)initialisant si sa taille ou
+        ses champs ne correspondent plus à la configuration.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            valid = os.fstat(fd).st_size == self.size
+            if valid:
+                with mmap.mmap(fd, self.size, prot=mmap.PROT_READ) as mm:
+                    valid = self._header_ok(mm)
+            if not valid:
+                logging.info("Télémétrie : initialisation du tampon %s", self.path)
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.size)
+            self._mm = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        if not valid:
+            self.HEADER.pack_into(
+                self._mm, 0, self.MAGIC, self._crc, self.capacity, len(self.fields), 0, 0
+            )
+        self._data = memoryview(self._mm)[self.HEADER.size:].cast("d")
+
+    def append(self, ts: float, values: dict):
+        _, _, _, _, head, count = self.HEADER.unpack_from(self._mm, 0)
+        self._data[head] = ts
+        for col, name in enumerate(self.fields, start=1):
+            value = values.get(name)
+            self._data[col * self.capacity + head] = math.nan if value is None else value
+        # En-tête mis à jour en dernier : un lecteur ne voit que des lignes complètes
+        self.HEADER.pack_into(
+            self._mm, 0, self.MAGIC, self._crc, self.capacity, len(self.fields),
+            (head + 1) % self.capacity, min(count + 1, self.capacity),
+        )
+
+    # ---------------------------
+    # Lecture (tous les workers)
+    # ---------------------------
+
+    def _header_ok(self, mm):
+        magic, crc, capacity, nfields, _, _ = self.HEADER.unpack_from(mm, 0)
+        return (
+            magic == self.MAGIC
+            and crc == self._crc
+            and capacity == self.capacity
+            and nfields == len(self.fields)
+        )
+
+    def read(self, start: float, end: float):
+        """
+        Échantillons de [start, end] dans l'ordre chronologique :
+        (ts: array, {champ: array}). Vide si le tampon n'existe pas encore.
+        """
+        empty = (array("d"), {name: array("d") for name in self.fields})
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return empty
+        try:
+            if os.fstat(fd).st_size != self.size:
+                return empty
+            with mmap.mmap(fd, self.size, prot=mmap.PROT_READ) as mm:
+                if not self._header_ok(mm):
+                    return empty
+                _, _, _, _, head, count = self.HEADER.unpack_from(mm, 0)
+                data = memoryview(mm)[self.HEADER.size:].cast("d")
+                try:
+                    first = (head - count) % self.capacity
+                    ts = self._column(data, 0, first, count)
+                    lo = bisect.bisect_left(ts, start)
+                    hi = bisect.bisect_right(ts, end)
+                    series = {
+                        name: self._column(data, col, first, count)[lo:hi]
+                        for col, name in enumerate(self.fields, start=1)
+                    }
+                    return ts[lo:hi], series
+                finally:
+                    data.release()
+        finally:
+            os.close(fd)
+
+    def _column(self, data, col: int, first: int, count: int):
+        base = col * self.capacity
+        out = array("d")
+        out.frombytes(data[base + first: base + min(first + count, self.capacity)].tobytes())
+        if first + count > self.capacity:
+            out.frombytes(data[base: base + first + count - self.capacity].tobytes())
+        return out
+
+    def oldest(self):
+        """
+        Horodatage du plus ancien échantillon du tampon (None si vide).
+        """
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(self.HEADER.size)
+                if len(header) != self.HEADER.size or not self._header_ok(header):
+                    return None
+                _, _, _, _, head, count = self.HEADER.unpack(header)
+                if not count:
+                    return None
+                f.seek(self.HEADER.size + ((head - count) % self.capacity) * 8)
+                return struct.unpack("<d", f.read(8))[0]
+        except (OSError, struct.error):
+            return None
+
+
+class TelemetryStore(SqliteStore):
+    """
+    Agrégats par pas (ROLLUP_STEPS), une ligne par (pas, champ, début de
+    tranche). Une tranche écrite en deux fois (changement de leader) est
+    fusionnée.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS telemetry_rollups (
+            step INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            avg REAL NOT NULL,
+            min REAL NOT NULL,
+            max REAL NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (step, name, bucket)
+        );
+    """
+
+    def write(self, step: int, bucket: int, aggregates: dict):
+        """
+        aggregates : {champ: [somme, min, max, n]}
+        """
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO telemetry_rollups (step, name, bucket, avg, min, max, n) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (step, name, bucket) DO UPDATE SET "
+                "avg = (avg * n + excluded.avg * excluded.n) / (n + excluded.n), "
+                "min = MIN(min, excluded.min), max = MAX(max, excluded.max), "
+                "n = n + excluded.n",
+                [
+                    (step, name, bucket, total / n, lo, hi, n)
+                    for name, (total, lo, hi, n) in aggregates.items()
+                    if n
+                ],
+            )
+
+    def query(self, step: int, start: float, end: float):
+        """
+        {champ: [(bucket, avg, min, max, n), ...]} pour les tranches de [start, end].
+        """
+        rows = self._conn().execute(
+            "SELECT name, bucket, avg, min, max, n FROM telemetry_rollups "
+            "WHERE step = ? AND bucket >= ? AND bucket <= ? ORDER BY name, bucket",
+            (step, int(start // step * step), end),
+        )
+        out = {}
+        for name, bucket, avg, lo, hi, n in rows:
+            out.setdefault(name, []).append((bucket, avg, lo, hi, n))
+        return out
+
+    def prune(self, now: float = None):
+        now = now or time.time()
+        with self._conn() as conn:
+            for step, retention in ROLLUP_STEPS.items():
+                conn.execute(
+                    "DELETE FROM telemetry_rollups WHERE step = ? AND bucket < ?",
+                    (step, now - retention),
+                )
+
+
+class _Rollup:
+    """
+    Agrégat en cours pour un pas ; écrit dans le store à chaque changement
+    de tranche.
+    """
+
+    def __init__(self, step: int, store: TelemetryStore):
+        self.step = step
+        self.store = store
+        self.bucket = None
+        self.values = {}
+
+    def add(self, ts: float, values: dict):
+        bucket = int(ts // self.step * self.step)
+        if self.bucket is not None and bucket != self.bucket:
+            self.flush()
+        self.bucket = bucket
+        for name, value in values.items():
+            agg = self.values.get(name)
+            if agg is None:
+                self.values[name] = [value, value, value, 1]
+            else:
+                agg[0] += value
+                agg[1] = min(agg[1], value)
+                agg[2] = max(agg[2], value)
+                agg[3] += 1
+
+    def flush(self):
+        if self.bucket is not None and self.values:
+            self.store.write(self.step, self.bucket, self.values)
+        self.values = {}
+
+
+def _downsample(points, start: float, step: float):
+    """
+    points : itérable de (ts, valeur, poids). Retourne [[ts, moyenne], ...]
+    par tranches de `step` alignées sur `start`.
+    """
+    buckets = {}
+    for ts, value, weight in points:
+        if math.isnan(value):
+            continue
+        index = int((ts - start) // step)
+        acc = buckets.setdefault(index, [0.0, 0])
+        acc[0] += value * weight
+        acc[1] += weight
+    return [
+        [round(start + index * step, 3), round(total / weight, 3)]
+        for index, (total, weight) in sorted(buckets.items())
+    ]
+
+
+def query_series(ring: RingBuffer, store: TelemetryStore, start: float, end: float,
+                 step: float):
+    """
+    Séries moyennées par `step` sur [start, end]. Pour un pas fin, seuls
+    les échantillons bruts du tampon sont utilisés ; sinon les agrégats
+    SQLite du plus grand pas <= step, complétés par les échantillons bruts
+    à partir du début du tampon (tranche en cours pas encore agrégée).
+    Retourne (source, {champ: [[ts, valeur], ...]}).
+    """
+    rollup_step = max((s for s in ROLLUP_STEPS if s <= step), default=None)
+    ts, columns = ring.read(start, end)
+    if rollup_step is None:
+        return "raw", {
+            name: _downsample(((t, v, 1) for t, v in zip(ts, values)), start, step)
+            for name, values in columns.items()
+        }
+
+    oldest = ring.oldest()
+    cutoff = math.inf if oldest is None else math.ceil(oldest / rollup_step) * rollup_step
+    rows = store.query(rollup_step, start, min(end, cutoff - 1))
+    first_raw = bisect.bisect_left(ts, cutoff)
+    series = {}
+    for name in ring.fields:
+        points = [(r[0], r[1], r[4]) for r in rows.get(name, [])]
+        values = columns.get(name, array("d"))
+        points.extend((ts[i], values[i], 1) for i in range(first_raw, len(ts)))
+        series[name] = _downsample(points, start, step)
+    return f"rollup_{rollup_step}s", series
+
+
+class TelemetryPoller:
+    def __init__(self, ring: RingBuffer, store: TelemetryStore, keys: dict,
+                 interval: float, lock_path: str, driver_factory, metrics=None):
+        """
+        keys           : {champ: (clé Pellematic, échelle)} (load_keys())
+        driver_factory : crée le client de lecture (okofen_http.HttpDriver)
+        metrics        : okofen_metrics.Metrics (optionnel)
+        """
+        self.ring = ring
+        self.store = store
+        self.keys = keys
+        self.interval = interval
+        self.lock = ProcessLock(lock_path)
+        self.driver_factory = driver_factory
+        self.metrics = metrics
+        self.leader = False
+        self.last_sample = None
+        self._rollups = [_Rollup(step, store) for step in sorted(ROLLUP_STEPS)]
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="telemetry", daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        return {
+            "interval_s": self.interval,
+            "leader": self.leader,
+            "fields": list(self.keys),
+            "last_sample_age_s": (
+                round(time.time() - self.last_sample, 1) if self.last_sample else None
+            ),
+        }
+
+    def _loop(self):
+        # Un seul échantillonneur tous workers confondus ; les autres
+        # retentent régulièrement au cas où le leader disparaîtrait
+        while not self.lock.acquire(blocking=False):
+            time.sleep(self.interval)
+        self.leader = True
+        logging.info("Télémétrie : ce worker échantillonne (pid=%s)", os.getpid())
+        self.ring.open_writer()
+        driver = self.driver_factory()
+        last_prune = 0.0
+        while True:
+            try:
+                self.sample(driver)
+            except Exception as e:
+                logging.warning("Télémétrie : échantillon impossible (%s)", e)
+                if self.metrics is not None:
+                    self.metrics.inc("okofen_telemetry_errors_total")
+            now = time.time()
+            if now - last_prune >= 3600:
+                last_prune = now
+                self.store.prune(now)
+            # Échantillons alignés sur l'intervalle
+            time.sleep(self.interval - (time.time() % self.interval))
+
+    def sample(self, driver):
+        raw = driver.read_values([key for key, _ in self.keys.values()])
+        ts = time.time()
+        values = {}
+        for name, (key, scale) in self.keys.items():
+            try:
+                values[name] = float(raw[key]) * scale
+            except (KeyError, TypeError, ValueError):
+                continue
+        self.ring.append(ts, values)
+        for rollup in self._rollups:
+            rollup.add(ts, values)
+        self.last_sample = ts
+        if self.metrics is not None:
+            self.metrics.inc("okofen_telemetry_samples_total")
+        return values
@@ -0,0 +1,97 @@
+"""
+Traces détaillées des dernières exécutions (GET /traces).
+
+Pendant une commande, app.py collecte dans un RunTrace tous les événements
+du driver : phases, état lu, erreurs et journaux ("log", au niveau
+DRIVER_LOG_LEVEL). À la fin, la trace est écrite dans un anneau de taille
+fixe (TraceRing) : TRACE_RING_SIZE emplacements réutilisés en boucle, donc
+aucune croissance quel que soit le nombre de commandes. L'anneau est dans
+la base SQLite partagée pour que tous les workers gunicorn voient les mêmes
+exécutions.
+"""
+import json
+import time
+
+from okofen_store import SqliteStore
+
+# Événements gardés par exécution (les suivants sont seulement comptés)
+MAX_TRACE_EVENTS = 500
+
+
+class RunTrace:
+    def __init__(self, action: str, run_id: str = None, max_events: int = MAX_TRACE_EVENTS):
+        self.action = action
+        self.run_id = run_id
+        self.started = time.time()
+        self.max_events = max_events
+        self.events = []
+        self.dropped = 0
+        self.tail = []
+
+    def add(self, event: dict):
+        if len(self.events) < self.max_events:
+            self.events.append(event)
+        else:
+            self.dropped += 1
+
+    def to_dict(self, http_code: int, payload: dict):
+        return {
+            "action": self.action,
+            "run_id": self.run_id,
+            "started": self.started,
+            "duration_ms": payload.get("duration_ms"),
+            "http_code": http_code,
+            "ok": bool(payload.get("ok")),
+            "status": payload.get("status"),
+            "error_code": payload.get("error_code"),
+            "events": self.events,
+            "dropped_events": self.dropped,
+            "tail": self.tail,
+        }
+
+
+class TraceRing(SqliteStore):
+    """
+    Anneau des `size` dernières traces : la trace n° seq occupe
+    l'emplacement seq % size.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS traces (
+            slot INTEGER PRIMARY KEY,
+            seq INTEGER NOT NULL,
+            ts REAL NOT NULL,
+            trace TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: str, size: int = 20):
+        super().__init__(path)
+        self.size = max(1, size)
+
+    def append(self, trace: dict) -> int:
+        with self._conn() as conn:
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM traces").fetchone()[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO traces (slot, seq, ts, trace) VALUES (?, ?, ?, ?)",
+                (seq % self.size, seq, time.time(), json.dumps(trace, ensure_ascii=False)),
+            )
+            return seq
+
+    def last(self, n: int = None):
+        """
+        Traces les plus récentes d'abord (au plus `size`).
+        """
+        rows = self._conn().execute(
+            "SELECT seq, ts, trace FROM traces ORDER BY seq DESC LIMIT ?",
+            (min(n or self.size, self.size),),
+        )
+        return [{"id": seq, "ts": ts, **json.loads(trace)} for seq, ts, trace in rows]
+
+    def get(self, seq: int):
+        row = self._conn().execute(
+            "SELECT seq, ts, trace FROM traces WHERE seq = ?", (seq,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "ts": row[1], **json.loads(row[2])}
@@ -0,0 +1,77 @@
+"""
+Captures d'échec (okofen_artifacts.py) : masquage des traces Playwright.
+"""
+import os
+import json
+import stat
+import zipfile
+
+import pytest
+
+from okofen_artifacts import ArtifactStore, new_run_id, REDACTED
+
+PASSWORD = "s3cret-pellematic"
+
+
+def _resource(url, method="GET", post=None, headers=(), cookies=()):
+    request = {
+        "url": url,
+        "method": method,
+        "headers": [{"name": k, "value": v} for k, v in headers],
+        "cookies": [{"name": k, "value": v} for k, v in cookies],
+    }
+    if post is not None:
+        request["postData"] = post
+    return {"type": "resource-snapshot", "snapshot": {"request": request, "response": {}}}
+
+
+def _write_trace(path, events, resources=None):
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("trace.network", "\n".join(json.dumps(e) for e in events))
+        z.writestr("trace.trace", json.dumps({"type": "before", "callId": "call@1"}))
+        for name, data in (resources or {}).items():
+            z.writestr(f"resources/{name}", data)
+
+
+def test_login_post_and_session_redacted(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    path = store.path(new_run_id(), "trace.zip")
+    body = f"username=admin&password={PASSWORD}&language=fr&submit=Login"
+    _write_trace(path, [
+        # Formulaire de login.cgi posté vers index.cgi, corps stocké à part
+        _resource("http://okofen/index.cgi", "POST",
+                  post={"mimeType": "application/x-www-form-urlencoded", "_sha1": "abc.dat"}),
+        _resource("http://okofen/index.cgi", "POST", post=body),
+        _resource("http://okofen/?action=get&attr=1",
+                  headers=[("Cookie", "session=xyz"), ("Accept", "*/*")],
+                  cookies=[("session", "xyz")]),
+    ], resources={"abc.dat": body, "page.html": "<html></html>"})
+
+    store.redact_trace(path)
+
+    with zipfile.ZipFile(path) as z:
+        names = z.namelist()
+        network = z.read("trace.network").decode("utf-8")
+    assert "resources/abc.dat" not in names
+    assert "resources/page.html" in names
+    assert PASSWORD not in network and "xyz" not in network
+    events = [json.loads(line) for line in network.splitlines()]
+    assert events[0]["snapshot"]["request"]["postData"]["text"] == REDACTED
+    assert events[1]["snapshot"]["request"]["postData"] == REDACTED
+    request = events[2]["snapshot"]["request"]
+    assert request["headers"] == [
+        {"name": "Cookie", "value": REDACTED}, {"name": "Accept", "value": "*/*"},
+    ]
+    assert request["cookies"] == [{"name": "session", "value": REDACTED}]
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_unreadable_trace_removed(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    path = store.path(new_run_id(), "trace.zip")
+    with open(path, "wb") as f:
+        f.write(f"password={PASSWORD}".encode("utf-8"))
+
+    with pytest.raises(zipfile.BadZipFile):
+        store.redact_trace(path)
+    assert not os.path.exists(path)
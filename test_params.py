@@ -0,0 +1,37 @@
+"""
+Paramètres (okofen_params.py) : validation des valeurs demandées.
+"""
+import pytest
+
+from okofen_params import load_params, validate
+
+
+@pytest.fixture
+def params(monkeypatch):
+    monkeypatch.delenv("OKOFEN_PARAMS", raising=False)
+    return load_params()[1]
+
+
+def test_number_rounded_to_step(params):
+    changes, errors = validate({"comfort_temp": "20,3", "hot_water_mode": "Marche"}, params)
+    assert errors == []
+    assert changes == [
+        {"field": "comfort_temp", "value": 20.5},
+        {"field": "hot_water_mode", "value": "on"},
+    ]
+
+
+def test_out_of_range_and_unknown_field(params):
+    changes, errors = validate({"comfort_temp": 45, "boost": 1}, params)
+    assert changes == []
+    assert errors == [
+        {"field": "comfort_temp", "error": "hors plage [10, 30]"},
+        {"field": "boost", "error": "champ inconnu"},
+    ]
+
+
+@pytest.mark.parametrize("value", ["inf", "-inf", "nan", "1e400", float("inf"), float("nan")])
+def test_non_finite_number_rejected(params, value):
+    changes, errors = validate({"comfort_temp": value}, params)
+    assert changes == []
+    assert errors == [{"field": "comfort_temp", "error": "nombre attendu"}]
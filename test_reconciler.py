@@ -0,0 +1,40 @@
+"""
+Réconciliateur (okofen_reconciler.py) : exécution en échec.
+"""
+from okofen_reconciler import Reconciler
+from okofen_store import DesiredState, ProcessLock
+
+
+def test_execute_exception_finishes_request(tmp_path):
+    desired = DesiredState(str(tmp_path / "okofen.sqlite3"))
+    recorded = []
+    calls = []
+
+    def execute(action, progress):
+        calls.append(action)
+        raise ConnectionError("Réponse vide du driver")
+
+    reconciler = Reconciler(
+        desired,
+        ProcessLock(str(tmp_path / "command.lock")),
+        execute=execute,
+        record=lambda action, http_code, payload: recorded.append((action, http_code, payload)),
+        verified_status=lambda: None,
+    )
+    job_id = reconciler.submit("on")["job_id"]
+
+    assert reconciler._reconcile_once() is True
+    # Demande traitée : pas de nouvelle exécution au passage suivant
+    assert reconciler._reconcile_once() is False
+    assert calls == ["on"]
+    assert desired.pending() is None
+
+    [(action, http_code, payload)] = recorded
+    assert (action, http_code) == ("on", 500)
+    assert payload["error_code"] == "execution_error"
+    assert payload["error_message"] == "Réponse vide du driver"
+
+    job = desired.job(job_id)
+    assert job["state"] == "done"
+    assert job["http_code"] == 500
+    assert job["result"]["ok"] is False
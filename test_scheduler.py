@@ -0,0 +1,55 @@
+"""
+Programmation (okofen_scheduler.py) : rattrapage au redémarrage.
+"""
+import time
+
+from okofen_scheduler import ScheduleStore, Scheduler
+
+
+def _scheduler(tmp_path, submitted):
+    store = ScheduleStore(str(tmp_path / "schedule.sqlite3"))
+
+    def submit(action):
+        submitted.append(action)
+        return {"job_id": f"job-{len(submitted)}"}
+
+    scheduler = Scheduler(store, submit, str(tmp_path / "scheduler.lock"),
+                          catchup=3600, check_interval=0.01)
+    return store, scheduler
+
+
+def test_restart_ignores_stale_overrides(tmp_path):
+    submitted = []
+    store, scheduler = _scheduler(tmp_path, submitted)
+    now = time.time()
+    # Service arrêté depuis deux jours, deux dérogations manquées
+    store.mark_fired(now - 2 * 86400)
+    stale = store.add_override(now - 86400, "on")
+    recent = store.add_override(now - 60, "off")
+
+    scheduler._catch_up(now)
+    scheduler._tick()
+    scheduler._tick()
+
+    # Seule la plus récente (dans l'horizon de rattrapage) est appliquée
+    assert submitted == ["off"]
+    done = {entry["id"]: entry["done"] for entry in store.overrides(include_done=True)}
+    assert done == {stale: True, recent: True}
+    assert scheduler._heap == []
+
+
+def test_future_override_still_fires(tmp_path):
+    submitted = []
+    store, scheduler = _scheduler(tmp_path, submitted)
+    now = time.time()
+    store.mark_fired(now - 2 * 86400)
+    store.add_override(now - 86400, "on")
+    store.add_override(now + 0.05, "off")
+
+    scheduler._catch_up(now)
+    scheduler._tick()
+    time.sleep(0.1)
+    scheduler._tick()
+
+    assert submitted == ["off"]
+    assert store.overrides() == []